@@ -0,0 +1,260 @@
+"""
+Acquisition from several monitors in one process.
+
+MultiMonitorAcquisition drives one PhilipsTelemetryStream per serial port, each
+with its own decoder, distiller, keep-alive timer and sampled data buffers,
+from a single selector loop (epoll on Linux): a port is read as soon as it is
+readable, so one process (and one core) serves every bed of the box.
+
+The association handshakes are blocking, so they run (as do reconnects) on
+their own daemon threads; a stream joins the selector once it is polling and
+leaves it while it reconnects, so a monitor that stops answering never stalls
+the others. Selectors need file descriptors, so this runs on POSIX only.
+
+Usage: python Acquisition.py --ports /dev/ttyUSB0 /dev/ttyUSB1 [--values Pleth 128 II 512]
+       python Acquisition.py --simulate 8 [--speed 1]
+"""
+
+from __future__ import unicode_literals, division
+
+import argparse
+import collections
+import logging
+import multiprocessing as mp
+import selectors
+import socket
+import threading
+import time
+
+from PhilipsTelemetryStream import PhilipsTelemetryStream
+
+
+class MultiMonitorAcquisition(object):
+    # Multiplexes the serial ports of several telemetry streams (see module docstring).
+    # callback(stream, data) is called with every published result.
+
+    def __init__(self, streams, callback=None):
+        self.streams = list(streams)
+        self.callback = callback
+
+        for stream in self.streams:
+            if stream.reader_thread:
+                raise ValueError('{0}: streams are read by the selector, not a reader thread'.format(stream.port))
+
+        self.selector = selectors.DefaultSelector()
+
+        # Handshake threads hand opened streams over through a deque, and wake
+        # up the selector through a socket pair
+        self.opened = collections.deque()
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.wakeup_r.setblocking(False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, None)
+
+        self.stats = {stream.port: collections.Counter() for stream in self.streams}
+        self.last_report = time.monotonic()
+        self.last_cpu = time.process_time()
+        self.running = False
+
+    # Starts the handshake of every stream
+    def open(self):
+        for stream in self.streams:
+            self.connect(stream)
+
+    # Opens a stream on a thread of its own, then hands it to the selector loop
+    def connect(self, stream, reconnect=False):
+        def handshake():
+            if reconnect:
+                try:
+                    stream.close()
+                except (IOError, AttributeError):
+                    logging.error('{0}: ignoring error closing connection'.format(stream.port))
+            stream.open()
+            self.opened.append(stream)
+            self.wakeup_w.send(b'\x00')
+
+        threading.Thread(target=handshake, name='Open {0}'.format(stream.port), daemon=True).start()
+
+    # Registers streams whose handshake has finished
+    def attach(self):
+        try:
+            while self.wakeup_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        while self.opened:
+            stream = self.opened.popleft()
+            self.selector.register(stream.rs232, selectors.EVENT_READ, stream)
+            logging.info('{0}: polling'.format(stream.port))
+
+    # Takes a stream out of the loop and opens it again
+    def reconnect(self, stream):
+        logging.error('{0}: resetting connection'.format(stream.port))
+        self.selector.unregister(stream.rs232)
+        self.stats[stream.port]['reconnects'] += 1
+        self.connect(stream, reconnect=True)
+
+    # Streams currently polled by the selector loop
+    def active(self):
+        return [key.data for key in list(self.selector.get_map().values()) if key.data is not None]
+
+    # Sends due keep-alives, reconnects timed out streams, returns seconds until the next deadline
+    def check_timers(self, timeout):
+        now = time.time()
+
+        for stream in self.active():
+            if (now - stream.last_keep_alive) > (stream.KeepAliveTime - 5):
+                stream.submit_keep_alive()
+
+            if (now - stream.last_read_time) > stream.timeout:
+                logging.error('{0}: data stream timed out'.format(stream.port))
+                self.reconnect(stream)
+                continue
+
+            timeout = min(timeout,
+                          stream.last_keep_alive + stream.KeepAliveTime - 5 - now,
+                          stream.last_read_time + stream.timeout - now)
+
+        return max(0, timeout)
+
+    # Decodes and publishes everything a readable stream received
+    def service(self, stream):
+        start = time.perf_counter()
+        stats = self.stats[stream.port]
+
+        try:
+            batch = stream.rs232.receiveReadable()
+            data = stream.handle_batch(batch)
+        except IOError:
+            self.reconnect(stream)
+            return
+
+        stats['frames'] += len(batch)
+        stats['bytes'] += sum(len(message) for arrival, message in batch)
+
+        if data:
+            data = stream.publish(data)
+            stats['results'] += 1
+            if self.callback:
+                self.callback(stream, data)
+
+        stats['busy'] += time.perf_counter() - start
+
+    # One pass of the selector loop (waits at most timeout seconds)
+    def step(self, timeout=1.0):
+        timeout = self.check_timers(timeout)
+
+        for key, events in self.selector.select(timeout):
+            if key.data is None:
+                self.attach()
+            elif key.data in self.active():
+                self.service(key.data)
+
+    def run(self):
+        self.open()
+        self.running = True
+        while self.running:
+            self.step()
+
+    def close(self):
+        self.running = False
+
+        for stream in self.active():
+            self.selector.unregister(stream.rs232)
+            try:
+                stream.close()
+            except IOError:
+                logging.error('{0}: ignoring IOError closing connection'.format(stream.port))
+
+        self.selector.close()
+        self.wakeup_r.close()
+        self.wakeup_w.close()
+
+    # Per port rates since the previous call
+    def throughput(self):
+        """
+        returns: rates - {port: {'frames/s', 'kB/s', 'results/s', 'busy',
+                 'reconnects', and the totals of the stream's counters}}, plus
+                 'cpu', the share of one core used by the whole process
+        """
+        now = time.monotonic()
+        cpu = time.process_time()
+        elapsed = max(now - self.last_report, 1e-9)
+
+        rates = {}
+        for stream in self.streams:
+            stats = self.stats[stream.port]
+            rates[stream.port] = dict(stream.read_counters(),
+                                      **{'frames/s': stats['frames'] / elapsed,
+                                         'kB/s': stats['bytes'] / elapsed / 1e3,
+                                         'results/s': stats['results'] / elapsed,
+                                         'busy': stats['busy'] / elapsed,
+                                         'reconnects': stats['reconnects']})
+            for key in ['frames', 'bytes', 'results', 'busy']:
+                stats[key] = 0
+
+        rates['cpu'] = (cpu - self.last_cpu) / elapsed
+        self.last_report = now
+        self.last_cpu = cpu
+
+        return rates
+
+
+# Runs simulated monitors until stop is set (in a process of their own, so
+# they do not share a core with the acquisition)
+def simulate_monitors(count, speed, ports, stop):
+    from IntellivueProtocol.IntellivueSimulator import IntellivueSimulator
+
+    simulators = [IntellivueSimulator(speed=speed) for i in range(count)]
+    ports.put([simulator.start() for simulator in simulators])
+    stop.wait()
+
+    for simulator in simulators:
+        simulator.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Acquisition from several monitors in one process')
+    parser.add_argument('--ports', nargs='+', default=[], help='serial ports, one per monitor')
+    parser.add_argument('--values', nargs='+', default=['Pleth', 128, 'II', 512],
+                        help="paired value names and frequencies to buffer, e.g. 'Pleth 128 II 512'")
+    parser.add_argument('--simulate', type=int, default=0, help='number of simulated monitors to add')
+    parser.add_argument('--speed', type=float, default=1.0, help='data rate of simulated monitors')
+    parser.add_argument('--report', type=float, default=5.0, help='seconds between throughput reports')
+    opts = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    ports = list(opts.ports)
+    stop = mp.Event()
+    if opts.simulate:
+        queue = mp.Queue()
+        simulators = mp.Process(target=simulate_monitors, args=(opts.simulate, opts.speed, queue, stop), daemon=True)
+        simulators.start()
+        ports += queue.get()
+
+    streams = [PhilipsTelemetryStream(port=port, values=opts.values, fused_waves=True) for port in ports]
+    acquisition = MultiMonitorAcquisition(streams)
+    acquisition.open()
+
+    try:
+        next_report = time.monotonic() + opts.report
+        while 1:
+            acquisition.step(max(0, next_report - time.monotonic()))
+
+            if time.monotonic() >= next_report:
+                next_report += opts.report
+                rates = acquisition.throughput()
+                for port in ports:
+                    print('{0:<14} {1[frames/s]:>7.1f} frames/s {1[kB/s]:>7.1f} kB/s {1[results/s]:>6.1f} results/s '
+                          '{1[busy]:>6.1%} busy {1[keep_alives]} keep-alives {1[reconnects]} reconnects '
+                          '{2} link errors {1[malformed_messages]} malformed {1[dropped_packets]} dropped packets'.format(
+                              port, rates[port],
+                              rates[port]['crcFailures'] + rates[port]['framingErrors'] + rates[port]['incompleteFrames']))
+                print('{0} monitors, {1:.0%} of one core'.format(len(acquisition.active()), rates['cpu']))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        acquisition.close()
+        stop.set()
@@ -0,0 +1,1031 @@
+"""
+Microbenchmarks for the RS232 framing and Intellivue decoding paths.
+
+Each benchmark compares the current implementation against the original
+reference implementation kept below, on synthesized wave frames.
+
+Usage: python -m IntellivueProtocol.Benchmark [transparency] [crc] [replay]
+                                              [simulator] [async] [counters]
+                                              [allocations] [decode] [startup]
+                                              [encode] [records] [corpus]
+                                              [primitives] [waves] [numerics]
+                                              [--capture FILE]
+                                              [--baseline FILE] [--save-baseline]
+
+--capture replays a session recorded with RS232(captureFile=...) instead of
+synthesized frames. replay times the receive path over a capture and checks
+that a reader thread idles once the capture is over. simulator streams from
+IntellivueSimulator at 1x, 2x, 5x and 10x real time and reports whether the
+receive path keeps up; async does the same with AsyncRS232 read from an
+asyncio event loop. counters polls a PhilipsTelemetryStream with logging
+disabled, as Main does, and checks that its periodic counter reports still
+reach the caller. allocations traces the memory allocated per wave frame by
+framing and decoding. decode times readData on each kind of poll result
+against walking DataTypes, and with only the attributes the distiller reads
+selected. startup times the construction of a decoder, with and without the
+nomenclature table cache. encode times writing the messages of a handshake,
+from templates or not. records compares the time and memory of poll results
+read as dicts and as PollRecords records. primitives checks the FLOAT,
+String, BCD and VariableLabel readers against the original ones on every
+value (every character, for Strings) and times them. waves compares wave
+results distilled into new arrays, then appended to SampledDataBuffers,
+against fused distillation straight into them, and times reading the windows
+of the buffers. numerics times distilling numerics and alarms results, and
+traces the memory held by a distiller over 72 hours of numerics at one
+result per second.
+
+corpus reads a corpus with every message type the decoder receives
+(synthesized, or the frames of --capture grouped by type) and reports
+messages/s, us/message and bytes allocated per type. With --baseline it is a
+regression gate: it exits with status 1 if a type got slower than the stored
+figures by more than TIME_TOLERANCE (or allocates more than
+ALLOCATION_TOLERANCE); --save-baseline stores the current figures instead.
+Times are scaled by a fixed pure Python workload timed in the same run, so a
+baseline carries over between machines roughly; corpus_baseline.json holds
+the figures of the synthesized corpus.
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+from IntellivueProtocol import IntellivueDecoder as decoderModule
+from IntellivueProtocol.Capture import CaptureWriter, readCapture
+from IntellivueProtocol.IntellivueDecoder import IntellivueDecoder, UINT16
+from IntellivueProtocol.IntellivueDistiller import IntellivueDistiller
+from IntellivueProtocol.IntellivueSimulator import IntellivueSimulator
+from IntellivueProtocol.PollRecords import readPollReply, pollReplyDict
+from IntellivueProtocol.RS232 import RS232, AsyncRS232, ReplayRS232
+from PhilipsTelemetryStream import PhilipsTelemetryStream
+from TelemetryStream import SampledDataBuffer
+
+
+# Original implementations, kept as a reference for the benchmarks
+def legacyWriteTransparencyCheck(message):
+    for i in range(1, len(message)-1):
+        if message[i] == 0xC0 or message[i] == 0xC1 or message[i] == 0x7D:
+            replace_byte = message[i] ^ 0x20
+            message[i] = 0x7D
+            message.insert(i+1, replace_byte)
+
+    return message
+
+
+def legacyReadTransparencyCheck(message):
+    if type(message) != bytearray:
+        message = bytearray(message)
+
+    indices = []
+
+    for i in range(0, len(message)-1):
+        if message[i] == 0x7D:
+            if message[i+1] == 0xC0 ^ 0x20:
+                indices.append((i, 192))
+            elif message[i+1] == 0xC1 ^ 0x20:
+                indices.append((i, 193))
+            elif message[i+1] == 0x7D ^ 0x20:
+                indices.append((i, 125))
+
+    sortedIndices = sorted(indices, reverse=True)
+
+    for value in sortedIndices:
+        if value[1] == 192:
+            message[value[0]:value[0]+2] = b'\xC0'
+        elif value[1] == 193:
+            message[value[0]:value[0]+2] = b'\xC1'
+        elif value[1] == 125:
+            message[value[0]:value[0]+2] = b'\x7D'
+
+    return bytes(message)
+
+
+def legacyGetCRC16(message, table):
+    fcs = 0xFFFF
+
+    if type(message) != bytearray:
+        message = bytearray(message)
+
+    for i in range(0, len(message)):
+        fcs = (fcs >> 8) ^ table[(fcs ^ message[i]) & 0xFF]
+
+    fcs = ~fcs & 0xFFFF
+
+    return struct.pack('<H', fcs)
+
+
+# Primitive readers of IntellivueDecoder as they were (decoder in place of self),
+# except that VariableLabel values are read from index (they were read from data[i:i+1],
+# the start of the message)
+def legacyReadVariableLabel(decoder, index, current_message_dict, data):
+    current_message_dict['VariableLabel'] = {}
+    current_message_dict['VariableLabel']['length'] = decoder.get16(data[index: index+2])
+    current_message_dict['VariableLabel']['value'] = []
+    index += 2
+
+    for i in range(current_message_dict['VariableLabel']['length']):
+
+        current_message_dict['VariableLabel']['value'].append(decoder.get8(data[index:index+1]))
+        index += 1
+
+    return index
+
+
+def legacyReadString(decoder, index, current_message_dict, data):
+    current_message_dict['String'] = {}
+    current_message_dict['String']['length'] = decoder.get16(data[index: index+2])
+
+    index += 2
+
+    byte_values = bytes(data[index:index+current_message_dict['String']['length']])
+    current_message_dict['String']['value'] = ''
+
+    for i in range(0, int(current_message_dict['String']['length']/2), 1):
+        temp = byte_values[2*i+1:2*i+2] + byte_values[2*i:2*i+1]
+        current_message_dict['String']['value'] += temp.decode('utf-16')
+
+    current_message_dict['String']['value'] = current_message_dict['String']['value'].split(' ')[0]
+
+    index += current_message_dict['String']['length']
+    return index
+
+
+def legacyReadFLOAT(decoder, index, current_message_dict, data):
+    current_message_dict['FLOATType'] = {}
+
+    if data[index+1:index+4] == b'\x7F\xFF\xFF':
+        current_message_dict['FLOATType'] = 'Not a number'
+
+    elif data[index+1:index+4] == b'\x80\x00\x00':
+        current_message_dict['FLOATType'] = 'Not at this resolution'
+
+    elif data[index+1:index+4] ==b'\x7F\xFF\xFE':
+        current_message_dict['FLOATType'] = 'Positive Infinity'
+
+    elif data[index+1:index+4] ==b'\x80\x00\x02':
+        current_message_dict['FLOATType'] = 'Negative Infinity'
+
+    else:
+        exponent = struct.unpack('>b',data[index:index+1])[0]
+        (num1, num2, num3) = struct.unpack('>BBB', data[index+1:index+4])
+        mantissa = (num1*65536)+(num2*256)+num3
+        if mantissa >= 0x800000:
+            mantissa -= 0x1000000
+
+        current_message_dict['FLOATType'] = mantissa * 10 ** exponent
+
+    index += 4
+
+    return index
+
+
+def legacyReadBCD(decoder, index, current_message_dict, data):
+    temp_value = decoder.get8(data[index:index+1])
+    temp_bin = '{0:08b}'.format(temp_value)
+    digit_one = int(temp_bin[0:4],2)
+    digit_two = int(temp_bin[4:8],2)
+    current_message_dict['century'] = int(str(digit_one) + str(digit_two))
+    return index + 1
+
+
+# readData walking DataTypes for every message, as before decode plans (poll results start at index 0)
+def legacyReadData(decoder, data):
+    message = {}
+    decoder.recurseRead(decoder.MessageLists[decoder.getMessageType(data)], 0, message, memoryview(data))
+    return message
+
+
+# Whether two decoded messages hold the same keys, in the same order, and values (wave samples are arrays)
+def sameDecode(a, b):
+    if isinstance(a, dict):
+        return (isinstance(b, dict) and list(a) == list(b)
+                and all(sameDecode(value, b[key]) for key, value in a.items()))
+    if isinstance(a, np.ndarray):
+        return isinstance(b, np.ndarray) and a.dtype == b.dtype and np.array_equal(a, b)
+    return type(a) == type(b) and a == b
+
+
+# RS232 instance without a serial port, for the framing methods
+def offlineRS232():
+    rs232 = RS232.__new__(RS232)
+    rs232.socket = None
+    rs232.setupConnection()
+    return rs232
+
+
+# Synthesized wave payloads (uint16 samples, so start/stop/escape bytes occur naturally)
+def waveMessages(count=200, size=1000, seed=0):
+    generator = random.Random(seed)
+    return [bytes(generator.getrandbits(8) for _ in range(size)) for _ in range(count)]
+
+
+def report(name, seconds, count, nbytes):
+    print('{0:<40} {1:>10.1f} us/frame {2:>10.2f} MB/s'.format(
+        name, 1e6 * seconds / count, nbytes / seconds / 1e6))
+
+
+def benchmarkTransparency(repeat=5):
+    rs232 = offlineRS232()
+    messages = waveMessages()
+    frames = [bytes(rs232.frameCheckWrite(message)) for message in messages]
+    payloads = [frame[1:-1] for frame in frames]
+    nbytes = sum(len(frame) for frame in frames)
+
+    # Byte stream as it arrives from the serial port, split into driver-sized reads
+    stream = b''.join(frames)
+    chunks = [stream[i:i+4096] for i in range(0, len(stream), 4096)]
+
+    def legacyRead():
+        for payload in payloads:
+            legacyReadTransparencyCheck(payload)
+
+    def currentRead():
+        for payload in payloads:
+            rs232.readTransparencyCheck(payload)
+
+    def streamingRead():
+        for chunk in chunks:
+            rs232.splitFrames(chunk)
+
+    def legacyWrite():
+        for message in messages:
+            legacyWriteTransparencyCheck(bytearray(b'\xC0') + message + bytearray(b'\xC1'))
+
+    def currentWrite():
+        for message in messages:
+            rs232.writeTransparencyCheck(bytearray(b'\xC0') + message + bytearray(b'\xC1'))
+
+    for name, function in [('readTransparencyCheck (original)', legacyRead),
+                           ('readTransparencyCheck', currentRead),
+                           ('splitFrames (unescape + FCS)', streamingRead),
+                           ('writeTransparencyCheck (original)', legacyWrite),
+                           ('writeTransparencyCheck', currentWrite)]:
+        seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+        report(name, seconds, len(frames), nbytes)
+
+
+def benchmarkCRC(repeat=5):
+    rs232 = offlineRS232()
+
+    for size in (16, 256, 1400):
+        messages = waveMessages(count=200, size=size)
+        nbytes = size * len(messages)
+
+        def legacyCRC():
+            for message in messages:
+                legacyGetCRC16(message, rs232.CRCTable)
+
+        def currentCRC():
+            for message in messages:
+                rs232.getCRC16(message)
+
+        for name, function in [('getCRC16 (original) {0} B'.format(size), legacyCRC),
+                               ('getCRC16 {0} B'.format(size), currentCRC)]:
+            seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+            report(name, seconds, len(messages), nbytes)
+
+    # Sending a constant message: framing on every call vs cached frame
+    message = waveMessages(count=1, size=40)[0]
+    rs232.cacheFrames([message])
+    count = 10000
+    for name, function in [('frameCheckWrite (per send)', lambda: rs232.frameCheckWrite(message)),
+                           ('frameCache lookup (per send)', lambda: rs232.frameCache.get(message))]:
+        seconds = min(timeit.repeat(function, number=count, repeat=repeat))
+        report(name, seconds, count, len(message) * count)
+
+
+# Writes synthesized wave frames to a capture file, in driver-sized reads
+def synthesizedCapture(path):
+    rs232 = offlineRS232()
+    stream = b''.join(bytes(rs232.frameCheckWrite(message)) for message in waveMessages())
+
+    capture = CaptureWriter(path)
+    arrival = time.monotonic_ns()
+    for i in range(0, len(stream), 4096):
+        capture.write(stream[i:i+4096], arrival + i * 1000)
+    capture.close()
+
+
+def benchmarkReplay(repeat=5, capture=None):
+    temporary = None
+    if capture is None:
+        descriptor, temporary = tempfile.mkstemp(suffix='.ivcap')
+        os.close(descriptor)
+        synthesizedCapture(temporary)
+        capture = temporary
+
+    try:
+        nbytes = sum(len(chunk) for arrival, chunk in readCapture(capture))
+        counts = []
+
+        # Whole receive path (capture -> framing -> messages) as fast as possible
+        def replay():
+            rs232 = ReplayRS232(capture, speed=None)
+            count = 0
+            while not rs232.finished:
+                count += len(rs232.receiveFrames())
+            counts.append(count)
+
+        seconds = min(timeit.repeat(replay, number=1, repeat=repeat))
+        report('ReplayRS232.receiveFrames ({0} frames)'.format(counts[-1]), seconds, max(counts[-1], 1), nbytes)
+
+        # Once the capture is over, the reader thread must idle as on a quiet port
+        rs232 = ReplayRS232(capture, readerThread=True, speed=None)
+        while not rs232.finished:
+            rs232.receiveBatch()
+            time.sleep(0.01)
+        cpu = time.process_time()
+        time.sleep(1.0)
+        cpu = time.process_time() - cpu
+        rs232.close()
+        if cpu > 0.1:
+            raise AssertionError('Reader thread busy after the replay: {0:.0%} CPU'.format(cpu))
+        print('{0:<40} {1:>10.1%} CPU'.format('reader thread after the replay', cpu))
+    finally:
+        if temporary:
+            os.remove(temporary)
+
+
+# Association, priority list and polls, as PhilipsTelemetryStream.open() does
+def simulatorSession(rs232, decoder, distiller):
+    rs232.send(decoder.writeData('AssociationRequest'))
+    messages = []
+    while len(messages) < 2:
+        messages += [frame for arrival, frame in rs232.receiveBatch()]
+        time.sleep(0.01)
+
+    event, parameters = decoder.readData(messages[1])
+    attributes = event['MDSCreateInfo']['MDSAttributeList']['AttributeList']['AVAType']
+    distiller.saveInitialTime(attributes['NOM_ATTR_TIME_ABS']['AttributeValue']['AbsoluteTime'],
+                              attributes['NOM_ATTR_TIME_REL']['AttributeValue']['RelativeTime'])
+    rs232.send(decoder.writeData('MDSCreateEventResult', parameters))
+    rs232.send(decoder.writeData('MDSSetPriorityListWAVE', {'TextIdLabel': ['II', 'Pleth']}))
+
+    dataCollection = {'RelativeTime': 72 * 60 * 60 * 8000}
+    for poll in ['MDSExtendedPollActionNUMERIC', 'MDSExtendedPollActionWAVE', 'MDSExtendedPollActionALARM']:
+        rs232.send(decoder.writeData(poll, dataCollection))
+
+
+# Receive -> decode -> distill figures of a simulator session
+class SessionStats(object):
+
+    def __init__(self, decoder, distiller):
+        self.decoder = decoder
+        self.distiller = distiller
+        self.received = 0
+        self.nbytes = 0
+        self.busy = 0
+        self.lag = 0
+
+    def process(self, batch):
+        begin = time.monotonic()
+        for arrival, message in batch:
+            if self.decoder.getMessageType(message) == 'MDSExtendedPollActionResult':
+                self.distiller.refine(self.decoder.readData(message))
+                self.received += 1
+                self.nbytes += len(message)
+            self.lag = max(self.lag, time.monotonic_ns() - arrival)
+        self.busy += time.monotonic() - begin
+
+    def report(self, speed, seconds, simulator, rs232):
+        sent = sum(simulator.stats[kind] for kind in ['NOM_MOC_VMO_METRIC_SA_RT', 'NOM_MOC_VMO_METRIC_NU',
+                                                     'NOM_MOC_VMO_AL_MON'])
+        print('{0:>4}x: {1:>5}/{2:<5} results received {3:>8.1f} kB/s {4:>6.1%} busy '
+              '{5:>8.1f} ms max lag {6} overflows {7} dropped frames'.format(
+                  speed, self.received, sent, self.nbytes / seconds / 1e3, self.busy / seconds, self.lag / 1e6,
+                  simulator.stats['overflows'], rs232.counters['droppedFrames']))
+
+
+def benchmarkSimulator(speeds=(1, 2, 5, 10), seconds=5.0):
+    for speed in speeds:
+        simulator = IntellivueSimulator(alarms=2, speed=speed)
+        simulator.start()
+        rs232 = RS232(simulator.port, readerThread=True)
+        decoder = IntellivueDecoder()
+        distiller = IntellivueDistiller()
+
+        try:
+            simulatorSession(rs232, decoder, distiller)
+
+            # Receive -> decode -> distill, as PhilipsTelemetryStream.batch_poll()
+            stats = SessionStats(decoder, distiller)
+            start = time.monotonic()
+            while time.monotonic() - start < seconds:
+                batch = rs232.receiveBatch()
+                stats.process(batch)
+                if not batch:
+                    time.sleep(0.005)
+        finally:
+            simulator.stop()
+            rs232.close()
+            simulator.close()
+
+        stats.report(speed, seconds, simulator, rs232)
+
+
+# Same as benchmarkSimulator(), the port read from an event loop once associated
+async def asyncSimulatorSession(speed, seconds):
+    simulator = IntellivueSimulator(alarms=2, speed=speed)
+    simulator.start()
+    rs232 = AsyncRS232(simulator.port)
+    decoder = IntellivueDecoder()
+    distiller = IntellivueDistiller()
+    loop = asyncio.get_running_loop()
+
+    try:
+        # The blocking handshake in a worker thread, as PhilipsTelemetryStream.aopen()
+        await loop.run_in_executor(None, simulatorSession, rs232, decoder, distiller)
+        rs232.attach(loop)
+
+        stats = SessionStats(decoder, distiller)
+        start = time.monotonic()
+        while time.monotonic() - start < seconds:
+            stats.process(await rs232.receiveBatchAsync(timeout=max(0, start + seconds - time.monotonic())))
+    finally:
+        rs232.detach()
+        simulator.stop()
+        rs232.close()
+        simulator.close()
+
+    stats.report(speed, seconds, simulator, rs232)
+
+
+def benchmarkAsync(speeds=(1, 2, 5, 10), seconds=5.0):
+    for speed in speeds:
+        asyncio.run(asyncSimulatorSession(speed, seconds))
+
+
+# Polls a simulated monitor with logging disabled, as Main does: the counter
+# dumps must still reach counters_report
+def benchmarkCounters(seconds=3.0, interval=0.5):
+    simulator = IntellivueSimulator(speed=5)
+    simulator.start()
+    reports = []
+    stream = PhilipsTelemetryStream(port=simulator.port, values=['Pleth', 128, 'II', 512], fused_waves=True,
+                                    counters_interval=interval, counters_report=reports.append)
+
+    logging.disable()
+    try:
+        stream.open()
+        start = time.monotonic()
+        while time.monotonic() - start < seconds:
+            stream.read(1)
+            time.sleep(stream.polling_interval)
+        stream.close()
+    finally:
+        logging.disable(logging.NOTSET)
+        simulator.stop()
+        simulator.close()
+
+    if len(reports) < seconds / interval - 1:
+        raise AssertionError('{0} counter reports in {1} s with logging disabled'.format(len(reports), seconds))
+    print('{0} counter reports, the last: {1}'.format(len(reports), reports[-1]))
+
+
+# Poll results of each kind (by OIDType) as sent by the simulated monitor
+def simulatedPollResults(count=100):
+    simulator = IntellivueSimulator(alarms=3)
+    try:
+        simulator.startTime = time.monotonic()
+        for action in ['MDSExtendedPollActionWAVE', 'MDSExtendedPollActionNUMERIC', 'MDSExtendedPollActionALARM']:
+            simulator.startPoll(simulator.decoder.writeData(action), simulator.startTime)
+        messages = {}
+        for OIDType, poll in simulator.polls.items():
+            messages[OIDType] = [bytes(simulator.pollResult(poll, poll['next'] + i * poll['period']))
+                                 for i in range(count)]
+    finally:
+        simulator.close()
+    return messages
+
+
+# Wave poll results as sent by the simulated monitor
+def simulatedWaveMessages(count=100):
+    return simulatedPollResults(count)['NOM_MOC_VMO_METRIC_SA_RT']
+
+
+def benchmarkDecode(repeat=20):
+    decoder = IntellivueDecoder()
+
+    # Decoding only what the distiller reads
+    selective = IntellivueDecoder()
+    selective.selectAttributes(IntellivueDistiller.ATTRIBUTES)
+
+    for OIDType, messages in sorted(simulatedPollResults().items()):
+        for message in messages:
+            if not sameDecode(decoder.readData(message), legacyReadData(decoder, message)):
+                raise AssertionError('Decode plan and DataTypes walk disagree on {0}'.format(OIDType))
+            if not sameDecode(selective.readData(message), legacyReadData(selective, message)):
+                raise AssertionError('Selective decode plan and DataTypes walk disagree on {0}'.format(OIDType))
+
+        name = OIDType.replace('NOM_MOC_VMO_', '')
+        nbytes = sum(len(message) for message in messages)
+        for label, function in [('readData {0} (tree walk)'.format(name),
+                                 lambda: [legacyReadData(decoder, message) for message in messages]),
+                                ('readData {0}'.format(name),
+                                 lambda: [decoder.readData(message) for message in messages]),
+                                ('readData {0} (distiller attributes)'.format(name),
+                                 lambda: [selective.readData(message) for message in messages])]:
+            seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+            report(label, seconds, len(messages), nbytes)
+
+        for label, reader in [('all attributes', decoder), ('distiller attributes', selective)]:
+            peak, retained, results = tracedAllocations(reader.readData, messages)
+            print('{0:<40} {1:>8.0f} B/frame peak {2:>8.0f} B/frame retained'.format(
+                '  allocations ({0})'.format(label), peak, retained))
+
+
+# Bytes allocated while function runs on each item, as traced by tracemalloc
+def tracedAllocations(function, items):
+    """
+    returns: peak - mean of the highest allocation above the start of each call
+             retained - mean allocation still held (by the results) afterwards
+             results - list of what function returned
+    """
+    results = []
+    peak = 0
+
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        for item in items:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            results.append(function(item))
+            peak += tracemalloc.get_traced_memory()[1] - before
+        retained = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+
+    return peak / len(items), retained / len(items), results
+
+
+def benchmarkAllocations(count=100):
+    rs232 = offlineRS232()
+    decoder = IntellivueDecoder()
+    messages = simulatedWaveMessages(count)
+    frames = [bytes(rs232.frameCheckWrite(message)) for message in messages]
+    size = sum(len(frame) for frame in frames) / len(frames)
+
+    print('{0} wave frames of {1:.0f} B'.format(len(frames), size))
+
+    # One driver read per frame, then every decoded message kept, as a consumer would
+    peak, retained, received = tracedAllocations(rs232.splitFrames, frames)
+    received = [message for batch in received for message in batch]
+    print('{0:<40} {1:>8.0f} B/frame peak {2:>8.0f} B/frame retained'.format('splitFrames', peak, retained))
+
+    peak, retained, decoded = tracedAllocations(decoder.readData, received)
+    print('{0:<40} {1:>8.0f} B/frame peak {2:>8.0f} B/frame retained'.format('readData', peak, retained))
+
+
+# Poll results read as nested dicts and as PollRecords records
+def benchmarkRecords(repeat=20):
+    decoder = IntellivueDecoder()
+
+    for OIDType, messages in sorted(simulatedPollResults().items()):
+        for message in messages:
+            if not sameDecode(pollReplyDict(decoder, readPollReply(decoder, message)), decoder.readData(message)):
+                raise AssertionError('Records and readData disagree on {0}'.format(OIDType))
+
+        name = OIDType.replace('NOM_MOC_VMO_', '')
+        nbytes = sum(len(message) for message in messages)
+        for label, read in [('readData {0}'.format(name), decoder.readData),
+                            ('readPollReply {0}'.format(name), lambda message: readPollReply(decoder, message)),
+                            ('readPollReply {0} (as dicts)'.format(name),
+                             lambda message: pollReplyDict(decoder, readPollReply(decoder, message)))]:
+            seconds = min(timeit.repeat(lambda: [read(message) for message in messages], number=1, repeat=repeat))
+            report(label, seconds, len(messages), nbytes)
+            peak, retained, results = tracedAllocations(read, messages)
+            print('{0:<40} {1:>8.0f} B/frame peak {2:>8.0f} B/frame retained'.format('', peak, retained))
+
+
+# Corpus of every message type the decoder receives: {label: [messages]}
+def simulatedCorpus(count=20):
+    """
+    Messages come from IntellivueSimulator as a monitor would send them, the
+    types it never sends (ConnectIndicationEvent, linked poll results, priority
+    list, abort) from writeData(). Extended poll results are labelled by kind.
+    """
+    corpus = collections.OrderedDict()
+    simulator = IntellivueSimulator(alarms=3)
+    decoder = simulator.decoder
+
+    def collect(message, kind=None):
+        message_type = decoder.getMessageType(message)
+        if message_type == 'MDSExtendedPollActionResult':
+            message_type += ' ' + kind.replace('NOM_MOC_VMO_', '')
+        corpus.setdefault(message_type, []).append(bytes(message))
+
+    simulator.send = collect
+
+    try:
+        simulator.startTime = time.monotonic()
+        for i in range(count):
+            now = simulator.startTime + i
+            simulator.handle(decoder.writeData('AssociationRequest'), now)
+            simulator.handle(decoder.writeData('MDSSetPriorityListWAVE', {'TextIdLabel': ['II', 'Pleth']}), now)
+            simulator.handle(decoder.writeData('MDSSinglePollAction', {'invoke_id': i}), now)
+            for action in ['MDSExtendedPollActionWAVE', 'MDSExtendedPollActionNUMERIC', 'MDSExtendedPollActionALARM']:
+                simulator.handle(decoder.writeData(action), now)
+            for poll in simulator.polls.values():
+                simulator.sendPollResult(poll, poll['next'])
+
+        relative_time = simulator.relativeInitialTime
+        for i in range(count):
+            collect(decoder.writeData('ConnectIndicationEvent', {
+                'Nomenclature': 0x00000100, 'ro_type': 'ROIV_APDU', 'invoke_id': 0, 'CMDType': 'CMD_EVENT_REPORT',
+                'OIDType': ['NOM_MOC_VMS_MDS_COMPOS_SINGLE_BED', 0x0D1E], 'MdsContext': 0, 'Handle': 0,
+                'RelativeTime': relative_time + i,
+                'AttributeList': {
+                    'NOM_ATTR_NET_ADDR_INFO': {'MACAddress': [0x00, 0x09, 0xFB, 0x00, 0x00, i],
+                                               'IPAddress': [172, 16, 0, 10 + i], 'Subnet_Mask': [255, 255, 0, 0]},
+                    'NOM_ATTR_PCOL_SUPPORT': {'ProtoSupport': [
+                        {'ApplProtoID': 1 + j, 'TransProtoID': 1, 'port_number': 24105 + j, 'ProtoOptions': 0}
+                        for j in range(4)]}}}))
+
+            for message_type, poll_type, observations in [
+                    ('LinkedMDSSinglePollActionResult', 'NOM_ACT_POLL_MDIB_DATA', simulator.numericObservations),
+                    ('LinkedMDSExtendedPollActionResult', 'NOM_ACT_POLL_MDIB_DATA_EXT', simulator.waveObservations)]:
+                parameters = simulator.header('ROLRS_APDU', i, 'CMD_CONFIRMED_ACTION',
+                                              ['NOM_MOC_VMS_MDS', poll_type, 'NOM_MOC_VMO_METRIC_NU', 'ALL'])
+                parameters.update(simulator.absoluteTime(relative_time))
+                parameters.update({'state': 'RORLS_FIRST', 'Rolrs_count': 1, 'poll_number': i, 'sequence_no': i,
+                                   'RelativeTime': relative_time, 'NomPartition': 'NOM_PART_OBJ',
+                                   'PollInfoList': [{'MdsContext': 0, 'poll_info': observations(relative_time)}]})
+                collect(decoder.writeData(message_type, parameters))
+
+            parameters = simulator.header('RORS_APDU', i, 'CMD_GET', ['NOM_MOC_VMS_MDS'])
+            parameters['AttributeList'] = {'NOM_ATTR_POLL_RTSA_PRIO_LIST': {'TextIdLabel': ['II', 'Pleth']}}
+            collect(decoder.writeData('MDSGetPriorityListResult', parameters))
+
+            collect(decoder.writeData('AssociationAbort'))
+    finally:
+        simulator.close()
+
+    return corpus
+
+
+# Corpus of the messages in a capture file, by message type
+def captureCorpus(path):
+    rs232 = offlineRS232()
+    decoder = IntellivueDecoder()
+    corpus = collections.OrderedDict()
+
+    for arrival, chunk in readCapture(path):
+        for message in rs232.splitFrames(chunk):
+            message_type = decoder.getMessageType(message)
+            if message_type in decoder.MessageLists:
+                corpus.setdefault(message_type, []).append(bytes(message))
+
+    return corpus
+
+
+# Allowed slowdown (and growth of allocations) against a baseline before failing
+TIME_TOLERANCE = 0.25
+ALLOCATION_TOLERANCE = 0.10
+
+
+# A fixed pure Python workload (the original CRC), by whose time times are scaled
+# when checked against a baseline, so a busier or slower machine is not a regression
+def calibration():
+    rs232 = offlineRS232()
+    messages = waveMessages(count=20, size=256)
+    return lambda: [legacyGetCRC16(message, rs232.CRCTable) for message in messages]
+
+
+def benchmarkCorpus(repeat=20, capture=None, baseline=None, save=False):
+    """
+    returns: regressions - labels of the message types that fell behind baseline
+    """
+    decoder = IntellivueDecoder()
+    corpus = captureCorpus(capture) if capture else simulatedCorpus()
+
+    # Rounds time every type once (and the calibration), so that a busy spell of
+    # the machine does not fall on one type only
+    functions = collections.OrderedDict([('calibration', calibration())])
+    for label, messages in corpus.items():
+        functions[label] = lambda messages=messages: [decoder.readData(message) for message in messages]
+        functions[label, 'type'] = lambda messages=messages: [decoder.getMessageType(message) for message in messages]
+
+    times = collections.defaultdict(list)
+    for i in range(repeat):
+        for key, function in functions.items():
+            times[key].append(timeit.timeit(function, number=1))
+
+    results = collections.OrderedDict()
+    results['calibration'] = {'us': 1e6 * min(times['calibration'])}
+    print('{0:<46} {1:>9} {2:>10} {3:>9} {4:>9} {5:>9}'.format(
+        'message type', 'us/msg', 'msgs/s', 'type us', 'peak B', 'kept B'))
+
+    for label, messages in corpus.items():
+        seconds = min(times[label]) / len(messages)
+        typing = min(times[label, 'type']) / len(messages)
+        peak, retained, decoded = tracedAllocations(decoder.readData, messages)
+
+        results[label] = {'us': 1e6 * seconds, 'peak': peak, 'retained': retained}
+        print('{0:<46} {1:>9.1f} {2:>10.0f} {3:>9.2f} {4:>9.0f} {5:>9.0f}'.format(
+            '{0} ({1})'.format(label, len(messages)), 1e6 * seconds, 1 / seconds, 1e6 * typing, peak, retained))
+
+    if baseline is None:
+        return []
+
+    if save:
+        with open(baseline, 'w') as baselineFile:
+            json.dump(results, baselineFile, indent=1, sort_keys=True)
+        print('Baseline saved to {0}'.format(baseline))
+        return []
+
+    with open(baseline) as baselineFile:
+        stored = json.load(baselineFile)
+
+    # Current times on the machine speed of the baseline
+    scale = stored['calibration']['us'] / results['calibration']['us']
+    print('Times scaled by {0:.2f} (calibration)'.format(scale))
+
+    regressions = []
+    for label, result in results.items():
+        if label == 'calibration':
+            continue
+        if label not in stored:
+            print('{0}: not in baseline'.format(label))
+            continue
+        for key, value, tolerance in [('us', result['us'] * scale, TIME_TOLERANCE),
+                                      ('peak', result['peak'], ALLOCATION_TOLERANCE),
+                                      ('retained', result['retained'], ALLOCATION_TOLERANCE)]:
+            if value > stored[label][key] * (1 + tolerance):
+                print('REGRESSION {0}: {1} {2:.1f} (baseline {3:.1f})'.format(label, key, value, stored[label][key]))
+                regressions.append(label)
+                break
+
+    print('{0} regressions against {1}'.format(len(regressions), baseline))
+    return regressions
+
+
+# Encodings of every value of each primitive (and some longer Strings), for primitiveCases()
+def primitiveEncodings(seed=0):
+    generator = random.Random(seed)
+
+    # Every exponent with every top mantissa byte, and the low bytes of the exceptions and of sign changes
+    floats = [bytes((exponent, high)) + low for exponent in range(256) for high in range(256)
+              for low in (b'\x00\x00', b'\x00\x01', b'\x00\x02', b'\x7F\xFE', b'\x7F\xFF', b'\xFF\xFF')]
+
+    # Every character on its own (those of surrogate pairs fail on their own, both before and now),
+    # then labels with spaces, byte order marks and odd lengths
+    characters = [UINT16.pack(i) for i in range(0x10000)]
+    strings = characters + [
+        ''.join(generator.choice('HR SpO2 \ufeffABP\ufffe\u00b0C') for i in range(generator.randrange(40))).encode(
+            'utf-16-be') + b'\x00' * generator.randrange(2) for i in range(5000)]
+    strings = [UINT16.pack(len(string)) + string for string in strings]
+
+    labels = [bytes(generator.getrandbits(8) for i in range(length)) for length in range(256)]
+    labels = [UINT16.pack(len(label)) + label for label in labels]
+
+    return {'FLOATType': floats, 'String': strings, 'VariableLabel': labels, 'century': [bytes((i,)) for i in range(256)]}
+
+
+# Reads each encoding with reader(index, dict, data), returns [(value or exception type, index)]
+def readPrimitives(reader, encodings, offset=b''):
+    results = []
+    for encoding in encodings:
+        data = memoryview(offset + encoding)
+        value = {}
+        try:
+            index = reader(len(offset), value, data)
+        except UnicodeDecodeError:
+            results.append((UnicodeDecodeError, None))
+        else:
+            results.append((value, index - len(offset)))
+    return results
+
+
+def benchmarkPrimitives(repeat=5):
+    decoder = IntellivueDecoder()
+    encodings = primitiveEncodings()
+
+    readers = {
+        'FLOATType': (legacyReadFLOAT, decoder.readFLOAT),
+        'String': (legacyReadString, decoder.readString),
+        'VariableLabel': (legacyReadVariableLabel, decoder.readVariableLabel),
+        'century': (legacyReadBCD, lambda index, d, data: decoder.recurseRead(['century'], index, d, data)),
+    }
+
+    for name, (legacy, reader) in sorted(readers.items()):
+        cases = encodings[name]
+        compiled = decoder.decodePlan([name])
+        plan = lambda index, d, data: compiled(data, index, d)
+        expected = readPrimitives(lambda index, d, data: legacy(decoder, index, d, data), cases)
+
+        # Also behind other fields, as in a message
+        for label, function, offset in [('reader', reader, b''), ('plan', plan, b''),
+                                        ('reader at offset', reader, b'\xAA' * 6)]:
+            results = readPrimitives(function, cases, offset)
+            for case, result, reference in zip(cases, results, expected):
+                if not sameDecode(result[0], reference[0]) or result[1] != reference[1]:
+                    raise AssertionError('{0} {1} of {2!r}: {3!r}, was {4!r}'.format(
+                        name, label, bytes(case), result, reference))
+        print('{0:<40} {1:>8} encodings read as before'.format(name, len(cases)))
+
+        readable = [case for case, reference in zip(cases, expected) if reference[0] is not UnicodeDecodeError]
+        sample = [memoryview(case) for case in readable[-2000:]]
+        for label, function in [('{0} (original)'.format(name), lambda index, d, data: legacy(decoder, index, d, data)),
+                                (name, reader)]:
+            seconds = min(timeit.repeat(lambda: [function(0, {}, data) for data in sample], number=1, repeat=repeat))
+            report(label, seconds, len(sample), sum(len(data) for data in sample))
+
+
+# Distills wave results into SampledDataBuffers (as PhilipsTelemetryStream.publish()),
+# fused or not; returns the buffers
+def distillWaves(decoded, fused):
+    distiller = IntellivueDistiller()
+    # The same timeline in every run
+    distiller.initialMonotonic = 0
+    buffers = {'ECG Lead II': SampledDataBuffer(512, 7), 'PLETH wave label': SampledDataBuffer(128, 7)}
+
+    if fused:
+        distiller.bindWaves(lambda label: (label, buffers[label]) if label in buffers else None)
+        for message in decoded:
+            distiller.refine_wave_message(message)
+    else:
+        for message in decoded:
+            data = distiller.refine_wave_message(message)
+            for label, buffer in buffers.items():
+                buffer.rolling_append(data['timestamp'], data.get(label))
+
+    return buffers
+
+
+def benchmarkWaves(repeat=20):
+    decoder = IntellivueDecoder()
+    messages = simulatedWaveMessages(200)
+    decoded = [decoder.readData(message) for message in messages]
+
+    appended, stored = distillWaves(decoded, False), distillWaves(decoded, True)
+    for label in appended:
+        if not (np.array_equal(appended[label].y, stored[label].y) and
+                np.array_equal(appended[label].t, stored[label].t)):
+            raise AssertionError('Fused distillation disagrees on {0}'.format(label))
+
+    # Buffer times are numpy int64s; they must convert to the monitor's clock as ints do
+    distiller = IntellivueDistiller()
+    for label, buffer in stored.items():
+        if distiller.toDatetime(buffer.t[-1]) != distiller.toDatetime(int(buffer.t[-1])):
+            raise AssertionError('Buffer times of {0} disagree with the monitor clock'.format(label))
+
+    nbytes = sum(len(message) for message in messages)
+    for label, fused in [('distill, rolling_append', False), ('distill fused', True)]:
+        seconds = min(timeit.repeat(lambda: distillWaves(decoded, fused), number=1, repeat=repeat))
+        report(label, seconds, len(messages), nbytes)
+
+    # The window reads of a poll of the main loop
+    ppg, ecg = stored['PLETH wave label'], stored['ECG Lead II']
+    polls = 10000
+    seconds = min(timeit.repeat(lambda: (ppg.t, ppg.y, ecg.t, ecg.y), number=polls, repeat=repeat))
+    report('window reads of a poll', seconds, polls, polls * sum(buffer.t.nbytes + buffer.y.nbytes for buffer in stored.values()))
+
+
+def benchmarkNumerics(repeat=20, hours=72):
+    decoder = IntellivueDecoder()
+    distiller = IntellivueDistiller()
+    polls = simulatedPollResults()
+
+    for OIDType, refine in [('NOM_MOC_VMO_METRIC_NU', distiller.refine_numerics_message),
+                            ('NOM_MOC_VMO_AL_MON', distiller.refine_alarms_message)]:
+        messages = polls[OIDType]
+        decoded = [decoder.readData(message) for message in messages]
+        seconds = min(timeit.repeat(lambda: [refine(message) for message in decoded], number=1, repeat=repeat))
+        report('{0} {1}'.format(refine.__name__, OIDType.replace('NOM_MOC_VMO_', '')), seconds,
+               len(messages), sum(len(message) for message in messages))
+
+    # The same result, a second later each time
+    message = decoder.readData(polls['NOM_MOC_VMO_METRIC_NU'][-1])
+    reply = message['PollMdibDataReplyExt']
+    start = reply['RelativeTime']
+    distiller = IntellivueDistiller()
+    distiller.refine_numerics_message(message)
+
+    tracemalloc.start()
+    try:
+        for second in range(1, hours * 3600 + 1):
+            reply['RelativeTime'] = start + second * 8000
+            distiller.refine_numerics_message(message)
+            if second % (12 * 3600) == 0 or second == 3600:
+                print('{0:<40} {1:>8} B traced {2:>8} B numerics'.format(
+                    'after {0} h'.format(second // 3600), tracemalloc.get_traced_memory()[0],
+                    distiller.numerics.nbytes()))
+    finally:
+        tracemalloc.stop()
+
+
+# Messages a client writes on each (re)connection: (message_type, parameters)
+def handshakeMessages(invoke_id):
+    return [('AssociationRequest', {}),
+            ('MDSCreateEventResult', {'session_id': 'DataExportProtocol', 'p_context_id': 'DataExportProtocol',
+                                      'ro_type': 'RORS_APDU', 'invoke_id': invoke_id,
+                                      'CMDType': 'CMD_CONFIRMED_EVENT_REPORT',
+                                      'OIDType': ['NOM_MOC_VMS_MDS', 'NOM_NOTI_MDS_CREAT'],
+                                      'MdsContext': 0, 'Handle': 0, 'RelativeTime': 8000 * invoke_id}),
+            ('MDSSetPriorityListWAVE', {'invoke_id': invoke_id, 'TextIdLabel': ['Pleth', 'II']}),
+            ('MDSExtendedPollActionWAVE', {'invoke_id': invoke_id, 'RelativeTime': 800000}),
+            ('MDSExtendedPollActionNUMERIC', {'invoke_id': invoke_id, 'RelativeTime': 800000}),
+            ('MDSExtendedPollActionALARM', {'invoke_id': invoke_id, 'RelativeTime': 800000}),
+            ('MDSSinglePollAction', {'invoke_id': invoke_id})]
+
+
+def benchmarkEncode(repeat=20):
+    decoder = IntellivueDecoder()
+    messages = [handshakeMessages(invoke_id) for invoke_id in range(1, 101)]
+
+    for batch in messages[:2]:
+        for message_type, parameters in batch:
+            if decoder.writeData(message_type, parameters) != decoder.encodeMessage(message_type, parameters):
+                raise AssertionError('Template and DataTypes walk disagree on {0}'.format(message_type))
+
+    for label, write in [('writeData handshake (encoding)', decoder.encodeMessage),
+                         ('writeData handshake (templates)', decoder.writeData)]:
+        seconds = min(timeit.repeat(lambda: [write(message_type, parameters)
+                                             for batch in messages for message_type, parameters in batch],
+                                    number=1, repeat=repeat))
+        print('{0:<40} {1:>8.1f} us/handshake {2:>8.1f} us/message'.format(
+            label, 1e6 * seconds / len(messages), 1e6 * seconds / len(messages) / len(messages[0])))
+
+
+# Decoder construction with the nomenclature tables parsed, unpickled, and already loaded
+def benchmarkStartup(repeat=20):
+    decoder = IntellivueDecoder()
+    tables = decoderModule.nomenclature
+
+    # Decoder construction as before the cache: parsing the text files every time
+    seconds = min(timeit.repeat(IntellivueDecoder, number=1, repeat=repeat)) + \
+        min(timeit.repeat(decoder.parseNomenclature, number=1, repeat=repeat))
+    print('{0:<40} {1:>8.2f} ms'.format('IntellivueDecoder() (text files)', 1e3 * seconds))
+
+    def fromDisk():
+        decoderModule.nomenclature = None
+        IntellivueDecoder()
+
+    try:
+        seconds = min(timeit.repeat(fromDisk, number=1, repeat=repeat))
+        print('{0:<40} {1:>8.2f} ms'.format('IntellivueDecoder() (disk cache)', 1e3 * seconds))
+    finally:
+        decoderModule.nomenclature = tables
+
+    seconds = min(timeit.repeat(IntellivueDecoder, number=1, repeat=repeat))
+    print('{0:<40} {1:>8.2f} ms'.format('IntellivueDecoder() (loaded)', 1e3 * seconds))
+
+
+BENCHMARKS = {
+    'transparency': benchmarkTransparency,
+    'crc': benchmarkCRC,
+    'replay': benchmarkReplay,
+    'simulator': benchmarkSimulator,
+    'async': benchmarkAsync,
+    'counters': benchmarkCounters,
+    'allocations': benchmarkAllocations,
+    'decode': benchmarkDecode,
+    'startup': benchmarkStartup,
+    'encode': benchmarkEncode,
+    'records': benchmarkRecords,
+    'corpus': benchmarkCorpus,
+    'primitives': benchmarkPrimitives,
+    'waves': benchmarkWaves,
+    'numerics': benchmarkNumerics,
+}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Intellivue protocol microbenchmarks')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help='one or more of: {0} (default: all)'.format(', '.join(sorted(BENCHMARKS))))
+    parser.add_argument('--capture', metavar='FILE',
+                        help='capture file to replay instead of synthesized frames (replay and corpus benchmarks)')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='figures to check the corpus benchmark against (exits with 1 on a regression)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the corpus benchmark figures to --baseline instead of checking them')
+    opts = parser.parse_args()
+
+    regressions = []
+    for benchmark in opts.benchmarks or sorted(BENCHMARKS):
+        print('== {0} =='.format(benchmark))
+        if benchmark == 'replay':
+            BENCHMARKS[benchmark](capture=opts.capture)
+        elif benchmark == 'corpus':
+            regressions += BENCHMARKS[benchmark](capture=opts.capture, baseline=opts.baseline,
+                                                 save=opts.save_baseline)
+        else:
+            BENCHMARKS[benchmark]()
+
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,146 @@
+"""
+Raw serial capture files, for replaying a monitor session without the monitor.
+
+A capture is the magic bytes b'IVCAP\x01' followed by one record per read
+from the serial port:
+
+    |arrival time (int64 ns, time.monotonic_ns())|length (uint32)|bytes|
+
+all little endian. RS232(captureFile=...) writes them and ReplayRS232 plays
+them back.
+"""
+
+import struct
+import time
+import logging
+
+CAPTURE_MAGIC = b'IVCAP\x01'
+RECORD_HEADER = struct.Struct('<qI')
+
+
+class CaptureWriter(object):
+    """
+    Appends timestamped chunks of received bytes to a capture file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        # Reconnects append to the same capture
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+
+    def write(self, chunk, arrival=None):
+        if arrival is None:
+            arrival = time.monotonic_ns()
+        self.file.write(RECORD_HEADER.pack(arrival, len(chunk)))
+        self.file.write(chunk)
+        # Flushed per record: Main may end with os._exit(), which skips closing files
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+# Reads every record of a capture file
+def readCapture(path):
+    """
+    returns: records - list of (arrival time in ns, bytes)
+    """
+    with open(path, 'rb') as capture:
+        data = capture.read()
+
+    if not data.startswith(CAPTURE_MAGIC):
+        raise IOError('{0} is not a capture file'.format(path))
+
+    records = []
+    index = len(CAPTURE_MAGIC)
+    while index + RECORD_HEADER.size <= len(data):
+        arrival, length = RECORD_HEADER.unpack_from(data, index)
+        index += RECORD_HEADER.size
+        if index + length > len(data):
+            logging.warning('Capture {0} ends in a truncated record'.format(path))
+            break
+        records.append((arrival, data[index:index + length]))
+        index += length
+
+    return records
+
+
+class ReplaySocket(object):
+    """
+    Stands in for serial.Serial, serving the bytes of a capture with their
+    original timing scaled by speed (1 = real time, 10 = ten times faster,
+    None or 0 = as fast as possible). Writes are discarded.
+    """
+
+    def __init__(self, records, speed=1.0, timeout=0.5):
+        self.records = records
+        self.speed = speed
+        self.timeout = timeout
+        self.next = 0
+        self.buffer = bytearray()
+        self.open = True
+        self.startTime = None
+        self.firstArrival = records[0][0] if records else 0
+
+    # True once every recorded byte has been read
+    @property
+    def finished(self):
+        return self.next >= len(self.records) and not self.buffer
+
+    # Host time (monotonic ns) at which a record becomes readable
+    def dueTime(self, record):
+        if not self.speed:
+            return 0
+        return self.startTime + (record[0] - self.firstArrival) / self.speed
+
+    # Moves every record that is due into the buffer
+    def release(self):
+        if self.startTime is None:
+            self.startTime = time.monotonic_ns()
+
+        now = time.monotonic_ns()
+        while self.next < len(self.records) and self.dueTime(self.records[self.next]) <= now:
+            self.buffer += self.records[self.next][1]
+            self.next += 1
+
+    @property
+    def in_waiting(self):
+        self.release()
+        return len(self.buffer)
+
+    def read(self, size=1):
+        self.release()
+
+        # Wait (up to timeout) for the next record, like a blocking serial read
+        if not self.buffer and self.next < len(self.records):
+            wait = (self.dueTime(self.records[self.next]) - time.monotonic_ns()) / 1e9
+            if self.timeout is None or wait <= self.timeout:
+                time.sleep(max(0, wait))
+                self.release()
+            elif self.timeout:
+                time.sleep(self.timeout)
+        elif not self.buffer and self.timeout:
+            # Every record was replayed: time out like a quiet serial port
+            time.sleep(self.timeout)
+
+        chunk = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return chunk
+
+    def write(self, data):
+        return len(data)
+
+    def isOpen(self):
+        return self.open
+
+    def flushInput(self):
+        pass
+
+    def flushOutput(self):
+        pass
+
+    def close(self):
+        self.open = False
@@ -12,12 +12,459 @@ from io import open
 import struct
 import codecs
 import copy
+import hashlib
+import itertools
 import logging
 import os
+import pickle
+import tempfile
+import numpy as np
 
 # For path'd reads of label data
 package_directory = os.path.dirname(os.path.abspath(__file__))
 
+# Text files the nomenclature tables are parsed from, and the version of their
+# cached form (bump it whenever the load methods change what they return)
+NOMENCLATURE_FILES = ('OIDTypes.txt', 'SCADATypes.txt', 'UNITTypes.txt', 'PhysioLabels.txt', 'EventTypes.txt')
+NOMENCLATURE_VERSION = 1
+
+# Nomenclature tables of this process, loaded by the first decoder (see IntellivueDecoder.loadNomenclature())
+nomenclature = None
+
+# Big endian integers, read in place with unpack_from (no slicing of the message)
+UINT32 = struct.Struct('>I')
+UINT16 = struct.Struct('>H')
+INT16 = struct.Struct('>h')
+UINT8 = struct.Struct('>B')
+COUNT_LENGTH = struct.Struct('>HH')
+
+# Wave samples (VariableData values) as they are on the wire
+SAMPLES = np.dtype('>u2')
+
+# Attributes readData() itself reads, decoded whatever the selection (see selectAttributes())
+REQUIRED_ATTRIBUTES = frozenset(['NOM_ATTR_NET_ADDR_INFO', 'NOM_ATTR_PCOL_SUPPORT'])
+
+# Offset of the PollInfoList (count and length) in poll results, see checkMessage()
+POLL_INFO_OFFSETS = {
+    'MDSSinglePollActionResult': 44,
+    'LinkedMDSSinglePollActionResult': 46,
+    'MDSExtendedPollActionResult': 46,
+    'LinkedMDSExtendedPollActionResult': 48,
+}
+
+# Most message templates (and parameter sets seen once) kept by a decoder (see writeData())
+WRITE_TEMPLATES = 64
+
+# Struct format character of each basic (integer) data type
+BASIC_FORMATS = {32: 'I', 16: 'H', -16: 'h'}
+
+# uint8 BCD values: digits side by side (a nibble over 9 takes two digits, as str() would)
+BCD_VALUES = tuple(high * (10 if low < 10 else 100) + low for high, low in (divmod(i, 16) for i in range(256)))
+
+# Characters of Strings read as byte order marks, and so left out (see readString())
+BYTE_ORDER_MARKS = {0xFEFF: None, 0xFFFE: None}
+
+
+# Value of a FLOATType read as a uint32 (exponent byte, 24 bit mantissa)
+def floatValue(raw):
+    mantissa = raw & 0xFFFFFF
+
+    # Check for exceptions
+    if mantissa == 0x7FFFFF:
+        return 'Not a number'
+    elif mantissa == 0x800000:
+        return 'Not at this resolution'
+    elif mantissa == 0x7FFFFE:
+        return 'Positive Infinity'
+    elif mantissa == 0x800002:
+        return 'Negative Infinity'
+
+    exponent = raw >> 24
+    if exponent >= 0x80:
+        exponent -= 0x100
+    if mantissa >= 0x800000:
+        mantissa -= 0x1000000
+
+    return mantissa * 10 ** exponent
+
+
+class Labels(dict):
+    # Labels of a data type by value (see IntellivueDecoder.labelTable()):
+    # looking up a value without a label returns the value itself
+    def __missing__(self, value):
+        return value
+
+
+class DecodePlan(object):
+    """
+    A list of data types compiled into a single function that reads it
+    exactly as IntellivueDecoder.recurseRead() would, without walking
+    DataTypes: plan(data, index, current_message_dict) -> index
+
+    The plan is made of steps, each a closure step(data, index, dict) ->
+    index reading one part of the message into a dictionary. Consecutive
+    fixed size fields (including those of nested data types) are read by one
+    precompiled struct.Struct, the values with labels looked up by value in
+    tables built from DataKeys, and stored as laid out by a table of
+    (key, build) entries. The other steps read lengths, fill the
+    dictionaries of nested data types with variable size parts, loop over
+    VariableLengthLists and AttributeLists (each attribute is read by the
+    plan of its type), or hand the variable parts to the decoder's readers.
+    """
+
+    def __init__(self, decoder, message_list):
+        self.decoder = decoder
+        self.function = self.compile(message_list)
+
+    # Compiles the data types of message_list (see recurseRead()) into the
+    # step filling their dictionary
+    def compile(self, message_list):
+        DataTypes = self.decoder.DataTypes
+        steps = []
+
+        # Pending run of fixed size fields as (key, field), see fixedField()
+        fields = []
+
+        for data_type in message_list:
+
+            # Lists accompanying AttributeLists are only used for writing
+            if type(data_type) == list:
+                continue
+
+            field = self.fixedField(data_type)
+            if field is not None:
+                if field[0] is not None:
+                    fields.append(field)
+                continue
+
+            if fields:
+                steps.append(self.runStep(fields))
+                fields = []
+
+            if 'ASNLength' in data_type:
+                steps.append(self.asnLengthStep())
+
+            elif 'LILength' in data_type:
+                steps.append(self.liLengthStep())
+
+            elif data_type == 'AttributeList':
+                steps.append(self.attributeListStep())
+
+            elif data_type == 'VariableLabel':
+                steps.append(self.readerStep(self.decoder.readVariableLabel))
+
+            elif data_type == 'VariableData':
+                steps.append(self.readerStep(self.decoder.readVariableData))
+
+            elif data_type == 'String':
+                steps.append(self.readerStep(self.decoder.readString))
+
+            elif data_type == 'al_source_code':
+                steps.append(self.readerStep(self.decoder.readAlSourceCode))
+
+            # VariableLengthList: [count, length, value], each value read by the same step
+            elif DataTypes[data_type][0] == 'count':
+                steps.append(self.listStep(data_type, DataTypes[data_type][2],
+                                           self.compile([DataTypes[data_type][2]])))
+
+            # Nested data type with variable size parts: a dictionary of its own
+            else:
+                steps.append(self.nestedStep(data_type, self.compile(DataTypes[data_type])))
+
+        if fields:
+            steps.append(self.runStep(fields))
+
+        return self.sequence(steps)
+
+    # Runs steps one after the other, as a single step
+    def sequence(self, steps):
+        steps = tuple(steps)
+
+        if not steps:
+            return lambda data, index, values: index
+
+        elif len(steps) == 1:
+            return steps[0]
+
+        def step(data, index, values):
+            for part in steps:
+                index = part(data, index, values)
+            return index
+
+        return step
+
+    # Fixed size data type as (key, (struct format, value count, node)), or None
+    def fixedField(self, data_type):
+        """
+        key is where recurseRead() stores the data type (None if it stores
+        nothing), and node how its value is made of the values unpacked for
+        it: ('value', converter or None), ('list', count) or ('dict', fields)
+        for nested data types made of fixed size fields only.
+        """
+        DataTypes = self.decoder.DataTypes
+
+        if 'ASNLength' in data_type or 'LILength' in data_type:
+            return None
+
+        elif 'length' in data_type:
+            return 'length', ('H', 1, ('value', None))
+
+        elif data_type in ('AttributeList', 'VariableLabel', 'VariableData', 'String', 'al_source_code'):
+            return None
+
+        elif data_type == 'FLOATType':
+            return 'FLOATType', ('I', 1, ('value', floatValue))
+
+        elif DataTypes[data_type][0] == 'count':
+            return None
+
+        elif type(DataTypes[data_type][0]) == int:
+            size = DataTypes[data_type][0]
+
+            if size in BASIC_FORMATS:
+                # Only unsigned integers have labels
+                labels = self.decoder.labelTable(data_type, size // 8) if size > 0 else None
+                return data_type, (BASIC_FORMATS[size], 1, ('value', labels.__getitem__ if labels else None))
+
+            elif size == 8 and DataTypes[data_type][1] == 'bcd':
+                return data_type, ('B', 1, ('value', BCD_VALUES.__getitem__))
+
+            elif size == 8 and DataTypes[data_type][1] == 1:
+                labels = self.decoder.byteLabels(data_type)
+                return data_type, ('B', 1, ('value', labels.__getitem__ if labels is not None else None))
+
+            elif size == 8:
+                count = DataTypes[data_type][1]
+                return data_type, ('{0}B'.format(count), count, ('list', count))
+
+            # Any other size is not read
+            return None, ('', 0, None)
+
+        # Nested data type
+        fields = []
+        for nested_type in DataTypes[data_type]:
+            if type(nested_type) != list:
+                field = self.fixedField(nested_type)
+                if field is None:
+                    return None
+                fields.append(field)
+
+        return data_type, (''.join(field[0] for key, field in fields), sum(field[1] for key, field in fields),
+                           ('dict', fields))
+
+    # Returns how the value of a field is made of the (converted) values of
+    # its run, taken in order from an iterator: None for the next value, a
+    # tuple of keys for a dictionary of the next values, else a function of
+    # the iterator. Converters of the values are added to converters.
+    def builder(self, node, position, converters):
+        kind, detail = node
+
+        if kind == 'value':
+            if detail is not None:
+                converters.append((position, detail))
+            return None
+
+        elif kind == 'list':
+            return lambda values: list(itertools.islice(values, detail))
+
+        # A dictionary of the fields of a nested data type (fields stored
+        # nowhere have no values)
+        parts = []
+        for key, (format, count, nested) in detail:
+            if key is not None:
+                parts.append((key, self.builder(nested, position, converters)))
+            position += count
+
+        if all(build is None for key, build in parts):
+            return tuple(key for key, build in parts)
+
+        fill = self.filler(parts)
+        return lambda values: fill({}, values)
+
+    # Function filling a dictionary with (key, build) parts, see builder()
+    def filler(self, parts):
+        parts = tuple(parts)
+
+        def fill(nested, values):
+            for key, build in parts:
+                if build is None:
+                    nested[key] = next(values)
+                elif type(build) == tuple:
+                    # zip() takes no value past the last key
+                    nested[key] = dict(zip(build, values))
+                else:
+                    nested[key] = build(values)
+            return nested
+
+        return fill
+
+    # Step reading a run of fixed size fields
+    def runStep(self, fields):
+        unpack = struct.Struct('>' + ''.join(field[0] for key, field in fields))
+        size = unpack.size
+        unpack_from = unpack.unpack_from
+
+        converters = []
+        entries = []
+        count = 0
+        for key, (format, values, node) in fields:
+            entries.append((key, self.builder(node, count, converters)))
+            count += values
+
+        if converters:
+            # Every value has a converter, in order
+            if [position for position, converter in converters] == list(range(count)):
+                functions = tuple(converter for position, converter in converters)
+
+                def convert(values):
+                    return [function(value) for function, value in zip(functions, values)]
+            else:
+                functions = tuple(dict(converters).get(position) for position in range(count))
+
+                def convert(values):
+                    return [value if function is None else function(value)
+                            for function, value in zip(functions, values)]
+
+        # A single value
+        if len(entries) == 1 and count == 1 and entries[0][1] is None:
+            key = entries[0][0]
+            if converters:
+                converter = converters[0][1]
+
+                def step(data, index, values):
+                    values[key] = converter(unpack_from(data, index)[0])
+                    return index + size
+            else:
+                def step(data, index, values):
+                    values[key] = unpack_from(data, index)[0]
+                    return index + size
+
+            return step
+
+        # A single dictionary of every value (a nested data type)
+        if len(entries) == 1 and type(entries[0][1]) == tuple and len(entries[0][1]) == count:
+            key, keys = entries[0]
+            if converters:
+                def step(data, index, values):
+                    values[key] = dict(zip(keys, convert(unpack_from(data, index))))
+                    return index + size
+            else:
+                def step(data, index, values):
+                    values[key] = dict(zip(keys, unpack_from(data, index)))
+                    return index + size
+
+            return step
+
+        # Every value stored as it is
+        if all(build is None for key, build in entries) and len(entries) == count:
+            keys = tuple(key for key, build in entries)
+            if converters:
+                def step(data, index, values):
+                    values.update(zip(keys, convert(unpack_from(data, index))))
+                    return index + size
+            else:
+                def step(data, index, values):
+                    values.update(zip(keys, unpack_from(data, index)))
+                    return index + size
+
+            return step
+
+        fill = self.filler(entries)
+
+        def step(data, index, values):
+            run = unpack_from(data, index)
+            fill(values, iter(convert(run) if converters else run))
+            return index + size
+
+        return step
+
+    def asnLengthStep(self):
+        def step(data, index, values):
+            first = data[index]
+            if first == 130:
+                values['ASNLength'] = UINT16.unpack_from(data, index+1)[0]
+                return index + 3
+            elif first == 129:
+                values['ASNLength'] = data[index+1]
+                return index + 2
+            values['ASNLength'] = first
+            return index + 1
+
+        return step
+
+    def liLengthStep(self):
+        def step(data, index, values):
+            first = data[index]
+            if first == 255:
+                values['LILength'] = UINT16.unpack_from(data, index+1)[0]
+                return index + 3
+            values['LILength'] = first
+            return index + 1
+
+        return step
+
+    # Each attribute is read by the plan of its type, or skipped when not
+    # selected (see IntellivueDecoder.attributePlan())
+    def attributeListStep(self):
+        attributePlans = self.decoder.attributePlans
+        attributePlan = self.decoder.attributePlan
+        unpack_from = COUNT_LENGTH.unpack_from
+
+        def step(data, index, values):
+            count, length = unpack_from(data, index)
+            attributes = values['AttributeList'] = {'count': count, 'length': length, 'AVAType': {}}
+            index += 4
+            if count == 0:
+                attributes['AVAType'] = 'Null'
+                return index
+
+            values = attributes['AVAType']
+            for i in range(count):
+                OIDIndex, length = unpack_from(data, index)
+                index += 4
+                OIDType, plan = attributePlans.get(OIDIndex) or attributePlan(OIDIndex)
+                if plan:
+                    value = {}
+                    values[OIDType] = {'length': length, 'AttributeValue': value}
+                    index = plan(data, index, value)
+                elif plan is None:
+                    values[OIDType] = {'length': length, 'AttributeValue': 'OIDType Not Defined'}
+                    index += length
+                else:
+                    index += length
+            return index
+
+        return step
+
+    def readerStep(self, reader):
+        def step(data, index, values):
+            return reader(index, values, data)
+
+        return step
+
+    def nestedStep(self, data_type, body):
+        def step(data, index, values):
+            nested = values[data_type] = {}
+            return body(data, index, nested)
+
+        return step
+
+    def listStep(self, data_type, data_value, body):
+        prefix = data_value + '_'
+        unpack_from = COUNT_LENGTH.unpack_from
+
+        def step(data, index, values):
+            count, length = unpack_from(data, index)
+            values[data_type] = elements = {'count': count, 'length': length}
+            index += 4
+            for i in range(count):
+                value = elements[prefix + str(i)] = {}
+                index = body(data, index, value)
+            return index
+
+        return step
+
+
 class IntellivueDecoder(object):
     """
     This class contains all of the data structures defined in the Data Interface
@@ -82,6 +529,24 @@ class IntellivueDecoder(object):
         self.MessageLists = {}
         self.MessageParameters = {}
 
+        # Compiled decode plans by tuple of data types, by message type, and
+        # (OIDType, plan) by attribute id, all filled on first use (see decodePlan())
+        self.decodePlans = {}
+        self.messagePlans = {}
+        self.attributePlans = {}
+
+        # OIDTypes of the attributes decoded, None for all (see selectAttributes())
+        self.selectedAttributes = None
+
+        # Labels of the values read from messages, by data type and size,
+        # filled on first use (see labelTable())
+        self.labelTables = {}
+
+        # Encoded message templates (None where there can be none), and
+        # parameters written once, by template key (see writeData())
+        self.writeTemplates = {}
+        self.writtenOnce = {}
+
         self.DataTypes['Nomenclature'] = [32]
         self.DataTypes['ROapdus'] = ['ro_type', 'length_final']
         self.DataTypes['ro_type'] = [16]
@@ -89,7 +554,7 @@ class IntellivueDecoder(object):
         self.DataTypes['ROIVapdu'] = ['invoke_id', 'CMDType', 'length_final']
         self.DataTypes['invoke_id'] = [16]
         self.DataTypes['CMDType'] = [16]
-        self.DataTypes['EventReportArgument'] = ['ManagedObjectID', 'RelativeTime', 'OIDType', 'length']
+        self.DataTypes['EventReportArgument'] = ['ManagedObjectID', 'RelativeTime', 'OIDType', 'length_final']
         self.DataTypes['ManagedObjectID'] = ['OIDType', 'GlbHandle']
         self.DataTypes['OIDType'] = [16]
         self.DataTypes['GlbHandle'] = ['MdsContext', 'Handle']
@@ -713,17 +1178,20 @@ class IntellivueDecoder(object):
             'NOM_ATTR_TIME_STAMP_REL': 'RelativeTime'
         }
 
-        self.DataKeys['OIDType'] = self.loadOIDTypes()
+        # Tables from the text files, parsed once (see loadNomenclature())
+        tables = self.loadNomenclature()
 
-        self.DataKeys['SCADAType'] = self.loadSCADATypes()
+        self.DataKeys['OIDType'] = tables['OIDType']
 
-        self.DataKeys['UNITType'] = self.loadUNITTypes()
+        self.DataKeys['SCADAType'] = tables['SCADAType']
 
-        self.DataKeys['TextId'] = self.loadPhysioLabels()
+        self.DataKeys['UNITType'] = tables['UNITType']
 
-        self.DataKeys['PhysioKeys'] = self.loadPhysioKeys()
+        self.DataKeys['TextId'] = tables['TextId']
 
-        self.DataKeys['EventTypes'] = self.loadEventTypes()
+        self.DataKeys['PhysioKeys'] = tables['PhysioKeys']
+
+        self.DataKeys['EventTypes'] = tables['EventTypes']
 
         self.DataKeys['NomPartition'] = {
             b'\x00\x01': 'NOM_PART_OBJ',
@@ -1142,6 +1610,59 @@ class IntellivueDecoder(object):
     def set8(self, data):
         return bytearray(struct.pack('>B',data))
 
+    # Returns the DataKeys tables read from the text files, shared by every
+    # decoder of the process and cached on disk
+    def loadNomenclature(self):
+        """
+        The tables are parsed once (see parseNomenclature()) and pickled to
+        __pycache__/nomenclature.<hash>.pickle in the package, where <hash>
+        covers NOMENCLATURE_VERSION and the contents of NOMENCLATURE_FILES, so
+        editing a text file rebuilds the cache. Where __pycache__ cannot be
+        written, each process parses the files.
+
+        returns: tables - {DataKeys key: table}, to be read only
+        """
+        global nomenclature
+        if nomenclature is not None:
+            return nomenclature
+
+        digest = hashlib.sha1(str(NOMENCLATURE_VERSION).encode('ascii'))
+        for name in NOMENCLATURE_FILES:
+            with open(os.path.join(package_directory, name), 'rb') as text_file:
+                digest.update(text_file.read())
+
+        cache_directory = os.path.join(package_directory, '__pycache__')
+        cache_path = os.path.join(cache_directory, 'nomenclature.{0}.pickle'.format(digest.hexdigest()[:16]))
+
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                tables = pickle.load(cache_file)
+
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+            tables = self.parseNomenclature()
+
+            # Written under a temporary name, so that other processes never see part of it
+            try:
+                if not os.path.isdir(cache_directory):
+                    os.makedirs(cache_directory)
+                with tempfile.NamedTemporaryFile(dir=cache_directory, suffix='.tmp', delete=False) as cache_file:
+                    pickle.dump(tables, cache_file, pickle.HIGHEST_PROTOCOL)
+                os.replace(cache_file.name, cache_path)
+            except (IOError, OSError):
+                logging.debug('Could not cache nomenclature tables in {0}'.format(cache_directory))
+
+        nomenclature = tables
+        return tables
+
+    # Parses the nomenclature tables from the text files, returns dict
+    def parseNomenclature(self):
+        return {'OIDType': self.loadOIDTypes(),
+                'SCADAType': self.loadSCADATypes(),
+                'UNITType': self.loadUNITTypes(),
+                'TextId': self.loadPhysioLabels(),
+                'PhysioKeys': self.loadPhysioKeys(),
+                'EventTypes': self.loadEventTypes()}
+
     # Reads in text file of OID Types into a bidirectional dictionary
     # with the format number:label and label:number, returns dict
     def loadOIDTypes(self):
@@ -1420,8 +1941,8 @@ class IntellivueDecoder(object):
         """
         # Initialize Variables
         current_message_dict['AttributeList'] = {}
-        current_message_dict['AttributeList']['count'] = self.get16(data[index: index+2])
-        current_message_dict['AttributeList']['length'] = self.get16(data[index+2: index+4])
+        current_message_dict['AttributeList']['count'] = UINT16.unpack_from(data, index)[0]
+        current_message_dict['AttributeList']['length'] = UINT16.unpack_from(data, index+2)[0]
         current_message_dict['AttributeList']['AVAType'] = {}
 
         index += 4
@@ -1435,25 +1956,15 @@ class IntellivueDecoder(object):
             # Iterate through "count" attributes
             for i in range(current_message_dict['AttributeList']['count']):
 
-                OIDIndex = data[index:index+2]
-
-                if OIDIndex == b'\x00\x01':
-                    OIDType = 'NOM_POLL_PROFILE_SUPPORT'
-                elif OIDIndex == b'\x01\x02':
-                    OIDType = 'NOM_MDIB_OBJ_SUPPORT'
-                elif OIDIndex == b'\xF0\x01':
-                    OIDType = 'NOM_ATTR_POLL_PROFILE_EXT'
-                # Fix from @uday for u'ALL' problem 3/18
-                elif OIDIndex == b'\x00\x00':
-                    OIDType = 0
-                else:
-                    # This is the real dictionary, incorporate partitions somehow
-                    OIDType = self.DataKeys['OIDType'].get(OIDIndex, OIDIndex)
-
-                # length
-                length = self.get16(data[index+2:index+4])
+                OIDIndex, length = COUNT_LENGTH.unpack_from(data, index)
+                OIDType = self.attributeType(OIDIndex)
                 index += 4
 
+                # Skip attributes that are not selected without reading them
+                if self.selectedAttributes is not None and OIDType not in self.selectedAttributes:
+                    index += length
+                    continue
+
                 # Initialize AVAType variables
                 current_message_dict['AttributeList']['AVAType'][OIDType] = {}
                 current_message_dict['AttributeList']['AVAType'][OIDType]['length'] = length
@@ -1490,8 +2001,8 @@ class IntellivueDecoder(object):
 
         # Initialize Variables
         current_message_dict[data_type] = {}
-        current_message_dict[data_type]['count'] = self.get16(data[index: index+2])
-        current_message_dict[data_type]['length'] = self.get16(data[index+2: index+4])
+        current_message_dict[data_type]['count'] = UINT16.unpack_from(data, index)[0]
+        current_message_dict[data_type]['length'] = UINT16.unpack_from(data, index+2)[0]
         index += 4
 
         # Initialize data_value
@@ -1513,37 +2024,32 @@ class IntellivueDecoder(object):
         Reads in VariableLabels
         """
 
-        # Initialize Variables
-        current_message_dict['VariableLabel'] = {}
-        current_message_dict['VariableLabel']['length'] = self.get16(data[index: index+2])
-        current_message_dict['VariableLabel']['value'] = []
+        length = UINT16.unpack_from(data, index)[0]
         index += 2
 
-        # Read through the values "length" times
-        for i in range(current_message_dict['VariableLabel']['length']):
+        # The "length" uint8s that follow, as a list
+        current_message_dict['VariableLabel'] = {'length': length, 'value': list(data[index:index+length])}
 
-            current_message_dict['VariableLabel']['value'].append(self.get8(data[i:i+1]))
-            index += 1
-
-        return index
+        return index + length
 
     # Reads in data types of format [length, value[length uint16s]], returns index
     def readVariableData(self, index, current_message_dict, data):
         """
-        Reads in VariableData (ie actual data values of uint16s)
+        Reads in VariableData (ie actual data values of uint16s, as a big-endian
+        numpy array viewing the message)
         """
 
         # Initialize Variables
         current_message_dict['VariableData'] = {}
-        current_message_dict['VariableData']['length'] = self.get16(data[index: index+2])
-        current_message_dict['VariableData']['value'] = []
+        current_message_dict['VariableData']['length'] = UINT16.unpack_from(data, index)[0]
         index += 2
 
-        # Read through the values "length" times
-        for i in range(int(current_message_dict['VariableData']['length']/2)):
-
-            current_message_dict['VariableData']['value'].append(self.get16(data[index: index+2]))
-            index += 2
+        # Read all "length/2" values as one big-endian array viewing the
+        # message, not copied: the receive buffer of RS232 is never overwritten,
+        # and the distiller converts the samples as it scales them
+        count = current_message_dict['VariableData']['length'] // 2
+        current_message_dict['VariableData']['value'] = np.frombuffer(data, SAMPLES, count, index)
+        index += 2 * count
 
         return index
 
@@ -1551,104 +2057,57 @@ class IntellivueDecoder(object):
     def readString(self, index, current_message_dict, data):
         """
         Reads in Strings
-        dumbest formatting ever - utf-16, and each of the two bytes in order
-        has to be swapped
+        utf-16 big endian, decoded in one go (a trailing odd byte is ignored).
+        Each character used to be decoded on its own, where U+FEFF and U+FFFE
+        read as byte order marks, so those are still left out; surrogate
+        pairs, which failed that way, are now decoded.
         """
-        # Initialize Variables
-        current_message_dict['String'] = {}
-        current_message_dict['String']['length'] = self.get16(data[index: index+2])
-
+        length = UINT16.unpack_from(data, index)[0]
         index += 2
 
-        byte_values = data[index:index+current_message_dict['String']['length']]
-        current_message_dict['String']['value'] = ''
-
-        for i in range(0, int(current_message_dict['String']['length']/2), 1):
-            temp = byte_values[2*i+1:2*i+2] + byte_values[2*i:2*i+1]
-            # This fixes a number of things that turn out to be important and should not be ignored.
-            # current_message_dict['String']['value'] += temp.decode('utf-16', errors='ignore')
-            current_message_dict['String']['value'] += temp.decode('utf-16')
-
-        current_message_dict['String']['value'] = current_message_dict['String']['value'].split(' ')[0]
+        value = codecs.decode(data[index:index + length - length % 2], 'utf-16-be')
+        if '\ufeff' in value or '\ufffe' in value:
+            value = value.translate(BYTE_ORDER_MARKS)
 
-        # if current_message_dict.get('String').get('value'):
-        #     logging.debug(current_message_dict.get('String').get('value'))
+        current_message_dict['String'] = {'length': length, 'value': value.split(' ')[0]}
 
-        index += current_message_dict['String']['length']
+        index += length
         return index
 
     # Reads in data types of FLOAT format, returns index
     def readFLOAT(self, index, current_message_dict, data):
         """
-        Reads in Floats
+        Reads in Floats (exponent and mantissa as one uint32, see floatValue())
         """
-        # Initialize Variables
-        current_message_dict['FLOATType'] = {}
-
-        # Check for exceptions
-        if data[index+1:index+4] == b'\x7F\xFF\xFF':
-            current_message_dict['FLOATType'] = 'Not a number'
-
-        elif data[index+1:index+4] == b'\x80\x00\x00':
-            current_message_dict['FLOATType'] = 'Not at this resolution'
-
-        elif data[index+1:index+4] ==b'\x7F\xFF\xFE':
-            current_message_dict['FLOATType'] = 'Positive Infinity'
+        current_message_dict['FLOATType'] = floatValue(UINT32.unpack_from(data, index)[0])
 
-        elif data[index+1:index+4] ==b'\x80\x00\x02':
-            current_message_dict['FLOATType'] = 'Negative Infinity'
-
-        else:
-            exponent = struct.unpack('>b',data[index:index+1])[0]
-            (num1, num2, num3) = struct.unpack('>BBB', data[index+1:index+4])
-            mantissa = (num1*65536)+(num2*256)+num3
-            if mantissa >= 0x800000:
-                mantissa -= 0x1000000
-
-            current_message_dict['FLOATType'] = mantissa * 10 ** exponent
-
-        index += 4
-
-        return index
+        return index + 4
 
     # Read in data type of al_source_code, returns index
     def readAlSourceCode(self, index, current_message_dict, data):
         """
         Reads in DevAlarmEntry
         """
-        # Store source
-        source = data[index:index+2]
-        index += 2
-
-        # Store and determine code (ignoring last bit)
-        # converting bc event types has binary keys
-        code = self.get16(data[index:index+2])
-        index += 2
+        # Store source and code
+        source, code = COUNT_LENGTH.unpack_from(data, index)
+        index += 4
 
         # Based on code, determine source in OID or SCADA
-        if code & 1:
-            if source in self.DataKeys['OIDType']:
-                current_message_dict['al_source'] = self.DataKeys['OIDType'][source]
-            else:
-                current_message_dict['al_source'] = self.get16(source)
-        else:
-            if source in self.DataKeys['SCADAType']:
-                current_message_dict['al_source'] = self.DataKeys['SCADAType'][source]
-            else:
-                current_message_dict['al_source'] = self.get16(source)
+        labels = self.labelTable('OIDType', 2) if code & 1 else self.labelTable('SCADAType', 2)
+        current_message_dict['al_source'] = labels.get(source, source)
 
-        # Set code to bytes to iterate through EventTypes, turn off last bit
+        # Look up the code in EventTypes (keyed by number), ignoring the last bit
         code = code & ~1
-        if code in self.DataKeys['EventTypes']:
-            current_message_dict['al_code'] = self.DataKeys['EventTypes'][code]
-        else:
-            current_message_dict['al_code'] = code
+        current_message_dict['al_code'] = self.DataKeys['EventTypes'].get(code, code)
 
         return index
 
     # Iterates recursively through data structure, returns index
     def recurseRead(self, message_list, index, current_message_dict, data):
         """
+        Interprets DataTypes on every call; readData() runs the equivalent
+        compiled plans instead (see decodePlan())
+
         Inputs:
         message_list: A list of the data types stored in the message
         index: The current index being parsed
@@ -1709,89 +2168,158 @@ class IntellivueDecoder(object):
                 # If there is an integer (ie got to basic data type)
                 elif type(self.DataTypes[data_type][0]) == int:
 
-                    # Read out uint32
-                    if self.DataTypes[data_type][0] == 32:
-                        bit_range = data[index:index+4]
-                        index += 4
+                    # Read out uint32 / uint16 in place
+                    if self.DataTypes[data_type][0] == 32 or self.DataTypes[data_type][0] == 16:
 
-                    # Read out uint16
-                    elif self.DataTypes[data_type][0] == 16:
+                        size = 4 if self.DataTypes[data_type][0] == 32 else 2
+                        value = (UINT32 if size == 4 else UINT16).unpack_from(data, index)[0]
 
-                        bit_range = data[index:index+2]
-                        index += 2
+                        # If there is a key associated with the int
+                        # store the label, otherwise the value
+                        labels = self.labelTable(data_type, size)
+                        if labels:
+                            value = labels.get(value, value)
+
+                        current_message_dict[data_type] = value
+                        index += size
 
                     # Read out int16 (note: only 1 case)
                     elif self.DataTypes[data_type][0] == -16:
-                        current_message_dict[data_type] = self.geti16(data[index:index+2])
+                        current_message_dict[data_type] = INT16.unpack_from(data, index)[0]
                         index += 2
-                        bit_range = b''
 
                     # for uint8s there is a second value indicating how many uint8s there are
                     elif self.DataTypes[data_type][0] == 8:
 
                         # Deal with BCD encoding
                         if self.DataTypes[data_type][1] == 'bcd':
-                            bit_range = b''
-                            temp_value = self.get8(data[index:index+1])
-                            temp_bin = '{0:08b}'.format(temp_value)
-                            digit_one = int(temp_bin[0:4],2)
-                            digit_two = int(temp_bin[4:8],2)
-                            value = int(str(digit_one) + str(digit_two))
-                            current_message_dict[data_type] = value
+                            current_message_dict[data_type] = BCD_VALUES[data[index]]
                             index += 1
 
                         elif self.DataTypes[data_type][1] == 1:
-                            bit_range = data[index:index+1]
+                            value = UINT8.unpack_from(data, index)[0]
+                            labels = self.byteLabels(data_type)
+                            if labels is not None:
+                                value = labels[value]
+                            current_message_dict[data_type] = value
                             index += 1
 
                         else:
-                            bit_range = []
-                            for i in range(self.DataTypes[data_type][1]):
-                                bit_range.append(self.get8(data[index:index+1]))
-                                index += 1
-
-                    # If there is a key associated with the int
-                    # store the value in the created dictionary
-                    if self.DataKeys.get(data_type, 'Not Defined') != 'Not Defined':
-
-                        current_message_dict[data_type] = self.DataKeys[data_type].get(bit_range,bit_range)
+                            current_message_dict[data_type] = list(data[index:index+self.DataTypes[data_type][1]])
+                            index += self.DataTypes[data_type][1]
 
-                        # If bytes, then convert to int
-                        if type(current_message_dict[data_type]) == bytes:
-
-                            if len(bit_range) == 4:
-
-                                current_message_dict[data_type] = self.get32(bit_range)
-
-                            elif len(bit_range) == 2:
-
-                                current_message_dict[data_type] = self.get16(bit_range)
-
-                    # Otherwise just store the values
-                    elif len(bit_range) == 4 and type(bit_range) == bytes:
-
-                        current_message_dict[data_type] = self.get32(bit_range)
+                # If not a basic data type, than reiterate through with the
+                # next level of the data tree
+                else:
 
-                    elif len(bit_range) == 2 and type(bit_range) == bytes:
+                    current_message_dict[data_type] = {}
+                    index = self.recurseRead(self.DataTypes[data_type], index, current_message_dict[data_type], data)
 
-                        current_message_dict[data_type] = self.get16(bit_range)
+        return index
 
-                    elif len(bit_range) == 1 and type(bit_range) == bytes:
+    # Returns the compiled plan reading message_list, compiling it on first use
+    def decodePlan(self, message_list):
+        """
+        The plan reads exactly what recurseRead(message_list, ...) reads, see
+        DecodePlan. Plans are compiled from DataTypes and DataKeys as they are
+        when first used.
 
-                        current_message_dict[data_type] = self.get8(bit_range)
+        returns: plan - function(data, index, current_message_dict) -> index
+        """
+        key = tuple(data_type for data_type in message_list if type(data_type) != list)
 
-                    elif bit_range != b'':
+        plan = self.decodePlans.get(key)
+        if plan is None:
+            plan = self.decodePlans[key] = DecodePlan(self, key).function
 
-                        current_message_dict[data_type] = bit_range
+        return plan
 
-                # If not a basic data type, than reiterate through with the
-                # next level of the data tree
-                else:
+    # Restricts decoding to the given attributes (None decodes all of them again)
+    def selectAttributes(self, OIDTypes=None):
+        """
+        Attributes of any other type are skipped using their length, without
+        being read, and are left out of the AVAType of their AttributeList
+        (whose count and length stay those of the message). Attributes nested
+        in a skipped one are skipped with it, and those in REQUIRED_ATTRIBUTES
+        are always decoded.
 
-                    current_message_dict[data_type] = {}
-                    index = self.recurseRead(self.DataTypes[data_type], index, current_message_dict[data_type], data)
+        OIDTypes - names of the attributes, as the keys of AVAType
+        """
+        if OIDTypes is None:
+            self.selectedAttributes = None
+        else:
+            self.selectedAttributes = frozenset(OIDTypes) | REQUIRED_ATTRIBUTES
+
+        # Plans compiled so far are still valid, only the dispatch changes
+        self.attributePlans.clear()
+
+    # Returns the AVAType key and plan of an attribute id (None if not defined, False if not selected)
+    def attributePlan(self, OIDIndex):
+        plan = self.attributePlans.get(OIDIndex)
+        if plan is not None:
+            return plan
+
+        OIDType = self.attributeType(OIDIndex)
+        if self.selectedAttributes is not None and OIDType not in self.selectedAttributes:
+            plan = (OIDType, False)
+        elif isinstance(OIDType, str):
+            plan = (OIDType, self.decodePlan([self.DataKeys['AttributeType'].get(OIDType, OIDType)]))
+        else:
+            plan = (OIDType, None)
+
+        self.attributePlans[OIDIndex] = plan
+        return plan
+
+    # Returns the AVAType key of an attribute id: its OIDType, or the id as
+    # bytes if it has none
+    def attributeType(self, OIDIndex):
+        if OIDIndex == 0x0001:
+            return 'NOM_POLL_PROFILE_SUPPORT'
+        elif OIDIndex == 0x0102:
+            return 'NOM_MDIB_OBJ_SUPPORT'
+        elif OIDIndex == 0xF001:
+            return 'NOM_ATTR_POLL_PROFILE_EXT'
+        # Fix from @uday for u'ALL' problem 3/18
+        elif OIDIndex == 0x0000:
+            return 0
+
+        # This is the real dictionary, incorporate partitions somehow
+        OIDType = self.labelTable('OIDType', 2).get(OIDIndex)
+        return OIDType if OIDType is not None else UINT16.pack(OIDIndex)
+
+    # Returns the labels of a data type read as an unsigned integer of size bytes
+    def labelTable(self, data_type, size):
+        """
+        DataKeys tables hold both directions, with the values as byte strings.
+        Values read from a message are looked up by number in a table of the
+        one direction instead, without making byte strings. Tables are built
+        from DataKeys as they are when first used (as decode plans are).
 
-        return index
+        returns: labels - {value: label}, empty if the data type has no labels
+        """
+        labels = self.labelTables.get((data_type, size))
+        if labels is None:
+            keys = self.DataKeys.get(data_type)
+            labels = Labels()
+            for key, label in (keys.items() if isinstance(keys, dict) else ()):
+                if isinstance(key, bytes) and len(key) == size and label is not None and type(label) != bytes:
+                    labels[int.from_bytes(key, 'big')] = label
+            self.labelTables[data_type, size] = labels
+
+        return labels
+
+    # Returns the label of every uint8 value of a data type (unknown values as a
+    # byte string), None if it has no labels
+    def byteLabels(self, data_type):
+        if not isinstance(self.DataKeys.get(data_type), dict):
+            return None
+
+        labels = self.labelTables.get((data_type, 'uint8'))
+        if labels is None:
+            table = self.labelTable(data_type, 1)
+            labels = self.labelTables[data_type, 'uint8'] = tuple(table.get(i, bytes((i,))) for i in range(256))
+
+        return labels
 
     # Main function to read in messages, returns dictionary
     def readData(self,data):
@@ -1799,6 +2327,11 @@ class IntellivueDecoder(object):
         # Determine message type
         message_type = self.getMessageType(data)
 
+        # Reject what cannot be read before reading any of it
+        problem = self.checkMessage(data, message_type)
+        if problem is not None:
+            raise ValueError('Malformed {0}: {1}'.format(message_type, problem))
+
         # Print out Message Type
         #print('Reading in ' + message_type + '...')
 
@@ -1808,16 +2341,23 @@ class IntellivueDecoder(object):
         # Initialize dictionary based on message
         current_message_dict = {}
 
+        # Fields are read in place through a view (keys are looked up with
+        # bytes of just that field)
+        data = memoryview(data)
+
         # Initialize index
         if (message_type == 'AssociationResponse'):
-            index = data.find(b'\xBE\x80\x28\x80\x02\x01\x02\x81') + 8
+            index = bytes(data).find(b'\xBE\x80\x28\x80\x02\x01\x02\x81') + 8
 
         else:
             index = 0
 
-        # Recursively read the message
+        # Read the message with its compiled plan
         if message_type != 'AssociationAbort':
-            finalIndex = self.recurseRead(current_message_list, index, current_message_dict, data)
+            plan = self.messagePlans.get(message_type)
+            if plan is None:
+                plan = self.messagePlans[message_type] = self.decodePlan(current_message_list)
+            finalIndex = plan(data, index, current_message_dict)
         else:
             current_message_dict['AssociationAbort'] = ''
 
@@ -1857,32 +2397,32 @@ class IntellivueDecoder(object):
 
         if ('ASNLength' in data_type):
 
-            if (self.get8(data[index:index+1]) == 130):
-                current_message_dict['ASNLength'] = self.get16(data[index+1:index+3])
+            if (UINT8.unpack_from(data, index)[0] == 130):
+                current_message_dict['ASNLength'] = UINT16.unpack_from(data, index+1)[0]
                 index += 3
 
-            elif (self.get8(data[index:index+1]) == 129):
-                current_message_dict['ASNLength'] = self.get8(data[index+1:index+2])
+            elif (UINT8.unpack_from(data, index)[0] == 129):
+                current_message_dict['ASNLength'] = UINT8.unpack_from(data, index+1)[0]
                 index += 2
 
             else:
-                current_message_dict['ASNLength'] = self.get8(data[index:index+1])
+                current_message_dict['ASNLength'] = UINT8.unpack_from(data, index)[0]
                 index += 1
 
 
         elif ('LILength' in data_type):
 
-            if (self.get8(data[index:index+1]) == 255):
-                current_message_dict['LILength'] = self.get16(data[index+1:index+3])
+            if (UINT8.unpack_from(data, index)[0] == 255):
+                current_message_dict['LILength'] = UINT16.unpack_from(data, index+1)[0]
                 index += 3
 
             else:
-                current_message_dict['LILength'] = self.get8(data[index:index+1])
+                current_message_dict['LILength'] = UINT8.unpack_from(data, index)[0]
                 index += 1
 
         elif ('length' in data_type):
 
-            current_message_dict['length'] = self.get16(data[index:index+2])
+            current_message_dict['length'] = UINT16.unpack_from(data, index)[0]
             index += 2
 
         return index
@@ -2008,27 +2548,37 @@ class IntellivueDecoder(object):
 
     # Writes AttributeLists
     def writeAttributeList(self, message_list, output_message, length, ASNLength, LILength, index, parameters):
+        """
+        The attributes are either listed in DataTypes (ie ['AttributeList', [OIDs]],
+        values taken from parameters), or given in parameters['AttributeList'] as a
+        dict of OID: parameters of that attribute value
+        """
+
+        # Attributes listed next to "AttributeList", otherwise from parameters
+        position = message_list.index('AttributeList')
+        if position + 1 < len(message_list) and type(message_list[position+1]) == list:
+            attributes = message_list[position+1]
+        else:
+            attributes = parameters.get('AttributeList', {})
 
         # Handle Null Attributes
-        if message_list[1][0] == 'Null':
+        if not attributes or list(attributes)[0] == 'Null':
             output_message += b'\x00\x00\x00\x00'
             index += 4
 
         else:
             # count
-            output_message += self.set16(len(message_list[1]))
+            output_message += self.set16(len(attributes))
             index += 2
 
-            # length (stored to be calculated later)
-            # takes the name of the last value in the list and appends it to
-            # length, so when it is done parsing length can be calculated
-            length[self.DataKeys['AttributeType'].get(message_list[1][len(message_list[1])-1]) + '_' + str(index)] = [index]
+            # length (stored to be calculated later, once all attributes are written)
+            list_length = 'AttributeList_' + str(index)
+            length[list_length] = [index]
             output_message += bytearray(b'\xFF\xFF')
             index += 2
 
-
             #AVAType
-            for data_type in message_list[1]:
+            for data_type in attributes:
 
                 # OIDType
                 if (data_type == 'NOM_POLL_PROFILE_SUPPORT'):
@@ -2038,17 +2588,24 @@ class IntellivueDecoder(object):
                 elif (data_type == 'NOM_ATTR_POLL_PROFILE_EXT'):
                     output_message += self.set16(61441)
                 else:
-                    output_message += self.DataKeys['OIDType'][message_list[1][0]]
+                    output_message += self.DataKeys['OIDType'][data_type]
                 index += 2
 
                 # length
                 AttributeType = self.DataKeys['AttributeType'].get(data_type)
-                length[AttributeType + '_' + str(index)] = [index]
+                attribute_length = AttributeType + '_' + str(index)
+                length[attribute_length] = [index]
                 output_message += bytearray(b'\xFF\xFF')
                 index += 2
 
                 # AttributeValue
-                index = self.recurseWrite([AttributeType], output_message, length, ASNLength, LILength, index, parameters)
+                if type(attributes) == dict:
+                    index = self.recurseWrite([AttributeType], output_message, length, ASNLength, LILength, index, attributes[data_type])
+                else:
+                    index = self.recurseWrite([AttributeType], output_message, length, ASNLength, LILength, index, parameters)
+                length[attribute_length][1:] = [index-1]
+
+            length[list_length][1:] = [index-1]
 
         return index
 
@@ -2075,6 +2632,122 @@ class IntellivueDecoder(object):
 
     # Main function to write messages, outputs bytes
     def writeData(self, message_type, *parameter_input):
+        """
+        Messages are written from a template where possible: the unlabelled
+        16 and 32 bit integer parameters (invoke_id, RelativeTime, Handle...)
+        are patched into a copy of the message as encoded before with the
+        same other parameters. A template is made the second time those are
+        seen (see writeTemplate()), so one-off messages are only encoded, and
+        messages with structured contents (attribute lists, poll results) are
+        always encoded.
+        """
+        fields, key = self.templateKey(message_type, parameter_input)
+        if key is None:
+            return self.encodeMessage(message_type, *parameter_input)
+
+        template = self.writeTemplates.get(key)
+        if template is not None:
+            output_message = bytearray(template[0])
+            for offset, packer, name in template[1]:
+                packer.pack_into(output_message, offset, fields[name])
+            return bytes(output_message)
+
+        output_message = self.encodeMessage(message_type, *parameter_input)
+
+        if key not in self.writeTemplates:
+            if key in self.writtenOnce:
+                del self.writtenOnce[key]
+                template = self.writeTemplate(message_type, fields, parameter_input, output_message)
+                self.remember(self.writeTemplates, key, template)
+            else:
+                self.remember(self.writtenOnce, key, True)
+
+        return output_message
+
+    # Splits parameters into the integers patched into templates, and a key for the others
+    def templateKey(self, message_type, parameter_input):
+        """
+        returns: fields - {name: value} of the patched integers
+                 key - (message_type, names of fields, repr of the other parameters),
+                       None if a parameter is a dict or a list of them
+        """
+        parameters = dict(self.MessageParameters.get(message_type) or {})
+        if parameter_input and parameter_input[0]:
+            parameters.update(parameter_input[0])
+
+        fields = {}
+        others = []
+        for name, value in parameters.items():
+            if type(value) == int and self.DataTypes.get(name) in ([16], [32]) and name not in self.DataKeys:
+                fields[name] = value
+            elif type(value) == dict or (type(value) == list and value and type(value[0]) == dict):
+                return fields, None
+            else:
+                others.append((name, value))
+
+        return fields, (message_type, tuple(fields), repr(others))
+
+    # Returns (template, [(offset, struct, name) of each patched field]), None if there can be none
+    def writeTemplate(self, message_type, fields, parameter_input, output_message):
+        """
+        The message is encoded with every field zeroed, and with each field set
+        to its position in fields (plus the top bit, so its first byte always
+        differs): the differing bytes locate each field (written once or more).
+        The template must give back output_message, as encoded with the actual
+        values, to be kept.
+        """
+        names = list(fields)
+        if not names:
+            return output_message, []
+
+        parameters = dict(parameter_input[0]) if parameter_input and parameter_input[0] else {}
+
+        parameters.update(dict.fromkeys(names, 0))
+        template = self.encodeMessage(message_type, parameters)
+
+        for position, name in enumerate(names):
+            parameters[name] = (1 << (self.DataTypes[name][0] - 1)) | (position + 1)
+        probe = self.encodeMessage(message_type, parameters)
+
+        if len(probe) != len(template):
+            return None
+
+        patches = []
+        offset = 0
+        while offset < len(template):
+            if template[offset] == probe[offset]:
+                offset += 1
+                continue
+
+            for packer in (UINT16, UINT32):
+                if offset + packer.size > len(probe):
+                    continue
+                value = packer.unpack_from(probe, offset)[0]
+                position = (value & ~(1 << (8*packer.size - 1))) - 1
+                if value >> (8*packer.size - 1) and 0 <= position < len(names) and \
+                        self.DataTypes[names[position]][0] == 8*packer.size:
+                    patches.append((offset, packer, names[position]))
+                    offset += packer.size
+                    break
+            else:
+                return None
+
+        patched = bytearray(template)
+        for offset, packer, name in patches:
+            packer.pack_into(patched, offset, fields[name])
+        if patched != output_message:
+            return None
+
+        return template, patches
+
+    # Adds an entry to a bounded cache, dropping its oldest one when full
+    def remember(self, cache, key, value):
+        if len(cache) >= WRITE_TEMPLATES:
+            del cache[next(iter(cache))]
+        cache[key] = value
+
+    # Encodes a message by walking its DataTypes, returns bytes
+    def encodeMessage(self, message_type, *parameter_input):
 
         # Load in list defining data types in message
         message_list = self.MessageLists[message_type]
@@ -2137,6 +2810,142 @@ class IntellivueDecoder(object):
 
         return index
 
+    # Writes data types of format [count, length, value[count]]
+    def writeVariableLengthList(self, data_type, output_message, length, ASNLength, LILength, index, parameters):
+        """
+        parameters[data_type] is a list with the parameters of each entry
+        """
+
+        entries = parameters[data_type]
+
+        # count
+        output_message += self.set16(len(entries))
+        index += 2
+
+        # length (stored to be calculated later)
+        list_length = data_type + '_' + str(index)
+        length[list_length] = [index]
+        output_message += bytearray(b'\xFF\xFF')
+        index += 2
+
+        for entry in entries:
+            index = self.recurseWrite([self.DataTypes[data_type][2]], output_message, length, ASNLength, LILength, index, entry)
+
+        length[list_length][1:] = [index-1]
+
+        return index
+
+    # Writes VariableLabels (length, uint8s)
+    def writeVariableLabel(self, output_message, index, parameters):
+
+        value = parameters['VariableLabel']
+        if type(value) == str:
+            value = value.encode('ascii')
+
+        output_message += self.set16(len(value))
+        output_message += bytearray(value)
+
+        return index + 2 + len(value)
+
+    # Writes VariableData (length in bytes, uint16s)
+    def writeVariableData(self, output_message, index, parameters):
+
+        value = parameters['VariableData']
+
+        output_message += self.set16(2*len(value))
+        output_message += struct.pack('>{0}H'.format(len(value)), *value)
+
+        return index + 2 + 2*len(value)
+
+    # Writes Strings (utf-16, big endian)
+    def writeString(self, output_message, index, parameters):
+
+        value = parameters['String'].encode('utf-16-be')
+
+        output_message += self.set16(len(value))
+        output_message += value
+
+        return index + 2 + len(value)
+
+    # Writes FLOATs (int8 exponent, int24 mantissa)
+    def writeFLOAT(self, output_message, index, parameters):
+
+        value = parameters['FLOATType']
+
+        # Several FLOATs in the same structure are stored IN ORDER
+        if type(value) == list:
+            value = parameters['FLOATType'].pop(0)
+
+        special_values = {
+            'Not a number': b'\x00\x7F\xFF\xFF',
+            'Not at this resolution': b'\x00\x80\x00\x00',
+            'Positive Infinity': b'\x00\x7F\xFF\xFE',
+            'Negative Infinity': b'\x00\x80\x00\x02',
+        }
+
+        if value in special_values:
+            output_message += special_values[value]
+
+        else:
+            # Shift decimals into the mantissa, as long as it stays in 24 bits
+            exponent = 0
+            mantissa = value
+            while abs(mantissa - round(mantissa)) > 1e-9 * abs(mantissa) and abs(mantissa) < 0x7FFFFD // 10:
+                mantissa *= 10
+                exponent -= 1
+            mantissa = int(round(mantissa))
+
+            while abs(mantissa) > 0x7FFFFD:
+                mantissa = int(round(mantissa / 10))
+                exponent += 1
+
+            output_message += struct.pack('>b', exponent)
+            output_message += struct.pack('>i', mantissa)[1:]
+
+        return index + 4
+
+    # Writes al_source_code (source, code)
+    def writeAlSourceCode(self, output_message, index, parameters):
+
+        source = parameters['al_source']
+        code = self.DataKeys['EventTypes'].get(parameters['al_code'], parameters['al_code'])
+
+        # Odd code means the source is an OID, otherwise a SCADA type
+        if type(source) == str and source in self.DataKeys['OIDType']:
+            source = self.DataKeys['OIDType'][source]
+            code |= 1
+        elif type(source) == str:
+            source = self.DataKeys['SCADAType'][source]
+        else:
+            source = self.set16(source)
+
+        output_message += source
+        output_message += self.set16(code)
+
+        return index + 4
+
+    # Returns binary of an integer data type (according to DataTypes)
+    def setInteger(self, data_type, value):
+
+        if self.DataTypes[data_type][0] == 32:
+            return self.set32(value)
+
+        elif self.DataTypes[data_type][0] == 16:
+            return self.set16(value)
+
+        elif self.DataTypes[data_type][0] == -16:
+            return bytearray(struct.pack('>h', value))
+
+        # uint8s, either BCD, single or a list of "n" values
+        elif self.DataTypes[data_type][1] == 'bcd':
+            return self.set8(16*(value//10) + value % 10)
+
+        elif self.DataTypes[data_type][1] == 1:
+            return self.set8(value)
+
+        else:
+            return bytearray(value)
+
     # Iterates recursively through data structure, returns index
     def recurseWrite(self,message_list,output_message, length, ASNLength, LILength, index, parameters):
 
@@ -2155,6 +2964,32 @@ class IntellivueDecoder(object):
 
                     index = self.writeTextIdLabel(message_list, output_message, length, ASNLength, LILength, index, parameters)
 
+                # Data types that need separate writers
+                elif data_type == 'VariableLabel':
+
+                    index = self.writeVariableLabel(output_message, index, parameters)
+
+                elif data_type == 'VariableData':
+
+                    index = self.writeVariableData(output_message, index, parameters)
+
+                elif data_type == 'String':
+
+                    index = self.writeString(output_message, index, parameters)
+
+                elif data_type == 'FLOATType':
+
+                    index = self.writeFLOAT(output_message, index, parameters)
+
+                elif data_type == 'al_source_code':
+
+                    index = self.writeAlSourceCode(output_message, index, parameters)
+
+                # VariableLengthLists with the parameters of every entry
+                elif self.DataTypes.get(data_type, [None])[0] == 'count' and type(parameters.get(data_type)) == list:
+
+                    index = self.writeVariableLengthList(data_type, output_message, length, ASNLength, LILength, index, parameters)
+
                 # If data can still be broken down farther along the tree, then do so
                 elif self.DataTypes.get(data_type,'none') != 'none' and type(self.DataTypes.get(data_type,'none')[0]) != int:
 
@@ -2194,18 +3029,14 @@ class IntellivueDecoder(object):
                     # Set value based on parameters
                     value = parameters[data_type]
 
-                    if type(value) == list:
+                    # (a list of uint8s is a single value)
+                    if type(value) == list and self.DataTypes[data_type][0:2] != [8, len(value)]:
                         value = value[0]
                         del parameters[data_type][0]
 
                     # Write in value based on data_type
-                    if self.DataTypes[data_type][0] == 32:
-                        output_message += bytes(self.set32(value))
-                        index += len(bytes(self.set32(value)))
-
-                    elif self.DataTypes[data_type][0] == 16:
-                        output_message += bytes(self.set16(value))
-                        index += len(bytes(self.set16(value)))
+                    output_message += self.setInteger(data_type, value)
+                    index += len(self.setInteger(data_type, value))
 
                 # if DataKeys just a bytearray, then add array to output_message
                 elif type(self.DataKeys[data_type]) == bytearray:
@@ -2223,36 +3054,40 @@ class IntellivueDecoder(object):
                     # use dict - solution is to store the values IN ORDER
                     # in parameter list, and then delete them once they are used
                     if type(keyed_value) == list:
-                        output_message += self.DataKeys[data_type][keyed_value[0]]
-                        index += len(self.DataKeys[data_type][keyed_value[0]])
+                        keyed_value = keyed_value[0]
                         del parameters[data_type][0]
 
-                    else:
-                        output_message += self.DataKeys[data_type][keyed_value]
-                        index += len(self.DataKeys[data_type][keyed_value])
+                    # Values without a key (ie numbers) are written as is
+                    value = self.DataKeys[data_type].get(keyed_value)
+                    if type(value) not in (bytes, bytearray):
+                        value = self.setInteger(data_type, keyed_value)
+
+                    output_message += value
+                    index += len(value)
 
                 # If data type not defined print it out
                 else:
                     logging.warn('Could not find data type for: ' + data_type)
 
-                # Check end indicies of lengths
+                # Check end indicies of lengths (the first data type of that
+                # name to end after the length closes it)
                 for k in length.keys():
 
-                    if data_type in k:
+                    if k.rsplit('_', 1)[0] == data_type and len(length[k]) == 1:
 
                         length[k].append(index-1)
 
 
                 for k in ASNLength.keys():
 
-                    if data_type in k:
+                    if k.rsplit('_', 1)[0] == data_type and len(ASNLength[k]) == 1:
 
                         ASNLength[k].append(index-1)
 
 
                 for k in LILength.keys():
 
-                    if data_type in k:
+                    if k.rsplit('_', 1)[0] == data_type and len(LILength[k]) == 1:
 
                         LILength[k].append(index-1)
 
@@ -2318,6 +3153,59 @@ class IntellivueDecoder(object):
 
         return message_type
 
+    # Returns what is wrong with the structure of a message, None if it can be read
+    def checkMessage(self, data, message_type=None):
+        """
+        Checks, in constant time and before any decoding, that readData()
+        knows the message type, and that the length fields the message starts
+        with (LI of association responses; ROapdus and ROIV/RORS/ROLRS apdus;
+        PollInfoList of poll results) match its size. Frames cut short or
+        corrupted past the CRC check are rejected this way, instead of failing
+        deep in the decode.
+
+        message_type - as returned by getMessageType(), found if not given
+        """
+        if message_type is None:
+            message_type = self.getMessageType(data)
+
+        if message_type not in self.MessageLists or type(self.MessageLists[message_type]) != list:
+            return 'no reader for message type'
+
+        size = len(data)
+
+        if message_type == 'AssociationResponse':
+            if size < 4:
+                return 'shorter than its header'
+            length, start = (UINT16.unpack_from(data, 2)[0], 4) if data[1] == 0xFF else (data[1], 2)
+            if length != size - start:
+                return 'LI length {0} for {1} bytes'.format(length, size - start)
+
+        # SPpdu (or the Nomenclature of a ConnectIndicationEvent), then ROapdus
+        elif data[0] == 0xE1 or message_type == 'ConnectIndicationEvent':
+            if size < 14:
+                return 'shorter than its header'
+            ro_type, length = COUNT_LENGTH.unpack_from(data, 4)
+            if length != size - 8:
+                return 'ROapdus length {0} for {1} bytes'.format(length, size - 8)
+
+            # ROLRSapdu starts with a RolrsId
+            start = 10 if ro_type == 0x0005 else 8
+            if size < start + 6:
+                return 'shorter than its header'
+            length = UINT16.unpack_from(data, start + 4)[0]
+            if length != size - start - 6:
+                return 'remote operation length {0} for {1} bytes'.format(length, size - start - 6)
+
+            start = POLL_INFO_OFFSETS.get(message_type)
+            if start is not None:
+                if size < start + 4:
+                    return 'shorter than its header'
+                length = UINT16.unpack_from(data, start + 2)[0]
+                if length != size - start - 4:
+                    return 'PollInfoList length {0} for {1} bytes'.format(length, size - start - 4)
+
+        return None
+
 
 if __name__ == '__main__':
 
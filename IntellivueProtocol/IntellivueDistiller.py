@@ -12,15 +12,31 @@ import datetime
 import time
 import numpy as np
 from IntellivueProtocol import IntellivueDecoder
+from IntellivueProtocol.NumericsStore import NumericsStore
 
 import logging
 
+# Nanoseconds per RelativeTime tick (8 kHz)
+TICK_NS = 125000
+
 class IntellivueDistiller(object):
     """
     This class works with decoded messages yielded by the IntellivueDecoder and
     extracts key vitals data into timestamped dictionaries.
+
+    Timestamps are int64 nanoseconds of the host's monotonic clock: the
+    RelativeTime of a message, in 8 kHz ticks, from the time the association
+    was made (see timestamp()). toDatetime() gives the monitor's date and time
+    of a timestamp, for export and display.
     """
 
+    # Attributes read by the refine methods (see IntellivueDecoder.selectAttributes())
+    ATTRIBUTES = ('NOM_ATTR_ID_HANDLE', 'NOM_ATTR_ID_LABEL', 'NOM_ATTR_UNIT_CODE',
+                  'NOM_ATTR_TIME_PD_SAMP', 'NOM_ATTR_SCALE_SPECN_I16',
+                  'NOM_ATTR_SA_VAL_OBS', 'NOM_ATTR_SA_CMPD_VAL_OBS',
+                  'NOM_ATTR_NU_VAL_OBS', 'NOM_ATTR_NU_CMPD_VAL_OBS',
+                  'NOM_ATTR_AL_MON_P_AL_LIST', 'NOM_ATTR_AL_MON_T_AL_LIST')
+
     def __init__(self):
 
         # Initialize Intellivue because has data types
@@ -31,6 +47,7 @@ class IntellivueDistiller(object):
         self.initialTime = str(self.initialTimeDateTime)
 
         self.relativeInitialTime = 0
+        self.initialMonotonic = time.monotonic_ns()
 
         # Creates file to store data (without overwriting previous data)
         # self.patientFolder = patientDirectory
@@ -39,25 +56,45 @@ class IntellivueDistiller(object):
         # Dictionary to be dumped into json file
         self.VitalsWaveData = {}
         self.VitalsWaveInfo = {}
+        # Wave channels by Handle, or by (Handle, SCADAType) for compound values
+        self.waveChannels = {}
+        # Fused distillation (see bindWaves()): destination of channels, and the channel bound to each
+        self.waveSink = None
+        self.boundWaves = {}
         self.VitalsNumericsInfo = {}
         self.VitalsNumericsAlarmsData = {}
         self.VitalsNumericsAlarmsData['Info'] = {}
         self.fileTime = 60*60
 
-    # Stores initial time, which all following times are based off
-    def saveInitialTime(self, decodedInitialTime, relativeDecodedInitialTime):
+        # Numerics trends, of fileTime values per label (1 Hz: an hour)
+        self.numerics = NumericsStore(self.fileTime)
+
+        # Active alarms by (source, code, type), see refine_alarms_message()
+        self.activeAlarms = {}
+
+    # Stores initial time, which all following times are based off, and the
+    # host monotonic time it was received at (default: now)
+    def saveInitialTime(self, decodedInitialTime, relativeDecodedInitialTime, monotonic=None):
+
+        # A (re)association: the monitor's handles may have changed
+        self.resetChannels()
 
         self.initialTime = '{0}/{1}/{2}{3}, {4}:{5}:{6}'.format(decodedInitialTime['month'],decodedInitialTime['day'], decodedInitialTime['century'], decodedInitialTime['year'], decodedInitialTime['hour'], decodedInitialTime['minute'], decodedInitialTime['second'])
         self.VitalsNumericsAlarmsData['Info']['InitialTime'] = self.initialTime
         self.relativeInitialTime = relativeDecodedInitialTime
+        self.initialMonotonic = time.monotonic_ns() if monotonic is None else monotonic
         self.initialTimeDateTime = datetime.datetime(decodedInitialTime['year']+decodedInitialTime['century']*100,decodedInitialTime['month'],decodedInitialTime['day'], decodedInitialTime['hour'], decodedInitialTime['minute'], decodedInitialTime['second'])
 
     def timestamp(self, decoded_message):
-        # Initialize timestamp
-        return self.initialTimeDateTime + datetime.timedelta(seconds=float((decoded_message['PollMdibDataReplyExt']['RelativeTime'] - self.relativeInitialTime)/8000))
+        # Initialize timestamp (int64 ns, see class docstring)
+        return self.initialMonotonic + (decoded_message['PollMdibDataReplyExt']['RelativeTime'] - self.relativeInitialTime) * TICK_NS
+
+    # Date and time of the monitor's clock at a timestamp
+    def toDatetime(self, ts):
+        return self.initialTimeDateTime + datetime.timedelta(microseconds=int(ts - self.initialMonotonic) // 1000)
 
     def strftime(self, ts):
-        return ts.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        return self.toDatetime(ts).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
 
     def refine(self, decoded_message):
         # Handle a decoded message
@@ -78,476 +115,305 @@ class IntellivueDistiller(object):
         return m
 
 
+    # Registers the wave channel(s) described by an attribute-bearing observation
+    def registerWave(self, attributes):
+        """
+        Resolves label, scale, units and sampling frequency of an observation
+        once, and indexes the channel by Handle (simple values) or by
+        (Handle, SCADAType) (compound values) for refine_wave_message
+        """
+        handle = attributes['NOM_ATTR_ID_HANDLE']['AttributeValue']['Handle']
+
+        # Store labels (in case of compound value, the scada labels; otherwise the TextId)
+        if 'NOM_ATTR_SA_CMPD_VAL_OBS' in attributes:
+            logging.debug(attributes)
+            compound = attributes['NOM_ATTR_SA_CMPD_VAL_OBS']['AttributeValue']['SaObsValueCmp']
+            labels = [compound[scada]['SaObsValue']['SCADAType'] for scada in compound if type(compound[scada]) == dict]
+            keys = [(handle, label) for label in labels]
+        else:
+            labels = [attributes['NOM_ATTR_ID_LABEL']['AttributeValue']['TextId']]
+            keys = [handle]
+
+        for label, key in zip(labels, keys):
+
+            # Only the first channel to use a label is kept
+            if label in self.VitalsWaveInfo:
+                continue
+
+            channel = {
+                'Label': label,
+                # Index of data values
+                'Index': 0,
+                # Linear conversion values (ie y = mx + b)
+                'ValueConversion': self.convertValues(attributes['NOM_ATTR_SCALE_SPECN_I16']['AttributeValue']['ScaleRangeSpec16']),
+                'Units': attributes['NOM_ATTR_UNIT_CODE']['AttributeValue']['UNITType'],
+                'SamplingFreq': int(8000/attributes['NOM_ATTR_TIME_PD_SAMP']['AttributeValue']['RelativeTime']),
+                # Handle (to help uniquely identify data type)
+                'Handle': handle,
+                'Sink': self.bindWave(label),
+            }
+
+            self.VitalsWaveInfo[label] = channel
+            self.waveChannels[key] = channel
+
+    # Forgets the wave channels, whose handles are only valid within one association
+    def resetChannels(self):
+        self.VitalsWaveInfo = {}
+        self.waveChannels = {}
+        self.boundWaves = {}
+
+    def bindWaves(self, sink):
+        """
+        Fused distillation: the samples of a wave channel are scaled straight
+        into a destination buffer, rather than returned as a new array.
+        sink(label) returns (name, buffer) for a channel label, or None to keep
+        returning the channel's samples; buffer.store(timestamp, samples, ValueConversion)
+        scales and stores them. refine_wave_message() then reports
+        {name: number of samples} under 'stored'.
+        """
+        self.waveSink = sink
+        self.boundWaves = {}
+        for channel in self.VitalsWaveInfo.values():
+            channel['Sink'] = self.bindWave(channel['Label'])
+
+    # Destination of a new wave channel, the first channel bound to a name keeps it
+    def bindWave(self, label):
+        sink = self.waveSink(label) if self.waveSink else None
+        if sink is None or sink[0] in self.boundWaves:
+            return None
+
+        self.boundWaves[sink[0]] = label
+        return sink
+
     # Save the wave data
     def refine_wave_message(self, decoded_message):
         """
-        Saves data into numpy arrays with timestamps and writes to file
+        Scales the samples of each wave channel in the message, resolving the
+        channel of an observation through self.waveChannels (channels bound to
+        a buffer are stored there, see bindWaves())
         """
 
-        temp_times = np.zeros(1)
+        reply = decoded_message['PollMdibDataReplyExt']
+        channels = self.waveChannels
+        timestamp = self.timestamp(decoded_message)
+        stored = {}
+        samples = 0
         ret = {}
 
         # Go through all of the Single Context Polls
-        for singleContextPolls in decoded_message['PollMdibDataReplyExt']['PollInfoList']:
+        for singleContextPolls in reply['PollInfoList'].values():
 
             # Make sure that they are dicts (ie not length, count), and they aren't empty
-            if type(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]) == dict and decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info']['length'] > 0:
-
-                # Go through all of the Observation Polls (each data modality stored in separate observation poll)
-                for observationPolls in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info']:
-
-                    # Make sure that they are dicts (ie not length, count)
-                    if type(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]) == dict:
-
-                        my_data = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']
-
-                        # If the message contains data regarding value conversion, units, and sampling freq, and is a compound value, store as defined below:
-                        if 'NOM_ATTR_SCALE_SPECN_I16' in my_data and 'NOM_ATTR_SA_CMPD_VAL_OBS' in my_data:
-
-                            # Iterate through all the different data types (ie scada) in the compound value
-                            for scada in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_SA_CMPD_VAL_OBS']['AttributeValue']['SaObsValueCmp']:
-
-                                # Make sure that they are dicts (ie not length, count)
-                                if type(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_SA_CMPD_VAL_OBS']['AttributeValue']['SaObsValueCmp'][scada]) == dict:
-
-                                    # Store label (in case of compound value, simply the scada label)
-                                    label = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_SA_CMPD_VAL_OBS']['AttributeValue']['SaObsValueCmp'][scada]['SaObsValue']['SCADAType']
-
-                                    # If this label isn't in self.VitalsWaveInfo, then initialize values for it
-                                    if label not in self.VitalsWaveInfo:
-
-                                        # Stores basic attributes of each data type
-                                        self.VitalsWaveInfo[label] = {}
-
-                                        # Sampling frequency
-
-                                        logging.debug(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType'])
-
-                                        fs = int(8000/decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_TIME_PD_SAMP']['AttributeValue']['RelativeTime'])
-
-                                        # Initialize numpy array for timestamps and data (length is fs*desired file time - time already elapsed)
-                                        # self.VitalsWaveData[label] = np.zeros((2,fs*self.fileTime - fs*int((decoded_message['PollMdibDataReplyExt']['RelativeTime'] - self.relativeInitialTime)/8000)), dtype = 'float32')
-
-                                        # # Set numpy data array in HDF5 file
-                                        # self.VitalsGroup.create_dataset(label, data = self.VitalsNumericsAlarmsData[label])
-
-                                        # Initialize index (to keep track of index of data values)
-                                        self.VitalsWaveInfo[label]['Index'] = 0
-
-                                        # Initialize linear conversion values (ie y = mx + b)
-                                        self.VitalsWaveInfo[label]['ValueConversion'] = self.convertValues(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_SCALE_SPECN_I16']['AttributeValue']['ScaleRangeSpec16'])
-
-                                        # Initialize units
-                                        self.VitalsWaveInfo[label]['Units'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_UNIT_CODE']['AttributeValue']['UNITType']
-                                        #self.VitalsGroup[label].attrs['Units'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_UNIT_CODE']['AttributeValue']['UNITType']
-
-                                        # Initialize sampling frequency
-                                        # self.VitalsGroup[label].attrs['SamplingFreq'] = fs
-                                        self.VitalsWaveInfo[label]['SamplingFreq'] = fs
-
-                                        # Inititialize Handle (to help uniquely identify scada)
-                                        self.VitalsWaveInfo[label]['Handle'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_ID_HANDLE']['AttributeValue']['Handle']
-
-                        # If the message contains data regarding value conversion, units, and sampling freq, and is not compound, store it as defined below:
-                        elif 'NOM_ATTR_SCALE_SPECN_I16' in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']:
-
-                            # Store label (in case of normal value, is the TextId)
-                            label = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_ID_LABEL']['AttributeValue']['TextId']
-
-                            # If this label isn't in self.VitalsWaveInfo, then initialize values for it
-                            if label not in self.VitalsWaveInfo:
-
-                                # Stores basic attributes of each data type
-                                self.VitalsWaveInfo[label] = {}
-
-                                # Sampling frequency
-                                fs = int(8000/decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_TIME_PD_SAMP']['AttributeValue']['RelativeTime'])
-
-                                # Initialize numpy array - 1hr
-                                # self.VitalsWaveData[label] = np.zeros((2,fs*self.fileTime - fs*int((decoded_message['PollMdibDataReplyExt']['RelativeTime'] - self.relativeInitialTime)/8000)), dtype = 'float32')
-
-                                # # Set numpy array in HDF5 file
-                                # self.VitalsGroup.create_dataset(label, data = self.VitalsNumericsAlarmsData[label])
-
-                                # Initialize index
-                                self.VitalsWaveInfo[label]['Index'] = 0
-
-                                # Initialize linear conversion values (ie y = mx + b)
-                                self.VitalsWaveInfo[label]['ValueConversion'] = self.convertValues(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_SCALE_SPECN_I16']['AttributeValue']['ScaleRangeSpec16'])
-
-                                # Initialize units
-                                self.VitalsWaveInfo[label]['Units'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_UNIT_CODE']['AttributeValue']['UNITType']
-                                # self.VitalsGroup[label].attrs['Units'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_UNIT_CODE']['AttributeValue']['UNITType']
-
-                                # Initialize sampling frequency
-                                #self.VitalsGroup[label].attrs['SamplingFreq'] = fs
-                                self.VitalsWaveInfo[label]['SamplingFreq'] = fs
-
-                                # Inititialize Handle (to help uniquely identify data type)
-                                self.VitalsWaveInfo[label]['Handle'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_ID_HANDLE']['AttributeValue']['Handle']
-
-                        # If the message contains data, save it
-                        if 'NOM_ATTR_SA_VAL_OBS' in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']:
-
-                            # Determine label based on SCADA Type and Handle
-                            for dataTypes in self.VitalsWaveInfo:
-
-                                # If label identified (ie handle and SCADA type match Text ID)...
-                                # Intellivue의 key가 안넘어오고있음
-                                # if self.VitalsWaveInfo[dataTypes]['Handle'] == decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['Handle'] and decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_SA_VAL_OBS']['AttributeValue']['SaObsValue']['SCADAType'] in self.Intellivue.DataKeys['PhysioKeys'][dataTypes]:
-                                if self.VitalsWaveInfo[dataTypes]['Handle'] == decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['Handle']:
-                                    label = dataTypes
-
-                                    # Create temporary time and data variables
-                                    temp_array = np.array(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_SA_VAL_OBS']['AttributeValue']['SaObsValue']['PhysioValue']['VariableData']['value'])
-                                    temp_times = np.linspace((decoded_message['PollMdibDataReplyExt']['RelativeTime'] - self.relativeInitialTime)/8000, (decoded_message['PollMdibDataReplyExt']['RelativeTime'] - self.relativeInitialTime)/8000 + temp_array.size/self.VitalsWaveInfo[label]['SamplingFreq'], temp_array.size, endpoint=False)
-
-                                    #*self.checkPatientFile(self.VitalsWaveInfo[label], temp_array.size, self.VitalsNumericsAlarmsData[label].shape[1])
-
-                                    # Save on RAM in python dict
-                                    # self.VitalsWaveData[label][:,self.VitalsWaveInfo[label]['Index']:self.VitalsWaveInfo[label]['Index']+temp_array.size] = [temp_times,temp_array*self.VitalsWaveInfo[label]['ValueConversion'][0] + self.VitalsWaveInfo[label]['ValueConversion'][1]]
-
-                                    # Save data to HDF5 File
-                                    # self.VitalsGroup[label][:,self.VitalsWaveInfo[label]['Index']:self.VitalsWaveInfo[label]['Index']+temp_array.size] = [temp_times,temp_array*self.VitalsWaveInfo[label]['ValueConversion'][0] + self.VitalsWaveInfo[label]['ValueConversion'][1]]
-
-                                    # Add to index
-                                    # self.VitalsWaveInfo[label]['Index'] += temp_array.size
-
-                                    ret[label] = temp_array*self.VitalsWaveInfo[label]['ValueConversion'][0] + self.VitalsWaveInfo[label]['ValueConversion'][1]
-
-                        # If the message contains compound data, save it
-                        if 'NOM_ATTR_SA_CMPD_VAL_OBS' in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']:
-
-                            # Determine label based on SCADA Type and Handle
-                            for dataTypes in self.VitalsWaveInfo:
-
-                                # If handle matches...
-                                if self.VitalsWaveInfo[dataTypes]['Handle'] == decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['Handle']:
-
-                                    # iterate through all the compound values
-                                    for saObsValues in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_SA_CMPD_VAL_OBS']['AttributeValue']['SaObsValueCmp']:
-
-                                        # iterate through dictionaries only (ie not count, length)
-                                        if type(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_SA_CMPD_VAL_OBS']['AttributeValue']['SaObsValueCmp'][saObsValues]) == dict:
-
-                                            # Make sure scada type matches data type
-                                            if decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_SA_CMPD_VAL_OBS']['AttributeValue']['SaObsValueCmp'][saObsValues]['SaObsValue']['SCADAType'] == dataTypes:
-
-                                                # Set label appropriately
-                                                label = dataTypes
-
-                                                # Create temporary time and data variables
-                                                temp_array = np.array(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_SA_CMPD_VAL_OBS']['AttributeValue']['SaObsValueCmp'][saObsValues]['SaObsValue']['PhysioValue']['VariableData']['value']).T
-                                                temp_times = np.linspace((decoded_message['PollMdibDataReplyExt']['RelativeTime'] - self.relativeInitialTime)/8000, (decoded_message['PollMdibDataReplyExt']['RelativeTime'] - self.relativeInitialTime)/8000 + temp_array.size/self.VitalsWaveInfo[label]['SamplingFreq'], temp_array.size, endpoint=False).T
-
-                                                #*self.checkPatientFile(self.VitalsWaveInfo[label], temp_array.size, self.VitalsNumericsAlarmsData[label].shape[1])
-
-                                                # Save on RAM in python dict
-#                                                self.VitalsWaveData[label][:,self.VitalsWaveInfo[label]['Index']:self.VitalsWaveInfo[label]['Index']+temp_array.size] = [temp_times,temp_array*self.VitalsWaveInfo[label]['ValueConversion'][0] + self.VitalsWaveInfo[label]['ValueConversion'][1]]
-
-                                                # Save data to HDF5 File
-                                                # self.VitalsGroup[label][:,self.VitalsWaveInfo[label]['Index']:self.VitalsWaveInfo[label]['Index']+temp_array.size] = [temp_times,temp_array*self.VitalsWaveInfo[label]['ValueConversion'][0] + self.VitalsWaveInfo[label]['ValueConversion'][1]]
-
-                                                # Add to index
-#                                                self.VitalsWaveInfo[label]['Index'] += temp_array.size
-
-                                                ret[label] = temp_array*self.VitalsWaveInfo[label]['ValueConversion'][0] + self.VitalsWaveInfo[label]['ValueConversion'][1]
-
-        ret['timestamp'] = self.timestamp(decoded_message)
-
-        if temp_times.any():
+            if type(singleContextPolls) != dict:
+                continue
+            poll_info = singleContextPolls['SingleContextPoll']['poll_info']
+            if poll_info['length'] == 0:
+                continue
+
+            # Go through all of the Observation Polls (each data modality stored in separate observation poll)
+            for observationPolls in poll_info.values():
+
+                # Make sure that they are dicts (ie not length, count)
+                if type(observationPolls) != dict:
+                    continue
+                observation = observationPolls['ObservationPoll']
+                attributes = observation['AttributeList']['AVAType']
+
+                # If the message contains data regarding value conversion, units, and sampling freq, register its channel(s)
+                if 'NOM_ATTR_SCALE_SPECN_I16' in attributes:
+                    self.registerWave(attributes)
+
+                # If the message contains data, save it
+                if 'NOM_ATTR_SA_VAL_OBS' in attributes:
+                    channel = channels.get(observation['Handle'])
+                    if channel is not None:
+                        temp_array = attributes['NOM_ATTR_SA_VAL_OBS']['AttributeValue']['SaObsValue']['PhysioValue']['VariableData']['value']
+                        samples = temp_array.size
+                        self.saveWave(channel, temp_array, timestamp, ret, stored)
+
+                # If the message contains compound data, save each scada type of it
+                if 'NOM_ATTR_SA_CMPD_VAL_OBS' in attributes:
+                    compound = attributes['NOM_ATTR_SA_CMPD_VAL_OBS']['AttributeValue']['SaObsValueCmp']
+                    for saObsValues in compound.values():
+                        if type(saObsValues) != dict:
+                            continue
+                        channel = channels.get((observation['Handle'], saObsValues['SaObsValue']['SCADAType']))
+                        if channel is not None:
+                            temp_array = saObsValues['SaObsValue']['PhysioValue']['VariableData']['value']
+                            samples = temp_array.size
+                            self.saveWave(channel, temp_array, timestamp, ret, stored)
+
+        if stored:
+            ret['stored'] = stored
+        ret['timestamp'] = timestamp
+
+        # The sample times of the last channel (a linspace from the relative time) are not all zero
+        if samples > 1 or (samples == 1 and reply['RelativeTime'] != self.relativeInitialTime):
             # about 25 samples/250ms, so back up 10ms
-            ret['end_time'] = ret['timestamp'] + datetime.timedelta(milliseconds=250-10)
+            ret['end_time'] = ret['timestamp'] + (250-10) * 1000000
 
         if len(ret) < 2:
             return None
 
         return ret
 
+    # Stores the samples of a channel in its buffer, or returns them scaled
+    def saveWave(self, channel, samples, timestamp, ret, stored):
+        if channel['Sink'] is None:
+            ret[channel['Label']] = self.scaleValues(samples, channel['ValueConversion'])
+        else:
+            name, buffer = channel['Sink']
+            buffer.store(timestamp, samples, channel['ValueConversion'])
+            stored[name] = samples.size
+
     # Save the numeric data
     def refine_numerics_message(self, decoded_message):
         """
-        Saves data into numpy arrays with timestamps and writes to file
+        Returns the numerics of the message by label, and appends them to the
+        trends of self.numerics
         """
 
-        currentTime = None
+        reply = decoded_message['PollMdibDataReplyExt']
+        info = self.VitalsNumericsAlarmsData['Info']
+        timestamp = self.timestamp(decoded_message)
+        ret = {'timestamp': timestamp}
 
         # Go through all of the Single Context Polls
-        for singleContextPolls in decoded_message['PollMdibDataReplyExt']['PollInfoList']:
+        for singleContextPolls in reply['PollInfoList'].values():
 
             # Make sure that they are dicts (ie not length, count), and they aren't empty
-            if type(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]) == dict and decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info']['length'] > 0:
-
-                # Go through all of the Observation Polls
-                for observationPolls in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info']:
-
-                    # Make sure that they are dicts (ie not length, count)
-                    if type(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]) == dict:
-
-                        # If the message contains the TextId, append it to self.Vitals['Info']
-                        if 'NOM_ATTR_ID_LABEL' in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']:
-
-                            # TextID
-                            label = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_ID_LABEL']['AttributeValue']['TextId']
-
-                            # Check to make sure label isn't already in self.Vitals['Info']
-                            if label not in self.VitalsNumericsAlarmsData['Info']:
-
-                                # Initialize to store attributes of data type
-                                self.VitalsNumericsAlarmsData['Info'][label] = {}
-
-                                # Inititalize Index
-                                # self.VitalsNumericsInfo[label]['Index'] = 0
+            if type(singleContextPolls) != dict:
+                continue
+            poll_info = singleContextPolls['SingleContextPoll']['poll_info']
+            if poll_info['length'] == 0:
+                continue
+
+            # Go through all of the Observation Polls
+            for observationPolls in poll_info.values():
+
+                # Make sure that they are dicts (ie not length, count)
+                if type(observationPolls) != dict:
+                    continue
+                attributes = observationPolls['ObservationPoll']['AttributeList']['AVAType']
+
+                # If the message contains the TextId, append it to self.VitalsNumericsAlarmsData['Info']
+                if 'NOM_ATTR_ID_LABEL' in attributes:
+                    label = attributes['NOM_ATTR_ID_LABEL']['AttributeValue']['TextId']
+                    if label not in info:
+                        info[label] = {}
+                else:
+                    label = 'noLabel'
+
+                # If there is data, store it
+                if 'NOM_ATTR_NU_VAL_OBS' in attributes:
+                    value = attributes['NOM_ATTR_NU_VAL_OBS']['AttributeValue']['NuObsValue']
+
+                    # If first time storing data, initialize attributes (units), else store it
+                    if label not in info:
+                        info[label] = {'Units': value['UNITType']}
+                    else:
+                        self.saveNumeric(ret, label, timestamp, value['FLOATType'])
+
+                # If compound data type, store each individual value within it
+                if 'NOM_ATTR_NU_CMPD_VAL_OBS' in attributes:
+                    for scada in attributes['NOM_ATTR_NU_CMPD_VAL_OBS']['AttributeValue']['NuObsValCmp'].values():
+
+                        # Make sure to iterate through dicts (ie not count, length)
+                        if type(scada) != dict:
+                            continue
+                        value = scada['NuObsValue']
+
+                        # Create unique scada_label which has both TextID and scada_type
+                        scada_label = label + '_' + value['SCADAType'].split('_')[-1]
+
+                        if scada_label not in info:
+                            info[scada_label] = {'Units': value['UNITType']}
                         else:
-                            label = 'noLabel'
-
-                        # If there is data, store it
-                        if 'NOM_ATTR_NU_VAL_OBS' in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']:
-
-                            # Unique label
-                            # label = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_ID_LABEL']['AttributeValue']['TextId']
-
-                            # If first time storing data, initialize attributes
-                            if label not in self.VitalsNumericsAlarmsData['Info']:
-
-                                # Fs = 1 Hz
-                                #fs = 1
-                                #self.VitalsNumericsInfo[label]['SamplingFreq'] = fs
-
-                                # Initialize numpy array - 1 hr chunk
-                                # self.VitalsNumericsAlarmsData[label] = np.zeros((2,fs*self.fileTime), dtype = 'float32')
-
-                                # Store data in HDF5 file
-                                # self.VitalsNumericsGroup.create_dataset(label, data = self.VitalsNumericsData[label])
+                            self.saveNumeric(ret, scada_label, timestamp, value['FLOATType'])
 
-                                # Initialize units
-                                self.VitalsNumericsAlarmsData['Info'][label] = {}
-                                self.VitalsNumericsAlarmsData['Info'][label]['Units'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_NU_VAL_OBS']['AttributeValue']['NuObsValue']['UNITType']
-                                # self.VitalsNumericsGroup[label].attrs['Units'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_NU_VAL_OBS']['AttributeValue']['NuObsValue']['UNITType']
-
-                            # If attributes confirmed, then can start storing
-                            else:
-                                # temporary time values
-                                temp_time = (decoded_message['PollMdibDataReplyExt']['RelativeTime'] - self.relativeInitialTime)/8000
-
-                                # Initialize timestamp
-                                currentTime = self.initialTimeDateTime + datetime.timedelta(seconds = int((decoded_message['PollMdibDataReplyExt']['RelativeTime'] - self.relativeInitialTime)/8000))
-                                currentTime = str(currentTime.time())
-
-                                # temporary values
-                                temp_value = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_NU_VAL_OBS']['AttributeValue']['NuObsValue']['FLOATType']
-                                # 값 저장 by JG
-                                # If its a string, then don't store it
-                                if type(temp_value) != str:
-
-                                    #self.checkPatientFile(self.Vitals['Info'][label], 1, self.VitalsNumericsData[label].shape[1])
-
-                                    # Store data
-                                    if currentTime in self.VitalsNumericsAlarmsData:
-                                        self.VitalsNumericsAlarmsData[currentTime][label] = temp_value
-                                    else:
-                                        self.VitalsNumericsAlarmsData[currentTime] = {}
-                                        self.VitalsNumericsAlarmsData[currentTime]['timestamp'] = temp_time
-                                        self.VitalsNumericsAlarmsData[currentTime][label] = temp_value
-
-                        # If compound data type...
-                        if 'NOM_ATTR_NU_CMPD_VAL_OBS' in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']:
-
-                            # NOT unique label (each value within the compound value has it)
-                            # Fixed per Uday, "I'm totally guessing now."
-                            # Removed again to fix a re-emergent bug
-                            # label = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_ID_LABEL']['AttributeValue']['TextId']
-
-                            # If the label has been created,
-                            if True:
-                            # Fixed per Uday "I'm not sure why we were holding it to only one label for a compound value".
-                            # if label in self.VitalsNumericsAlarmsData['Info']:
-
-                                # Store temporary time values
-                                temp_time = (decoded_message['PollMdibDataReplyExt']['RelativeTime'] - self.relativeInitialTime)/8000
-
-                                # Initialize timestamp
-                                currentTime = self.initialTimeDateTime + datetime.timedelta(seconds = int((decoded_message['PollMdibDataReplyExt']['RelativeTime'] - self.relativeInitialTime)/8000))
-                                currentTime = str(currentTime.time())
-
-                                # For each individual value within the compound
-                                for scada in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_NU_CMPD_VAL_OBS']['AttributeValue']['NuObsValCmp']:
-
-                                    # Make sure to iterate through dicts (ie not count, length)
-                                    if type(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_NU_CMPD_VAL_OBS']['AttributeValue']['NuObsValCmp'][scada]) == dict:
-
-                                        # Create unique scada_label which has both TextID and scada_type
-                                        scada_type = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_NU_CMPD_VAL_OBS']['AttributeValue']['NuObsValCmp'][scada]['NuObsValue']['SCADAType']
-                                        scada_label = label + '_' + scada_type.split('_')[-1]
-
-                                        # If no data written yet, initialize attributes
-                                        if scada_label not in self.VitalsNumericsAlarmsData['Info']:
-
-                                            # Initialize attribute info
-                                            self.VitalsNumericsAlarmsData['Info'][scada_label] = {}
-
-                                            # Sampling Frequency = 1 Hz
-                                            #fs = 1
-                                            #self.Vitals['Info'][scada_label]['SamplingFreq'] = fs
-
-                                            # Initialize numpy array
-                                            #self.VitalsNumericsData[scada_label] = np.zeros((2,fs*self.fileTime), dtype = 'float32')
-
-                                            # Store numpy array in HDF5
-                                            #self.VitalsNumericsGroup.create_dataset(scada_label, data = self.VitalsNumericsData[scada_label])
-
-                                            # Initialize units
-                                            self.VitalsNumericsAlarmsData['Info'][scada_label]['Units'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_NU_CMPD_VAL_OBS']['AttributeValue']['NuObsValCmp'][scada]['NuObsValue']['UNITType']
-                                            #self.VitalsNumericsGroup[scada_label].attrs['Units'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_NU_CMPD_VAL_OBS']['AttributeValue']['NuObsValCmp'][scada]['NuObsValue']['UNITType']
-
-                                            # Initialize index
-                                            #self.Vitals['Info'][scada_label]['Index'] = 0
-
-                                        # If everything initialized, start writing data
-                                        else:
-                                            # temporary values
-                                            temp_value = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_NU_CMPD_VAL_OBS']['AttributeValue']['NuObsValCmp'][scada]['NuObsValue']['FLOATType']
-
-                                            # If its a string, then don't store it
-                                            if type(temp_value) != str:
-
-                                                # self.checkPatientFile(self.Vitals['Info'][scada_label], 1, self.VitalsNumericsData[scada_label].shape[1])
-
-                                                # save data
-                                                # self.VitalsNumericsData[scada_label][:,self.Vitals['Info'][scada_label]['Index']] = [temp_time,temp_value]
-                                                # self.VitalsNumericsGroup[scada_label][:,self.Vitals['Info'][scada_label]['Index']] = [temp_time,temp_value]
-
-                                                # Store data
-                                                if currentTime in self.VitalsNumericsAlarmsData:
-                                                    self.VitalsNumericsAlarmsData[currentTime][scada_label] = temp_value
-                                                else:
-                                                    self.VitalsNumericsAlarmsData[currentTime] = {}
-                                                    self.VitalsNumericsAlarmsData[currentTime]['timestamp'] = temp_time
-                                                    self.VitalsNumericsAlarmsData[currentTime][scada_label] = temp_value
-
-                                            # add to index
-                                            #self.Vitals['Info'][scada_label]['Index'] += 1
-
-        ret = {'timestamp': self.timestamp(decoded_message)}
-
-        try:
-            if currentTime:
-                for key, value in self.VitalsNumericsAlarmsData[currentTime].items():
-                    if key != 'timestamp':
-                        ret[key] = value
-                # This possibly fixes growing forever problem
-                del self.VitalsNumericsAlarmsData[currentTime]
-        except:
-            no_tAlarm = None
-            # print('Distiller Numeric Error (CurrentTime is not exist)')
-        
         if len(ret) < 2:
             return None
 
         return ret
 
+    # Returns a numeric, and appends it to its trend
+    def saveNumeric(self, ret, label, timestamp, value):
+
+        # If its a string, then don't store it
+        if type(value) != str:
+            ret[label] = value
+            self.numerics.append(label, timestamp, value)
+
     # Save the alarm data
     def refine_alarms_message(self, decoded_message):
         """
-        Saves data into numpy arrays with timestamps and writes to file
+        Updates self.activeAlarms with the active patient (P) and technical (T)
+        alarm lists of the message, returns the alarms raised, changed (state
+        or string) and cleared since the previous lists as 'alarm_events'
         """
 
-        # Initialize return values
-        currentTime = None
+        current = {}
+        kinds = set()
 
         # Go through all of the Single Context Polls
-        for singleContextPolls in decoded_message['PollMdibDataReplyExt']['PollInfoList']:
+        for singleContextPolls in decoded_message['PollMdibDataReplyExt']['PollInfoList'].values():
 
             # Make sure that they are dicts (ie not length, count), and they aren't empty
-            if type(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]) == dict and decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info']['length'] > 0:
-
-                # Go through all of the Observation Polls (each data modality stored in separate observation poll)
-                for observationPolls in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info']:
-
-                    # Make sure that they are dicts (ie not length, count)
-                    if type(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]) == dict:
-
-                        # Initialize timestamp
-                        currentTime = self.initialTimeDateTime + datetime.timedelta(seconds = int((decoded_message['PollMdibDataReplyExt']['RelativeTime'] - self.relativeInitialTime)/8000))
-                        currentTime = str(currentTime.time())
-
-                        # Initialize currentTime
-                        if currentTime not in self.VitalsNumericsAlarmsData:
-                            self.VitalsNumericsAlarmsData[currentTime] = {}
-
-                        # If the message active patient alarm data, store it
-                        if 'NOM_ATTR_AL_MON_P_AL_LIST' in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']:
-
-                            i = 0
-
-                            # Iterate through all the different data types (ie scada) in the compound value
-                            for devAlarm in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_P_AL_LIST']['AttributeValue']['DevAlarmList']:
-
-                                # Make sure that they are dicts (ie not length, count)
-                                if type(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_P_AL_LIST']['AttributeValue']['DevAlarmList'][devAlarm]) == dict:
-
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_P_' + str(i)] = {}
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_P_' + str(i)] ['timestamp'] = currentTime
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_P_' + str(i)]['code'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]\
-                                    ['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_P_AL_LIST']['AttributeValue']['DevAlarmList'][devAlarm]['DevAlarmEntry']['al_code']#.split('NOM_EVT_')[1]
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_P_' + str(i)]['source'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]\
-                                    ['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_P_AL_LIST']['AttributeValue']['DevAlarmList'][devAlarm]['DevAlarmEntry']['al_source']#.split('NOM_')[1]
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_P_' + str(i)]['alarmType'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]\
-                                    ['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_P_AL_LIST']['AttributeValue']['DevAlarmList'][devAlarm]['DevAlarmEntry']['AlertType']#.split('_')[0] + '_P'
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_P_' + str(i)]['state'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]\
-                                    ['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_P_AL_LIST']['AttributeValue']['DevAlarmList'][devAlarm]['DevAlarmEntry']['AlertState']#.split('AL_')[1]
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_P_' + str(i)]['string'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]\
-                                    ['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_P_AL_LIST']['AttributeValue']['DevAlarmList'][devAlarm]['DevAlarmEntry']['StrAlMonInfo']['String']['value']
-                                    i += 1
-
-                        # If the patient contains active technical alarms, store it
-                        if 'NOM_ATTR_AL_MON_T_AL_LIST' in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']:
-
-                            i = 0
-
-                            # Iterate through all the different data types (ie scada) in the compound value
-                            for devAlarm in decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_T_AL_LIST']['AttributeValue']['DevAlarmList']:
-
-                                # Make sure that they are dicts (ie not length, count)
-                                if type(decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_T_AL_LIST']['AttributeValue']['DevAlarmList'][devAlarm]) == dict:
-
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_T_' + str(i)] = {}
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_T_' + str(i)] ['timestamp'] = currentTime
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_T_' + str(i)]['code'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]\
-                                    ['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_T_AL_LIST']['AttributeValue']['DevAlarmList'][devAlarm]['DevAlarmEntry']['al_code']#.split('NOM_EVT_')[1]
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_T_' + str(i)]['source'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]\
-                                    ['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_T_AL_LIST']['AttributeValue']['DevAlarmList'][devAlarm]['DevAlarmEntry']['al_source']#.split('NOM_')[1]
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_T_' + str(i)]['alarmType'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]\
-                                    ['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_T_AL_LIST']['AttributeValue']['DevAlarmList'][devAlarm]['DevAlarmEntry']['AlertType']#.split('_')[0] + '_T'
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_T_' + str(i)]['state'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]\
-                                    ['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_T_AL_LIST']['AttributeValue']['DevAlarmList'][devAlarm]['DevAlarmEntry']['AlertState']#.split('AL_')[1]
-                                    self.VitalsNumericsAlarmsData[currentTime]['Alarm_T_' + str(i)]['string'] = decoded_message['PollMdibDataReplyExt']['PollInfoList'][singleContextPolls]['SingleContextPoll']['poll_info'][observationPolls]\
-                                    ['ObservationPoll']['AttributeList']['AVAType']['NOM_ATTR_AL_MON_T_AL_LIST']['AttributeValue']['DevAlarmList'][devAlarm]['DevAlarmEntry']['StrAlMonInfo']['String']['value']
-                                    i += 1
-
-                        # # Append to file _if_ you are keeping a text file
-                        # with open(self.VitalsNumericsAlarmsDataFile, 'a+') as outfile:
-                        #     json.dump(self.VitalsNumericsAlarmsData, outfile)
-
-        ret = {'timestamp': self.timestamp(decoded_message),
-               'alarms': {} }
-
-        if currentTime:
-            for key, value in self.VitalsNumericsAlarmsData[currentTime].items():
-                if key.startswith('Alarm'):
-                    ret['alarms'][key] = {'source': value['source'],
-                                          'code': value['code'],
-                                          'state': value['state'],
-                                          'string': value['string'],
-                                          'type': value['alarmType']}
-
-            # This possibly fixes growing forever problem
-            del self.VitalsNumericsAlarmsData[currentTime]
-
-        if not ret['alarms']:
+            if type(singleContextPolls) != dict:
+                continue
+            poll_info = singleContextPolls['SingleContextPoll']['poll_info']
+            if poll_info['length'] == 0:
+                continue
+
+            # Go through all of the Observation Polls (each data modality stored in separate observation poll)
+            for observationPolls in poll_info.values():
+
+                # Make sure that they are dicts (ie not length, count)
+                if type(observationPolls) != dict:
+                    continue
+                attributes = observationPolls['ObservationPoll']['AttributeList']['AVAType']
+
+                # A list holds every active alarm of its kind
+                for kind, attribute in [('P', 'NOM_ATTR_AL_MON_P_AL_LIST'), ('T', 'NOM_ATTR_AL_MON_T_AL_LIST')]:
+                    if attribute not in attributes:
+                        continue
+                    kinds.add(kind)
+
+                    for devAlarm in attributes[attribute]['AttributeValue']['DevAlarmList'].values():
+
+                        # Make sure that they are dicts (ie not length, count)
+                        if type(devAlarm) != dict:
+                            continue
+                        entry = devAlarm['DevAlarmEntry']
+                        current[entry['al_source'], entry['al_code'], entry['AlertType']] = kind, entry
+
+        events = []
+        for key, (kind, entry) in current.items():
+            state = entry['AlertState']
+            string = entry['StrAlMonInfo']['String']['value']
+
+            active = self.activeAlarms.get(key)
+            if active is not None and active['state'] == state and active['string'] == string:
+                continue
+
+            self.activeAlarms[key] = {'kind': kind,
+                                      'source': key[0],
+                                      'code': key[1],
+                                      'state': state,
+                                      'string': string,
+                                      'type': key[2]}
+            events.append(('raised' if active is None else 'changed', self.activeAlarms[key]))
+
+        # Alarms missing from a list of their kind are over
+        for key in [key for key, active in self.activeAlarms.items() if active['kind'] in kinds and key not in current]:
+            events.append(('cleared', self.activeAlarms.pop(key)))
+
+        if not events:
             return None
 
-        return ret
+        timestamp = self.timestamp(decoded_message)
+        return {'timestamp': timestamp,
+                'alarm_events': [dict(alarm, event=event, timestamp=timestamp) for event, alarm in events]}
 
     # Reads in dict specified by ScaleRangeSpec16, returns a and b of y = ax + b
     def convertValues(self, ScaleRangeSpec16):
@@ -567,3 +433,14 @@ class IntellivueDistiller(object):
             b = ScaleRangeSpec16['lower_absolute_value']['FLOATType'] - a * ScaleRangeSpec16['lower_scaled_value']
 
             return a, b
+
+    def scaleValues(self, values, ValueConversion):
+        """
+        Converts an array of wave samples with y = ax + b (see convertValues)
+        into a new float32 array, without a float64 intermediate
+        """
+        a, b = ValueConversion
+        scaled = np.multiply(values, a, dtype=np.float32)
+        scaled += b
+
+        return scaled
@@ -0,0 +1,544 @@
+"""
+Simulated Intellivue monitor on a pseudo-terminal, for load testing without hardware.
+
+The simulator opens a PTY and behaves like the monitor at the other end of the
+serial cable: it answers the association handshake (AssociationResponse,
+MDSCreateEvent, priority list result) and then streams
+MDSExtendedPollActionResult messages for every extended poll it is sent
+(waves every 256 ms, numerics and alarms every second), all encoded with
+IntellivueDecoder.writeData().
+
+speed scales the message rate while the monitor's own clock (RelativeTime)
+keeps its pace, so speed=10 delivers ten times the real-time data rate. A PTY
+has no line rate, so speeds beyond what 115200 baud could carry are possible.
+If the client falls behind and the PTY buffer fills, the rest of the frame is
+dropped (and counted in stats['overflows']) like an overflowing UART.
+
+Usage: python -m IntellivueProtocol.IntellivueSimulator [--speed 5]
+           [--waves II:500,Pleth:125] [--numerics HR:72,SpO2:98,RR:16]
+           [--alarms 1]
+
+then point PhilipsTelemetryStream(port=...) at the printed port.
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import array
+import collections
+import datetime
+import errno
+import fcntl
+import logging
+import math
+import os
+import pty
+import random
+import select
+import termios
+import threading
+import time
+import tty
+
+from IntellivueProtocol.IntellivueDecoder import IntellivueDecoder
+from IntellivueProtocol.RS232 import RS232
+
+# Relative time ticks (1/8 ms) per wave poll result, and per numerics/alarms result
+WAVE_PERIOD = 2048
+NUMERIC_PERIOD = 8000
+
+# Fixed ACSE wrapper of the association response; IntellivueDecoder only
+# interprets the user data that follows the marker at the end
+ASSOC_RESP_SESSION_DATA = b'\x05\x08\x13\x01\x00\x16\x01\x02\x80\x00\x14\x02\x00\x02'
+ASSOC_RESP_PRESENTATION_HEAD = (
+    b'\x31\x80\xA0\x80\x80\x01\x01\x00\x00\xA2\x80\xA0\x03\x00\x00\x01\x61\x80'
+    b'\x30\x80\x02\x01\x01\xA0\x80\x61\x80\xBE\x80\x28\x80\x02\x01\x02\x81')
+ASSOC_RESP_TRAILER = b'\x00' * 16
+
+RELEASE_RESPONSE = (
+    b'\x0A\x18\xC1\x16\x61\x80\x30\x80\x02\x01\x01\xA0\x80\x63\x80\x80\x01\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x00')
+
+DEFAULT_WAVES = [('II', 500), ('Pleth', 125)]
+DEFAULT_NUMERICS = [('HR', 72, 0x0AA0), ('SpO2', 98, 0x0220), ('RR', 16, 0x0AE0)]
+
+
+class PTYSocket(object):
+    """
+    Stands in for serial.Serial on the master side of a pseudo-terminal
+    """
+
+    def __init__(self, fd, timeout=0.05):
+        self.fd = fd
+        self.timeout = timeout
+        self.open = True
+        self.overflows = 0
+        os.set_blocking(fd, False)
+
+    @property
+    def in_waiting(self):
+        waiting = array.array('i', [0])
+        fcntl.ioctl(self.fd, termios.FIONREAD, waiting)
+        return waiting[0]
+
+    def read(self, size=1):
+        if not select.select([self.fd], [], [], self.timeout)[0]:
+            return b''
+        try:
+            return os.read(self.fd, size)
+        except BlockingIOError:
+            return b''
+        except OSError as error:
+            # EIO while no client has the other end open
+            if error.errno == errno.EIO:
+                return b''
+            raise
+
+    # Writes without ever blocking; whatever does not fit is dropped
+    def write(self, data):
+        data = memoryview(bytes(data))
+        while data:
+            try:
+                written = os.write(self.fd, data)
+            except BlockingIOError:
+                self.overflows += 1
+                return
+            data = data[written:]
+
+    def isOpen(self):
+        return self.open
+
+    def flushInput(self):
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+
+    def flushOutput(self):
+        pass
+
+    def close(self):
+        if self.open:
+            self.open = False
+            os.close(self.fd)
+
+
+class MonitorLink(RS232):
+    """
+    RS232 framing on the monitor side of the PTY
+    """
+
+    def __init__(self, socket):
+        self.socket = socket
+        self.setupConnection()
+
+
+class IntellivueSimulator(object):
+    """
+    Simulated Intellivue monitor (see module docstring)
+
+    waves: list of (TextId label, sampling frequency in Hz)
+    numerics: list of (TextId label, value, unit code)
+    alarms: number of active patient alarms (one technical alarm is added if > 1)
+    speed: data rate as a multiple of real time
+    """
+
+    def __init__(self, waves=None, numerics=None, alarms=0, speed=1.0):
+        self.decoder = IntellivueDecoder()
+        self.speed = speed
+
+        self.waves = []
+        for i, (label, fs) in enumerate(waves or DEFAULT_WAVES):
+            self.waves.append(self.channel(label, 0x0100 + i, fs=fs))
+
+        self.numerics = []
+        for i, (label, value, unit) in enumerate(numerics or DEFAULT_NUMERICS):
+            self.numerics.append(self.channel(label, 0x0200 + i, value=value, unit=unit))
+
+        self.alarms = self.alarmList(alarms)
+
+        self.stats = collections.Counter()
+        self.thread = None
+        self.running = False
+
+        # Monitor clock
+        self.relativeInitialTime = 0x00100000
+        self.initialTime = datetime.datetime.now().replace(microsecond=0)
+
+        # Pseudo-terminal; the slave stays open so the client may reconnect
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.link = MonitorLink(PTYSocket(self.master))
+
+        self.reset()
+
+    # Channel description from its TextId label
+    def channel(self, label, handle, **kwargs):
+        text_id = self.decoder.DataKeys['TextId'][label]
+
+        channel = {
+            'label': label,
+            'handle': handle,
+            'TextId': self.decoder.DataKeys['TextId'][text_id],
+            # Observed value code is the low half of the label's code
+            'SCADAType': self.decoder.get16(text_id[2:4]),
+        }
+        channel.update(kwargs)
+
+        return channel
+
+    # Active alarms reported by the alarm monitor
+    def alarmList(self, count):
+        alarms = {'patient': [], 'technical': []}
+
+        for i in range(count):
+            numeric = self.numerics[i % len(self.numerics)]
+            alarms['patient'].append({
+                'al_source': numeric['SCADAType'],
+                'al_code': 'NOM_EVT_HI',
+                'AlertType': 'MED_PRI_P_AL',
+                'TextId': numeric['TextId'],
+                'String': '**{0} HIGH'.format(numeric['label']),
+            })
+
+        if count > 1:
+            alarms['technical'].append({
+                'al_source': self.waves[0]['SCADAType'],
+                'al_code': 'NOM_EVT_ADVIS_CHK',
+                'AlertType': 'LOW_PRI_T_AL',
+                'TextId': self.waves[0]['TextId'],
+                'String': '{0} LEADS OFF'.format(self.waves[0]['label']),
+            })
+
+        return alarms
+
+    # Forgets the association and every poll
+    def reset(self):
+        self.associated = False
+        self.polls = {}
+        self.staticSent = set()
+
+    # Monitor time (RelativeTime ticks) for a host time
+    def relativeTime(self, now):
+        return self.relativeInitialTime + int(8000 * self.speed * (now - self.startTime))
+
+    # Monitor date for a RelativeTime
+    def absoluteTime(self, relative_time):
+        moment = self.initialTime + datetime.timedelta(seconds=(relative_time - self.relativeInitialTime) / 8000)
+
+        return {'century': moment.year // 100, 'year': moment.year % 100, 'month': moment.month,
+                'day': moment.day, 'hour': moment.hour, 'minute': moment.minute,
+                'second': moment.second, 'sec_fractions': 0}
+
+    # Parameters shared by every remote operation
+    def header(self, ro_type, invoke_id, CMDType, OIDType):
+        return {'session_id': 'DataExportProtocol',
+                'p_context_id': 'DataExportProtocol',
+                'ro_type': ro_type,
+                'invoke_id': invoke_id,
+                'CMDType': CMDType,
+                'OIDType': OIDType,
+                'MdsContext': 0,
+                'Handle': 0}
+
+    def send(self, message, kind):
+        self.link.send(message)
+        self.stats[kind] += 1
+        self.stats['bytes'] += len(message)
+
+    def sendAssociationResponse(self):
+        user_data = self.decoder.writeData('AssociationResponse', {
+            'ProtocolVersion': 'MDDL_VERSION1',
+            'NomenclatureVersion': 'NOMEN_VERSION',
+            'FunctionalUnits': 'None',
+            'SystemType': 'SYST_SERVER',
+            'StartupMode': 'WARM_START',
+            'PollProfileRevision': 'POLL_PROFILE_REV_0',
+            'RelativeTime': 480000,
+            'max_mtu_rx': 1000,
+            'max_mtu_tx': 1364,
+            'max_bw_tx': 'NoEstimationPossible',
+            'PollProfileOptions': 'P_OPT_DYN_CREATE_AND_DELETE',
+            'PollProfileExtOptions': 'POLL1SECANDWAVEANDLISTANDDYN',
+        })
+
+        presentation = ASSOC_RESP_PRESENTATION_HEAD + user_data + ASSOC_RESP_TRAILER
+        session = ASSOC_RESP_SESSION_DATA + b'\xC1' + self.setLI(len(presentation)) + presentation
+
+        self.send(b'\x0E' + self.setLI(len(session)) + session, 'AssociationResponse')
+
+    # LI length (1 byte, or 0xFF and uint16)
+    def setLI(self, length):
+        if length <= 254:
+            return bytes(self.decoder.set8(length))
+        return b'\xFF' + bytes(self.decoder.set16(length))
+
+    def sendMDSCreateEvent(self, now):
+        relative_time = self.relativeTime(now)
+
+        parameters = self.header('ROIV_APDU', 1, 'CMD_CONFIRMED_EVENT_REPORT',
+                                 ['NOM_MOC_VMS_MDS', 'NOM_NOTI_MDS_CREAT', 'NOM_MOC_VMS_MDS'])
+        parameters['RelativeTime'] = relative_time
+        parameters['AttributeList'] = {
+            'NOM_ATTR_ID_BED_LABEL': {'String': 'SIMULATOR'},
+            'NOM_ATTR_VMS_MDS_STAT': {'MDSStatus': 'OPERATING'},
+            'NOM_ATTR_TIME_ABS': self.absoluteTime(relative_time),
+            'NOM_ATTR_TIME_REL': {'RelativeTime': relative_time},
+        }
+
+        self.send(self.decoder.writeData('MDSCreateEvent', parameters), 'MDSCreateEvent')
+
+    def sendSetPriorityListResult(self, request):
+        # TextIds requested (count at 34, TextIds from 38)
+        count = self.decoder.get16(request[34:36])
+        text_ids = [self.decoder.DataKeys['TextId'].get(request[38+4*i:42+4*i]) for i in range(count)]
+
+        parameters = self.header('RORS_APDU', self.decoder.get16(request[8:10]), 'CMD_CONFIRMED_SET',
+                                 ['NOM_MOC_VMS_MDS'])
+        parameters['AttributeList'] = {
+            'NOM_ATTR_POLL_RTSA_PRIO_LIST': {'TextIdLabel': [text_id for text_id in text_ids if text_id]},
+        }
+
+        self.send(self.decoder.writeData('MDSSetPriorityListResult', parameters), 'MDSSetPriorityListResult')
+
+    def sendSinglePollResult(self, request, now):
+        relative_time = self.relativeTime(now)
+
+        parameters = self.header('RORS_APDU', self.decoder.get16(request[8:10]), 'CMD_CONFIRMED_ACTION',
+                                 ['NOM_MOC_VMS_MDS', 'NOM_ACT_POLL_MDIB_DATA',
+                                  self.decoder.DataKeys['OIDType'][request[32:34]], 'ALL'])
+        parameters.update(self.absoluteTime(relative_time))
+        parameters.update({'poll_number': self.decoder.get16(request[28:30]),
+                           'RelativeTime': relative_time,
+                           'NomPartition': 'NOM_PART_OBJ',
+                           'PollInfoList': []})
+
+        self.send(self.decoder.writeData('MDSSinglePollActionResult', parameters), 'MDSSinglePollActionResult')
+
+    # Observation polls of a wave result
+    def waveObservations(self, relative_time):
+        observations = []
+
+        for wave in self.waves:
+            samples = wave['fs'] * WAVE_PERIOD // 8000
+            start = (relative_time - self.relativeInitialTime) * wave['fs'] // 8000
+            values = [int(2048 + 1500 * math.sin(2 * math.pi * 1.2 * (start + i) / wave['fs']))
+                      for i in range(samples)]
+
+            attributes = {}
+            if wave['handle'] not in self.staticSent:
+                self.staticSent.add(wave['handle'])
+                attributes['NOM_ATTR_ID_HANDLE'] = {'Handle': wave['handle']}
+                attributes['NOM_ATTR_ID_LABEL'] = {'TextId': wave['TextId']}
+                attributes['NOM_ATTR_TIME_PD_SAMP'] = {'RelativeTime': 8000 // wave['fs']}
+                attributes['NOM_ATTR_UNIT_CODE'] = {'UNITType': 0x10B2}
+                attributes['NOM_ATTR_SCALE_SPECN_I16'] = {'FLOATType': [-2.0, 2.0],
+                                                          'lower_scaled_value': 0,
+                                                          'upper_scaled_value': 4095}
+            attributes['NOM_ATTR_SA_VAL_OBS'] = {'SCADAType': wave['SCADAType'],
+                                                 'MeasurementState': 0,
+                                                 'VariableData': values}
+
+            observations.append({'Handle': wave['handle'], 'AttributeList': attributes})
+
+        return observations
+
+    # Observation polls of a numerics result (with the descriptive attributes a monitor sends along)
+    def numericObservations(self, relative_time):
+        observations = []
+
+        for numeric in self.numerics:
+            attributes = {}
+            attributes['NOM_ATTR_ID_HANDLE'] = {'Handle': numeric['handle']}
+            attributes['NOM_ATTR_ID_TYPE'] = {'NomPartition': 'NOM_PART_SCADA', 'OIDType': numeric['SCADAType']}
+            attributes['NOM_ATTR_METRIC_SPECN'] = {'RelativeTime': NUMERIC_PERIOD,
+                                                   'MetricCategory': 'AUTO_MEASUREMENT',
+                                                   'MetricAccess': 0, 'ms_struct': 0, 'ms_comp_no': 0,
+                                                   'MetricRelevance': 0}
+            attributes['NOM_ATTR_ID_LABEL'] = {'TextId': numeric['TextId']}
+            attributes['NOM_ATTR_ID_LABEL_STRING'] = {'String': numeric['label']}
+            attributes['NOM_ATTR_DISP_RES'] = {'pre_point': 3, 'post_point': 0}
+            attributes['NOM_ATTR_COLOR'] = {'SimpleColour': 'COL_GREEN'}
+            attributes['NOM_ATTR_METRIC_STAT'] = {'MetricState': 0}
+            attributes['NOM_ATTR_NU_VAL_OBS'] = {'SCADAType': numeric['SCADAType'],
+                                                 'MeasurementState': 0,
+                                                 'UNITType': numeric['unit'],
+                                                 'FLOATType': numeric['value'] + random.choice((-1, 0, 1))}
+
+            observations.append({'Handle': numeric['handle'], 'AttributeList': attributes})
+
+        return observations
+
+    # Observation poll of an alarms result
+    def alarmObservations(self, relative_time):
+        attributes = {}
+
+        for OIDType, kind in [('NOM_ATTR_AL_MON_P_AL_LIST', 'patient'), ('NOM_ATTR_AL_MON_T_AL_LIST', 'technical')]:
+            entries = []
+            for i, alarm in enumerate(self.alarms[kind]):
+                entries.append({
+                    'al_source': alarm['al_source'],
+                    'al_code': alarm['al_code'],
+                    'AlertType': alarm['AlertType'],
+                    'AlertState': 0,
+                    'OIDType': 'NOM_MOC_VMO_METRIC_NU',
+                    'MdsContext': 0,
+                    'Handle': 0,
+                    'alert_info_id': 'STR_ALMON_INFO',
+                    'al_inst_no': i,
+                    'TextId': alarm['TextId'],
+                    'AlertPriority': 0,
+                    'AlertFlags': 'BEDSIDE_AUDIBLE',
+                    'String': alarm['String'],
+                })
+            attributes[OIDType] = {'DevAlarmList': entries}
+
+        return [{'Handle': 1, 'AttributeList': attributes}]
+
+    # Extended poll result for one poll
+    def pollResult(self, poll, relative_time):
+        observations = poll['observations'](relative_time)
+
+        parameters = self.header('RORS_APDU', poll['invoke_id'], 'CMD_CONFIRMED_ACTION',
+                                 ['NOM_MOC_VMS_MDS', 'NOM_ACT_POLL_MDIB_DATA_EXT', poll['OIDType'], 'ALL'])
+        parameters.update(self.absoluteTime(relative_time))
+        parameters.update({'poll_number': poll['poll_number'],
+                           'sequence_no': poll['sequence_no'],
+                           'RelativeTime': relative_time,
+                           'NomPartition': 'NOM_PART_OBJ',
+                           'PollInfoList': [{'MdsContext': 0, 'poll_info': observations}]})
+        poll['sequence_no'] += 1
+
+        return self.decoder.writeData('MDSExtendedPollActionResult', parameters)
+
+    def sendPollResult(self, poll, relative_time):
+        self.send(self.pollResult(poll, relative_time), poll['OIDType'])
+
+    # Starts streaming results for an extended poll request
+    def startPoll(self, request, now):
+        OIDType = self.decoder.DataKeys['OIDType'].get(request[32:34])
+        observations = {
+            'NOM_MOC_VMO_METRIC_SA_RT': (self.waveObservations, WAVE_PERIOD),
+            'NOM_MOC_VMO_METRIC_NU': (self.numericObservations, NUMERIC_PERIOD),
+            'NOM_MOC_VMO_AL_MON': (self.alarmObservations, NUMERIC_PERIOD),
+        }
+        if OIDType not in observations:
+            logging.warning('Simulator: no data for polls of {0}'.format(OIDType))
+            return
+
+        self.polls[OIDType] = {
+            'OIDType': OIDType,
+            'observations': observations[OIDType][0],
+            'period': observations[OIDType][1],
+            'invoke_id': self.decoder.get16(request[8:10]),
+            'poll_number': self.decoder.get16(request[28:30]),
+            'sequence_no': 0,
+            'next': self.relativeTime(now),
+        }
+        logging.debug('Simulator: polling {0}'.format(OIDType))
+
+    # Answers a message from the client
+    def handle(self, message, now):
+        message = bytes(message)
+
+        if message[0:1] == b'\x0D':
+            self.reset()
+            self.sendAssociationResponse()
+            self.sendMDSCreateEvent(now)
+
+        elif message[0:2] == b'\x19\x2E':
+            self.reset()
+
+        elif message[0:1] == b'\x09':
+            self.reset()
+            self.send(RELEASE_RESPONSE, 'ReleaseResponse')
+
+        elif message[0:1] == b'\xE1':
+            ro_type = message[4:6]
+            CMDType = message[10:12]
+
+            # MDSCreateEventResult
+            if ro_type == self.decoder.DataKeys['ro_type']['RORS_APDU']:
+                self.associated = True
+
+            elif CMDType == self.decoder.DataKeys['CMDType']['CMD_CONFIRMED_SET']:
+                self.sendSetPriorityListResult(message)
+
+            elif CMDType == self.decoder.DataKeys['CMDType']['CMD_CONFIRMED_ACTION']:
+                if message[24:26] == self.decoder.DataKeys['action_type']['NOM_ACT_POLL_MDIB_DATA_EXT']:
+                    self.startPoll(message, now)
+                else:
+                    self.sendSinglePollResult(message, now)
+
+        self.stats['received'] += 1
+
+    # Sends every poll result that is due, returns seconds until the next one
+    def stream(self, now):
+        relative_time = self.relativeTime(now)
+        wait = 0.05
+
+        for poll in self.polls.values():
+            while poll['next'] <= relative_time:
+                self.sendPollResult(poll, poll['next'])
+                poll['next'] += poll['period']
+            wait = min(wait, (poll['next'] - relative_time) / 8000 / self.speed)
+
+        return wait
+
+    def run(self):
+        self.startTime = time.monotonic()
+        self.running = True
+
+        while self.running:
+            now = time.monotonic()
+            self.link.socket.timeout = self.stream(now)
+
+            message = self.link.receive()
+            if message:
+                self.handle(message, time.monotonic())
+
+        self.stats['overflows'] = self.link.socket.overflows
+
+    # Runs the simulator in a background thread
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='IntellivueSimulator', daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.stop()
+        self.link.close()
+        os.close(self.slave)
+
+
+# Parses "label:number,label:number"
+def parseChannels(text):
+    channels = []
+    for item in text.split(','):
+        label, number = item.rsplit(':', 1)
+        channels.append((label, int(number)))
+    return channels
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Simulated Intellivue monitor on a pseudo-terminal')
+    parser.add_argument('--speed', type=float, default=1.0, help='data rate as a multiple of real time')
+    parser.add_argument('--waves', help='waves as label:Hz,... (default: II:500,Pleth:125)')
+    parser.add_argument('--numerics', help='numerics as label:value,... (default: HR:72,SpO2:98,RR:16)')
+    parser.add_argument('--alarms', type=int, default=0, help='number of active alarms')
+    opts = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    waves = parseChannels(opts.waves) if opts.waves else None
+    numerics = [(label, value, 0) for label, value in parseChannels(opts.numerics)] if opts.numerics else None
+
+    simulator = IntellivueSimulator(waves, numerics, opts.alarms, opts.speed)
+    print('Simulated monitor on {0} at {1}x'.format(simulator.port, opts.speed))
+
+    simulator.run()
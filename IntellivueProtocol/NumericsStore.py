@@ -0,0 +1,85 @@
+"""
+Bounded store of numerics trends.
+
+NumericsStore keeps, per label, a ring of the latest capacity numerics: their
+times as int64 nanoseconds (the timestamps of IntellivueDistiller) and their
+values as float32. Memory is fixed by the capacity and the number of
+labels, however long a session lasts. Appending is O(1), last() is a snapshot
+of the latest value of every label, and trend() returns the values of a time
+range with vectorized searches (times are expected not to go back).
+"""
+
+from __future__ import division
+
+import numpy as np
+
+
+class NumericsRing(object):
+    # The latest numerics of a label; head is where the next one is written
+
+    __slots__ = ('times', 'values', 'count', 'head')
+
+    def __init__(self, capacity):
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float32)
+        self.count = 0
+        self.head = 0
+
+    def append(self, time, value):
+        self.times[self.head] = time
+        self.values[self.head] = value
+        self.head += 1
+        if self.head == self.times.size:
+            self.head = 0
+        if self.count < self.times.size:
+            self.count += 1
+
+    # The ring as chronological slices
+    def segments(self):
+        if self.count < self.times.size:
+            return [slice(0, self.count)]
+        return [slice(self.head, None), slice(0, self.head)]
+
+    def trend(self, start, stop):
+        times = []
+        values = []
+        for segment in self.segments():
+            first, last = np.searchsorted(self.times[segment], [start, stop])
+            times.append(self.times[segment][first:last])
+            values.append(self.values[segment][first:last])
+
+        return np.concatenate(times), np.concatenate(values)
+
+
+class NumericsStore(object):
+    """
+    Rings of (time, value) numerics by label, of capacity values each
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.rings = {}
+
+    def append(self, label, time, value):
+        ring = self.rings.get(label)
+        if ring is None:
+            ring = self.rings[label] = NumericsRing(self.capacity)
+        ring.append(time, value)
+
+    def last(self):
+        """
+        The latest value of every label: {label: value}
+        """
+        return {label: float(ring.values[ring.head - 1]) for label, ring in self.rings.items()}
+
+    def trend(self, label, start, stop):
+        """
+        Times and values (new arrays) of a label from start up to stop, in nanoseconds
+        """
+        ring = self.rings.get(label)
+        if ring is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return ring.trend(start, stop)
+
+    def nbytes(self):
+        return sum(ring.times.nbytes + ring.values.nbytes for ring in self.rings.values())
@@ -0,0 +1,187 @@
+"""
+Poll results decoded into compact records instead of nested dicts.
+
+readPollReply() reads an (extended, possibly linked) poll result into
+
+    PollReply -> contexts: [ContextPoll -> observations: [ObservationPoll]]
+
+where each ObservationPoll keeps its attribute values by attribute id
+(ObservationPoll.attributes, {OID int: AttributeValue}) instead of under
+PollInfoList/SingleContextPoll_i/poll_info/ObservationPoll_j/AttributeList/
+AVAType/<name>/AttributeValue. The records use __slots__, so a poll result
+allocates a few objects per observation rather than a dozen dicts.
+
+Attribute values are read by the decoder's attribute plans (and follow its
+IntellivueDecoder.selectAttributes()). pollReplyDict() gives back exactly
+what IntellivueDecoder.readData() returns, for callers of the dict shape.
+"""
+
+import struct
+
+from IntellivueProtocol.IntellivueDecoder import COUNT_LENGTH
+
+# Poll result messages read into records
+POLL_REPLIES = ('MDSExtendedPollActionResult', 'LinkedMDSExtendedPollActionResult')
+
+# SingleContextPoll and ObservationPoll: MdsContext or Handle, then list count and length
+ENTRY_HEADER = struct.Struct('>HHH')
+
+
+class PollReply(object):
+    """
+    A poll result: the message header (ROSE/ROapdus parts and ActionResult,
+    as decoded dicts), the PollMdibDataReplyExt fields, and its context polls
+    """
+    __slots__ = ('header', 'poll_number', 'sequence_no', 'relative_time', 'absolute_time',
+                 'polled_type', 'polled_group', 'count', 'length', 'contexts')
+
+    def __init__(self, header, poll_number, sequence_no, relative_time, absolute_time,
+                 polled_type, polled_group, count, length, contexts):
+        self.header = header
+        self.poll_number = poll_number
+        self.sequence_no = sequence_no
+        self.relative_time = relative_time
+        self.absolute_time = absolute_time
+        self.polled_type = polled_type
+        self.polled_group = polled_group
+        self.count = count
+        self.length = length
+        self.contexts = contexts
+
+    # Observations of every context
+    def observations(self):
+        return [observation for context in self.contexts for observation in context.observations]
+
+
+class ContextPoll(object):
+    """
+    The observations of one MDS context (count and length as on the wire)
+    """
+    __slots__ = ('mds_context', 'count', 'length', 'observations')
+
+    def __init__(self, mds_context, count, length, observations):
+        self.mds_context = mds_context
+        self.count = count
+        self.length = length
+        self.observations = observations
+
+
+class ObservationPoll(object):
+    """
+    The attributes of one object: values and lengths by attribute id (count
+    and length of the AttributeList as on the wire, skipped attributes included)
+    """
+    __slots__ = ('handle', 'count', 'length', 'attributes', 'lengths')
+
+    def __init__(self, handle, count, length, attributes, lengths):
+        self.handle = handle
+        self.count = count
+        self.length = length
+        self.attributes = attributes
+        self.lengths = lengths
+
+
+# Reads a poll result into a PollReply
+def readPollReply(decoder, data):
+    """
+    decoder - IntellivueDecoder (its compiled plans read the header and the
+              attribute values)
+    data - a message of one of POLL_REPLIES
+    """
+    data = memoryview(data)
+
+    message_type = decoder.getMessageType(data)
+    if message_type not in POLL_REPLIES:
+        raise ValueError('Not a poll result: {0}'.format(message_type))
+
+    problem = decoder.checkMessage(data, message_type)
+    if problem:
+        raise ValueError('Malformed {0}: {1}'.format(message_type, problem))
+
+    message_list = decoder.MessageLists[message_type]
+    header = {}
+    index = decoder.decodePlan(message_list[:-1])(data, 0, header)
+
+    # PollMdibDataReplyExt fields up to PollInfoList
+    fields = {}
+    index = decoder.decodePlan(decoder.DataTypes[message_list[-1]][:-1])(data, index, fields)
+
+    attributePlans = decoder.attributePlans
+    attributePlan = decoder.attributePlan
+
+    count, length = COUNT_LENGTH.unpack_from(data, index)
+    index += 4
+
+    contexts = []
+    for i in range(count):
+        mds_context, poll_count, poll_length = ENTRY_HEADER.unpack_from(data, index)
+        index += 6
+
+        observations = []
+        for j in range(poll_count):
+            handle, attribute_count, attribute_length = ENTRY_HEADER.unpack_from(data, index)
+            index += 6
+
+            attributes = {}
+            lengths = {}
+            for k in range(attribute_count):
+                OIDIndex, attribute_size = COUNT_LENGTH.unpack_from(data, index)
+                index += 4
+
+                # As in the AttributeList loop of DecodePlan
+                OIDType, plan = attributePlans.get(OIDIndex) or attributePlan(OIDIndex)
+                if plan:
+                    value = attributes[OIDIndex] = {}
+                    index = plan(data, index, value)
+                elif plan is None:
+                    attributes[OIDIndex] = 'OIDType Not Defined'
+                    index += attribute_size
+                else:
+                    index += attribute_size
+                    continue
+                lengths[OIDIndex] = attribute_size
+
+            observations.append(ObservationPoll(handle, attribute_count, attribute_length, attributes, lengths))
+
+        contexts.append(ContextPoll(mds_context, poll_count, poll_length, observations))
+
+    return PollReply(header, fields['poll_number'], fields['sequence_no'], fields['RelativeTime'],
+                     fields['AbsoluteTime'], fields['Type'], fields['OIDType'], count, length, contexts)
+
+
+# The dict IntellivueDecoder.readData() returns for the message read into reply
+def pollReplyDict(decoder, reply):
+    message = dict(reply.header)
+
+    poll_info_list = {'count': reply.count, 'length': reply.length}
+    for i, context in enumerate(reply.contexts):
+
+        poll_info = {'count': context.count, 'length': context.length}
+        for j, observation in enumerate(context.observations):
+
+            if observation.count == 0:
+                AVAType = 'Null'
+            else:
+                AVAType = {}
+                for OIDIndex, value in observation.attributes.items():
+                    AVAType[decoder.attributePlan(OIDIndex)[0]] = {'length': observation.lengths[OIDIndex],
+                                                                   'AttributeValue': value}
+
+            poll_info['ObservationPoll_{0}'.format(j)] = {'ObservationPoll': {
+                'Handle': observation.handle,
+                'AttributeList': {'count': observation.count, 'length': observation.length, 'AVAType': AVAType}}}
+
+        poll_info_list['SingleContextPoll_{0}'.format(i)] = {'SingleContextPoll': {
+            'MdsContext': context.mds_context, 'poll_info': poll_info}}
+
+    message['PollMdibDataReplyExt'] = {
+        'poll_number': reply.poll_number,
+        'sequence_no': reply.sequence_no,
+        'RelativeTime': reply.relative_time,
+        'AbsoluteTime': reply.absolute_time,
+        'Type': reply.polled_type,
+        'OIDType': reply.polled_group,
+        'PollInfoList': poll_info_list,
+    }
+
+    return message
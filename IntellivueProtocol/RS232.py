@@ -14,9 +14,39 @@ On OSX, dl the Mac 1.6 driver at http://plugable.com/drivers/prolific/
 
 import serial
 import serial.tools.list_ports
+import asyncio
 import struct
+import binascii
 import logging
 import itertools
+import collections
+import re
+import threading
+import time
+
+from IntellivueProtocol.Capture import CaptureWriter, ReplaySocket, readCapture
+
+# Bytes that must be escaped inside a frame (start, stop, escape)
+SPECIAL_BYTES = re.compile(b'[\xC0\xC1\x7D]')
+ESCAPED_BYTES = {
+    b'\xC0': b'\x7D\xE0',
+    b'\xC1': b'\x7D\xE1',
+    b'\x7D': b'\x7D\x5D',
+}
+
+# Every byte with its bit order reversed (0x01 -> 0x80), for the CRC16
+REVERSED_BITS = bytes(int('{0:08b}'.format(i)[::-1], 2) for i in range(256))
+
+# FCS of a message followed by its own FCS (the constant residue 0xF0B8 of
+# RFC 1662)
+GOOD_FCS = b'\x47\x0F'
+
+# Size of the buffers that received frames are unescaped into
+RECEIVE_BUFFER_SIZE = 65536
+
+# Link counters kept by every connection, see readCounters()
+LINK_COUNTERS = ('bytesIn', 'bytesOut', 'framesIn', 'framesOut', 'crcFailures', 'framingErrors',
+                 'incompleteFrames', 'resyncs', 'discardedBytes', 'droppedFrames')
 
 
 class RS232(object):
@@ -24,7 +54,7 @@ class RS232(object):
     Methods to engage in RS232 connection with monitor
     """
 
-    def __init__(self, specifiedPort):
+    def __init__(self, specifiedPort, readerThread=False, ringSize=256, captureFile=None):
         (serial.tools.list_ports.comports())
         # Check to see if the named port exists
         if 0: #specifiedPort not in itertools.chain.from_iterable(serial.tools.list_ports.comports()): by JG
@@ -45,9 +75,47 @@ class RS232(object):
             logging.warn("Failed to open serial connection")
             raise IOError
 
+        logging.debug('Serial connection opened')
+
+        self.setupConnection(readerThread, ringSize, captureFile)
+
+    # Initializes framing state once self.socket exists
+    def setupConnection(self, readerThread=False, ringSize=256, captureFile=None):
+
         # Create CRC16 Table
         self.CRCTable = self.getCRCTable()
-        logging.debug('Serial connection opened')
+
+        # Frames are unescaped one after the other into the receive buffer and
+        # handed out as views of it: receiveBuffer[frameStart:frameEnd] is the
+        # frame being received (see splitFrames())
+        self.receiveBuffer = bytearray(RECEIVE_BUFFER_SIZE)
+        self.receiveView = memoryview(self.receiveBuffer)
+        self.frameStart = 0
+        self.frameEnd = 0
+        self.inFrame = False
+        self.escapePending = False
+
+        # Set while bytes outside of any frame are skipped, until the next start bit
+        self.hunting = False
+
+        # Every key exists from the start, so other threads can copy the
+        # counters while they are updated (see readCounters())
+        self.counters = collections.Counter(dict.fromkeys(LINK_COUNTERS, 0))
+
+        # Frames not yet handed out
+        self.pendingFrames = collections.deque()
+
+        # Fully framed bytes of constant messages, see cacheFrames()
+        self.frameCache = {}
+
+        # Optionally tee every byte received to a capture file, see Capture.py
+        self.capture = CaptureWriter(captureFile) if captureFile else None
+
+        # Optionally hand reading over to a dedicated thread, see startReader()
+        self.frameRing = None
+        self.reader = None
+        if readerThread:
+            self.startReader(ringSize)
 
     # Returns value from uint16 binary
     def get16(self, data):
@@ -86,26 +154,24 @@ class RS232(object):
         return table
 
     # get CRC16
-    def getCRC16(self, message, table):
+    def getCRC16(self, message, table=None):
         """
         generates CRC16 as defined by manual
 
+        The manual's CRC (polynomial 0x8408, bit-reflected) is the bit-reversed
+        CRC-CCITT of the bit-reversed message, so it is computed in C by
+        binascii.crc_hqx instead of a byte-by-byte table walk in Python.
+        table is accepted for compatibility and no longer used.
+
         returns: fcs - 16 bit crc code
         """
-        length = len(message)
-        fcs = 0xFFFF
-
-        if type(message) != bytearray:
-            message = bytearray(message)
-
-        # logging.debug("CRC16->Message as bytes {0}:".format(message))
+        if not isinstance(message, (bytes, bytearray)):
+            message = bytes(message)
 
-        for i in range(0, length):
-            # fcs = (fcs >> 8) ^ table[(fcs ^ message[i]) & 0xFF]
-            fcs = (fcs >> 8) ^ table[(fcs ^ message[i]) & 0xFF]
+        crc = binascii.crc_hqx(message.translate(REVERSED_BITS), 0xFFFF)
 
-        # One's Complement
-        fcs = ~fcs & 0xFFFF
+        # Reverse bits back, One's Complement
+        fcs = ((REVERSED_BITS[crc & 0xFF] << 8) | REVERSED_BITS[crc >> 8]) ^ 0xFFFF
 
         # Byte Swap
         fcs = struct.pack('<H', fcs)
@@ -116,55 +182,36 @@ class RS232(object):
     def writeTransparencyCheck(self, message):
         """
         performs transparency check on written messages as defined by manual
+        (every start, stop and escape byte between BOF and EOF is replaced by
+        0x7D followed by the byte XOR 0x20, in a single pass)
 
         returns: message - bytes to be sent to monitor
         """
-        # iterate through each byte for start, stop, esc bytes
-        for i in range(1, len(message)-1):
-            if message[i] == 0xC0 or message[i] == 0xC1 or message[i] == 0x7D:
-                replace_byte = message[i] ^ 0x20
-                message[i] = 0x7D
-                message.insert(i+1, replace_byte)
+        body = SPECIAL_BYTES.sub(lambda match: ESCAPED_BYTES[match.group()], bytes(message[1:-1]))
 
-        return message
+        return bytearray(message[0:1]) + body + message[-1:]
 
     # read transparency check
     def readTransparencyCheck(self, message):
         """
         performs transparency check while reading as defined by manual
+        (single pass over the escape bytes)
 
         returns: message - bytes ready to be deciphered
         """
 
-        if type(message) != bytearray:
-            message = bytearray(message)
+        parts = bytes(message).split(b'\x7D')
+        unescaped = bytearray(parts[0])
 
-        # store (index, bin) in these lists
-        indices = []
-
-        # iterate through message and store indices of 0xc1,0xc0,0x7d
-        for i in range(0, len(message)-1):
-            if message[i] == 0x7D:
-                if message[i+1] == 0xC0 ^ 0x20:
-                    indices.append((i, 192))  # 0xc0 = 192
-                elif message[i+1] == 0xC1 ^ 0x20:
-                    indices.append((i, 193))  # 0xc1 = 193
-                elif message[i+1] == 0x7D ^ 0x20:
-                    indices.append((i, 125))  # 0x7d = 125
-
-        # Sort indices
-        sortedIndices = sorted(indices, reverse=True)
-
-        # Iterate through list and change message
-        for value in sortedIndices:
-            if value[1] == 192:
-                message[value[0]:value[0]+2] = b'\xC0'
-            elif value[1] == 193:
-                message[value[0]:value[0]+2] = b'\xC1'
-            elif value[1] == 125:
-                message[value[0]:value[0]+2] = b'\x7D'
+        for part in parts[1:]:
+            if part[0:1] in (b'\xE0', b'\xE1', b'\x5D'):
+                unescaped.append(part[0] ^ 0x20)
+                unescaped += part[1:]
+            else:
+                unescaped.append(0x7D)
+                unescaped += part
 
-        return bytes(message)
+        return bytes(unescaped)
 
     # Adds header, fcs, transparency check to messages
     def frameCheckWrite(self, message):
@@ -207,74 +254,353 @@ class RS232(object):
         if message[0:3] == b'\xC0\x11\x01':
 
             # Transparency Check (not including start, stop)
-            message = self.readTransparencyCheck(message[1:-1])
-
-            # Length, CRC calculations
-            length = self.get16(message[2:4])
-            givenCRC = message[4+length:6+length]
-            validatedCRC = self.getCRC16(message[:4+length], self.CRCTable)
-
-            # Check that CRC's match up, otherwise ignore message
-            if givenCRC == validatedCRC:
-                finalMessage = message[4:4+length]
-            # If they are not the same, output CRC mismatch
-            else:
-                finalMessage = b''
+            finalMessage = self.frameCheckPayload(self.readTransparencyCheck(message[1:-1]))
 
         else:
             logging.error('RS232: Incorrect framing...')
+            self.counters['framingErrors'] += 1
 
         return finalMessage
 
-    # Recieves each byte and outputs final message
+    # Checks header and FCS of a frame that has already been unescaped
+    def frameCheckPayload(self, message):
+        """
+        Takes the unescaped contents of a frame (Hdr|Hdr_len|message|FCS)
+        and strips the header and FCS after checking them
+
+        The message is not copied: it is returned as a read-only memoryview
+        of the frame.
+
+        returns: message - memoryview ready for IntellivueDecoder.readData(),
+                 b'' on CRC mismatch, None on incorrect framing
+        """
+
+        if message[0:2] != b'\x11\x01':
+            logging.error('RS232: Incorrect framing...')
+            self.counters['framingErrors'] += 1
+            return None
+
+        frame = message if isinstance(message, memoryview) else memoryview(message)
+        length = struct.unpack_from('>H', frame, 2)[0] if len(frame) >= 4 else 0
+
+        # The CRC over the whole frame, FCS included, is constant for a correct frame
+        if len(frame) == 6 + length:
+            valid = self.getCRC16(message) == GOOD_FCS
+        else:
+            valid = frame[4+length:6+length] == self.getCRC16(frame[:4+length])
+
+        # Check that CRC's match up, otherwise ignore message
+        if valid:
+            return frame[4:4+length].toreadonly()
+
+        # If they are not the same, output CRC mismatch
+        self.counters['crcFailures'] += 1
+        return b''
+
+    # Reads whatever is waiting on the serial port
+    def readChunk(self):
+        """
+        Reads every byte waiting in the serial driver in one call, or blocks
+        for a single byte (up to the socket timeout) if nothing is waiting
+
+        returns: chunk - bytes read (empty on timeout)
+        """
+        chunk = self.socket.read(self.socket.in_waiting or 1)
+        self.counters['bytesIn'] += len(chunk)
+        if chunk and self.capture:
+            self.capture.write(chunk)
+        return chunk
+
+    # Moves the frame being received to the start of a new receive buffer
+    def newReceiveBuffer(self, needed):
+        """
+        The full buffer is left to the frames already handed out, which keep
+        it alive for as long as they are used
+        """
+        length = self.frameEnd - self.frameStart
+        buffer = bytearray(max(RECEIVE_BUFFER_SIZE, 2 * (length + needed)))
+        buffer[:length] = self.receiveView[self.frameStart:self.frameEnd]
+
+        self.receiveBuffer = buffer
+        self.receiveView = memoryview(buffer)
+        self.frameStart = 0
+        self.frameEnd = length
+
+    # Skips bytes received outside of any frame
+    def discardBytes(self, count):
+        self.counters['discardedBytes'] += count
+        self.hunting = True
+
+    # Appends a run of ordinary bytes to the frame being received
+    def appendRun(self, chunk, start, end):
+        if start == end:
+            return
+
+        if self.frameEnd + (end - start) > len(self.receiveBuffer):
+            self.newReceiveBuffer(end - start)
+
+        # Byte following an escape byte is XOR 0x20
+        if self.escapePending:
+            self.receiveBuffer[self.frameEnd] = chunk[start] ^ 0x20
+            self.frameEnd += 1
+            self.escapePending = False
+            start += 1
+
+        self.receiveView[self.frameEnd:self.frameEnd + end - start] = chunk[start:end]
+        self.frameEnd += end - start
+
+    # Splits complete frames out of incoming bytes
+    def splitFrames(self, chunk):
+        """
+        Streams bytes through the framing state machine: finds start bit (0xC0)
+        and stop bit (0xC1) and undoes the transparency escapes while copying
+        into the receive buffer, so each frame is unescaped in the same pass
+        that finds it, then checked once complete. Bytes outside of a frame
+        are dropped (counted as a resync once the next frame starts), and a
+        partial frame is kept for the next chunk.
+
+        That copy into the receive buffer is the only one: frames are returned
+        as read-only views of it. Frames that fail their checks are
+        overwritten by the next one; when the buffer is full a new one is
+        started, so the frames handed out stay valid.
+
+        returns: frames - list of messages ready for IntellivueDecoder()
+        """
+        frames = []
+        position = 0
+
+        # Runs are copied straight from the chunk
+        if not isinstance(chunk, (bytes, bytearray)):
+            chunk = bytes(chunk)
+        view = memoryview(chunk)
+
+        for match in SPECIAL_BYTES.finditer(chunk):
+            index = match.start()
+            if self.inFrame:
+                self.appendRun(view, position, index)
+            elif index > position:
+                self.discardBytes(index - position)
+            position = index + 1
+
+            byte = chunk[index]
+            if byte == 0xC0:
+                # A second start bit before the stop bit means the first frame was cut short
+                if self.inFrame:
+                    logging.warning('Incomplete message received!')
+                    self.counters['incompleteFrames'] += 1
+                elif self.hunting:
+                    self.counters['resyncs'] += 1
+                    self.hunting = False
+                self.inFrame = True
+                self.escapePending = False
+                self.frameEnd = self.frameStart
+
+            elif not self.inFrame:
+                self.discardBytes(1)
+                continue
+
+            elif byte == 0xC1:
+                self.inFrame = False
+                message = self.frameCheckPayload(self.receiveView[self.frameStart:self.frameEnd])
+                if isinstance(message, memoryview):
+                    self.counters['framesIn'] += 1
+                    self.frameStart = self.frameEnd
+                    # A correct frame may carry an empty message: nothing to decode
+                    if message:
+                        frames.append(message)
+                else:
+                    # Failed checks are counted by frameCheckPayload(), including
+                    # flags with nothing between them (C0 C1), as framing errors
+                    self.frameEnd = self.frameStart
+
+            else:
+                self.escapePending = True
+
+        if self.inFrame:
+            self.appendRun(view, position, len(chunk))
+        elif position < len(chunk):
+            self.discardBytes(len(chunk) - position)
+
+        return frames
+
+    # Starts a thread that owns all reads from the serial port
+    def startReader(self, ringSize=256):
+        """
+        Starts a daemon thread that reads the serial port as soon as bytes
+        arrive, so they never wait in the kernel buffer while the caller is
+        busy. Each frame is stored with its arrival time (time.monotonic_ns())
+        in a bounded ring; when the ring is full the oldest frame is dropped.
+
+        The ring is a collections.deque, whose append and popleft are atomic,
+        so the reader and the consumer never take a lock.
+        """
+        self.frameRing = collections.deque(maxlen=ringSize)
+        self.frameReady = threading.Event()
+        self.readerRunning = True
+        self.reader = threading.Thread(target=self.readLoop, name='RS232Reader', daemon=True)
+        self.reader.start()
+
+    # Body of the reader thread
+    def readLoop(self):
+        while self.readerRunning:
+            try:
+                chunk = self.readChunk()
+            except (serial.SerialException, OSError, TypeError, AttributeError):
+                # Port closed or unplugged underneath us
+                if self.readerRunning:
+                    logging.warning('RS232 reader stopped: serial port not readable')
+                break
+
+            if not chunk:
+                continue
+
+            arrival = time.monotonic_ns()
+            frames = self.splitFrames(chunk)
+            for frame in frames:
+                if len(self.frameRing) == self.frameRing.maxlen:
+                    self.counters['droppedFrames'] += 1
+                self.frameRing.append((arrival, frame))
+
+            if frames:
+                self.frameReady.set()
+
+        self.readerRunning = False
+
+    # Stops the reader thread
+    def stopReader(self):
+        if self.reader is None:
+            return
+
+        self.readerRunning = False
+        if self.reader is not threading.current_thread():
+            self.reader.join(timeout=2 * (self.socket.timeout or 1))
+        self.reader = None
+
+    # Receives every frame in the reader thread's ring, with arrival times
+    def receiveBatch(self):
+        """
+        Drains the frame ring filled by the reader thread (or the serial port
+        directly when there is no reader thread) without waiting
+
+        returns: batch - list of (arrival time in ns, message)
+        """
+
+        if self.frameRing is None:
+            arrival = time.monotonic_ns()
+            return [(arrival, frame) for frame in self.receiveFrames()]
+
+        batch = []
+        while self.frameRing:
+            batch.append(self.frameRing.popleft())
+        return batch
+
+    # Receives every complete frame currently available
+    def receiveFrames(self):
+        """
+        Drains the serial port and returns zero or more messages, without
+        waiting for a frame that has only partially arrived
+
+        returns: frames - list of messages ready for IntellivueDecoder()
+        """
+
+        if self.frameRing is not None:
+            return [frame for arrival, frame in self.receiveBatch()]
+
+        if not self.socket or not self.socket.isOpen():
+            logging.warning('Trying to receive without a socket')
+            return []
+
+        if self.socket.in_waiting:
+            self.pendingFrames.extend(self.splitFrames(self.readChunk()))
+
+        frames = list(self.pendingFrames)
+        self.pendingFrames.clear()
+        return frames
+
+    # Receives the next complete message
     def receive(self):
         """
         Takes in input from serial port and strings into messages
         based on start bit (0xC0) and stop bit (0xC1)
 
-        will stop after reading in one message
+        will stop after one message is available; any further messages read
+        at the same time are kept for the following calls
 
         returns: message - ready to be interpreted by IntellivueDecoder()
         """
 
         if not self.socket or not self.socket.isOpen():
-            logging.warn('Trying to receive without a socket')
+            logging.warning('Trying to receive without a socket')
             return
 
-        # initialize message
-        message = bytearray()
+        if self.frameRing is not None:
+            # Wait (up to the socket timeout) for the reader thread
+            if not self.frameRing:
+                self.frameReady.clear()
+                if not self.frameRing:
+                    self.frameReady.wait(self.socket.timeout)
+            try:
+                return self.frameRing.popleft()[1]
+            except IndexError:
+                return b''
+
+        while not self.pendingFrames:
+            chunk = self.readChunk()
+            if not chunk:
+                if self.inFrame:
+                    # Bail out! The message is incomplete (kept in case the rest arrives).
+                    logging.warning('Incomplete message received!')
+                    self.counters['incompleteFrames'] += 1
+                    return None
+                return b''
 
-        # initialize boolean
-        messageNotDone = True
+            self.pendingFrames.extend(self.splitFrames(chunk))
 
-        # read in current byte
-        currentByte = self.socket.read(1)
+        return self.pendingFrames.popleft()
 
-        # Loop to read in entire message
-        if currentByte == b'\xC0':
-            message = message + currentByte
+    # Copies the link counters
+    def readCounters(self):
+        """
+        Cheap enough to call from any thread at any time: the reader thread
+        (or the caller) only ever increments existing keys
 
-            while(messageNotDone):
-                messageByte = self.socket.read(1)
+        returns: counters - dict of LINK_COUNTERS, with the monotonic time of
+                 the copy in 'time' (seconds), for computing rates
+        """
+        counters = dict(self.counters)
+        counters['time'] = time.monotonic()
+        return counters
 
-                if not messageByte:
-                    # Bail out! The message is incomplete.
-                    logging.warn('Incomplete message received!')
-                    return None
-                elif messageByte != b'\xC1':
-                    message = message + messageByte
-                else:
-                    message = message + messageByte
-                    messageNotDone = False
+    # File descriptor of the port, for selectors / epoll
+    def fileno(self):
+        return self.socket.fileno()
 
-            # Frame check message
-            finalMessage = self.frameCheckRead(bytes(message))
+    # Reads the port once a selector reports it readable
+    def receiveReadable(self):
+        """
+        Reads what the port has (without waiting, since it is readable) and
+        returns every frame completed, including any left over from receive().
+        A port that is readable but has nothing to read was disconnected, and
+        raises serial.SerialException.
 
-        # If not at start bit return nothing
-        else:
-            finalMessage = b''
+        returns: batch - list of (arrival time in ns, message)
+        """
+        chunk = self.readChunk()
+        arrival = time.monotonic_ns()
 
-        return finalMessage
+        self.pendingFrames.extend(self.splitFrames(chunk))
+        batch = [(arrival, frame) for frame in self.pendingFrames]
+        self.pendingFrames.clear()
+        return batch
+
+    # Stores framed bytes of messages that are sent unchanged many times
+    def cacheFrames(self, messages):
+        """
+        Frames (header, FCS, transparency check) each message once, so that
+        sending it later is a single write
+        """
+        for message in messages:
+            self.frameCache[bytes(message)] = bytes(self.frameCheckWrite(bytearray(message)))
 
     # Sends final messages to monitor
     def send(self, message):
@@ -285,7 +611,13 @@ class RS232(object):
             logging.warn('Trying to write without a socket')
             return
 
-        self.socket.write(self.frameCheckWrite(message))
+        framedMessage = self.frameCache.get(message) if isinstance(message, bytes) else None
+        if framedMessage is None:
+            framedMessage = self.frameCheckWrite(message)
+
+        self.socket.write(framedMessage)
+        self.counters['bytesOut'] += len(framedMessage)
+        self.counters['framesOut'] += 1
 
     def __del__(self):
         print('Tearing down socket.')
@@ -297,6 +629,11 @@ class RS232(object):
             logging.warn('Trying to close without a socket')
             return
 
+        self.stopReader()
+
+        if self.capture:
+            self.capture.close()
+
         # Maybe help with hangs?
         try:
             # self.socket.flush()
@@ -309,6 +646,116 @@ class RS232(object):
             raise
 
 
+class AsyncRS232(RS232):
+    """
+    RS232 connection read from an asyncio event loop
+
+    Behaves like RS232 (blocking reads) until attach() is called, so the
+    association handshake can run unchanged. Once attached, the port is
+    non-blocking and the event loop reads it through loop.add_reader(), and
+    frames are awaited with receiveAsync() / receiveBatchAsync().
+    """
+
+    def __init__(self, specifiedPort, **kwargs):
+        super(AsyncRS232, self).__init__(specifiedPort, **kwargs)
+        self.loop = None
+        self.frameQueue = None
+        self.blockingTimeout = self.socket.timeout
+
+    # Hands reading over to the event loop
+    def attach(self, loop=None):
+        if self.loop is not None:
+            return
+
+        self.loop = loop or asyncio.get_event_loop()
+        self.frameQueue = asyncio.Queue()
+
+        # Frames already read during the handshake come first
+        arrival = time.monotonic_ns()
+        while self.pendingFrames:
+            self.frameQueue.put_nowait((arrival, self.pendingFrames.popleft()))
+
+        self.socket.timeout = 0
+        self.loop.add_reader(self.socket.fileno(), self.onReadable)
+
+    # Returns the port to blocking reads
+    def detach(self):
+        if self.loop is None:
+            return
+
+        self.loop.remove_reader(self.socket.fileno())
+        self.socket.timeout = self.blockingTimeout
+        while not self.frameQueue.empty():
+            self.pendingFrames.append(self.frameQueue.get_nowait()[1])
+        self.loop = None
+        self.frameQueue = None
+
+    # Called by the event loop whenever the port has bytes to read
+    def onReadable(self):
+        try:
+            chunk = self.readChunk()
+        except (serial.SerialException, OSError):
+            logging.warning('RS232: serial port not readable, detaching from event loop')
+            self.loop.remove_reader(self.socket.fileno())
+            return
+
+        arrival = time.monotonic_ns()
+        for frame in self.splitFrames(chunk):
+            self.frameQueue.put_nowait((arrival, frame))
+
+    # Awaits the next complete message
+    async def receiveAsync(self, timeout=None):
+        """
+        returns: message - ready to be interpreted by IntellivueDecoder(),
+                 b'' if nothing arrived within timeout seconds
+        """
+        try:
+            return (await asyncio.wait_for(self.frameQueue.get(), timeout))[1]
+        except asyncio.TimeoutError:
+            return b''
+
+    # Awaits at least one message, then drains every message already received
+    async def receiveBatchAsync(self, timeout=None):
+        """
+        returns: batch - list of (arrival time in ns, message), empty if
+                 nothing arrived within timeout seconds
+        """
+        try:
+            batch = [await asyncio.wait_for(self.frameQueue.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+
+        while not self.frameQueue.empty():
+            batch.append(self.frameQueue.get_nowait())
+        return batch
+
+    def close(self):
+        if self.loop is not None and self.socket and self.socket.isOpen():
+            self.detach()
+        super(AsyncRS232, self).close()
+
+
+class ReplayRS232(RS232):
+    """
+    Plays back a capture file written by RS232(captureFile=...) in place of
+    a serial port, so a recorded session can be decoded again (or benchmarked)
+    without a monitor. Bytes are served with their recorded timing, scaled by
+    speed (1 = real time, 10 = ten times faster, None or 0 = as fast as
+    possible); anything sent is discarded.
+    """
+
+    def __init__(self, captureFile, readerThread=False, ringSize=256, speed=1.0):
+        logging.debug('Replaying capture {0}'.format(captureFile))
+
+        self.socket = ReplaySocket(readCapture(captureFile), speed=speed)
+        self.setupConnection(readerThread, ringSize)
+
+    # True once every byte of the capture has been received
+    @property
+    def finished(self):
+        return self.socket.finished and not self.pendingFrames and not self.frameRing
+
+
 if __name__ == '__main__':
 
     logging.basicConfig(level=logging.DEBUG)
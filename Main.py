@@ -3,10 +3,7 @@ from __future__ import unicode_literals
 import argparse
 import logging
 import time
-from IntellivueProtocol.IntellivueDecoder import IntellivueDecoder
-from IntellivueProtocol.RS232 import RS232
-from IntellivueProtocol.IntellivueDistiller import IntellivueDistiller
-from TelemetryStream import TelemetryStream
+from PhilipsTelemetryStream import PhilipsTelemetryStream
 from QualityOfSignal import QualityOfSignal as QoS
 from collections import deque
 import multiprocessing as mp
@@ -52,348 +49,6 @@ def qos(*args, **kwargs):
     else:
         return -1
 
-class CriticalIOError(IOError):
-    """Need to tear the socket down and reset."""
-    pass
-
-
-class PhilipsTelemetryStream(TelemetryStream):
-    """
-    Intellivue(Philips) 모니터와 RS232로 통신하는 클래스.
-    TelemetryStream을 상속하여 필요함수 override.
-    """
-
-    def __init__(self, *args, **kwargs):
-        super(PhilipsTelemetryStream, self).__init__(*args, **kwargs)
-
-        self.logger.name = 'PhilipsTelemetry'
-
-        serialPort = kwargs.get('port')
-        selectedDataTypes = kwargs.get('values')[::2]
-
-        self.port = serialPort
-        self.rs232 = None
-
-        # Initialize Intellivue Decoder and Distiller
-        self.decoder = IntellivueDecoder()
-        self.distiller = IntellivueDistiller()
-
-        # Data collection params
-        self.dataCollectionTime = 72 * 60 * 60  # seconds
-        self.dataCollection = {'RelativeTime': self.dataCollectionTime * 8000}
-        self.KeepAliveTime = 0
-        self.messageTimes = []
-        self.desiredWaveParams = {'TextIdLabel': selectedDataTypes}
-        self.initialTime = 0
-        self.relativeInitialTime = 0
-
-        # Messages
-        self.AssociationRequest = self.decoder.writeData('AssociationRequest')
-        self.AssociationAbort = self.decoder.writeData('AssociationAbort')
-        self.ConnectIndication = {}
-        self.AssociationResponse = ''
-        self.MDSCreateEvent = {}
-        self.MDSParameters = {}
-        self.MDSCreateEventResult = ''
-        self.MDSSetPriorityListWave = self.decoder.writeData('MDSSetPriorityListWAVE', self.desiredWaveParams)
-        self.MDSSetPriorityListNumeric = ''
-        self.MDSSetPriorityListResultWave = {}
-        self.MDSSetPriorityListResultNumeric = {}
-        self.MDSGetPriorityList = self.decoder.writeData('MDSGetPriorityList')
-        self.MDSGetPriorityListResult = {}
-        self.ReleaseRequest = self.decoder.writeData('ReleaseRequest')
-        self.MDSExtendedPollActionNumeric = self.decoder.writeData(
-            'MDSExtendedPollActionNUMERIC', self.dataCollection)
-        self.MDSExtendedPollActionWave = self.decoder.writeData(
-            'MDSExtendedPollActionWAVE', self.dataCollection)
-        self.MDSExtendedPollActionAlarm = self.decoder.writeData(
-            'MDSExtendedPollActionALARM', self.dataCollection)
-        self.KeepAliveMessage = self.decoder.writeData('MDSSinglePollAction')
-
-        self.data_flow = False
-        self.last_read_time = time.time()
-        self.timeout = 10
-        self.last_keep_alive = time.time()
-
-    def initiate_association(self, blocking=False):
-        def request_association():
-            if not self.rs232:
-                logging.warning('Trying to send an Association Request without a socket!')
-                raise CriticalIOError
-            try:
-                self.rs232.send(self.AssociationRequest)
-                self.logger.debug('Sent Association Request...')
-            except:
-                self.logger.warning("Unable to send Association Request")
-                raise IOError
-
-        def receive_association_response():
-            association_message = self.rs232.receive()
-            if not association_message:
-                logging.warning('No association received')
-                raise IOError
-
-            message_type = self.decoder.getMessageType(association_message)
-            self.logger.debug('Received ' + message_type + '.')
-
-            if message_type == 'AssociationResponse':
-                return association_message
-            elif message_type == 'TimeoutError':
-                raise IOError
-            elif message_type in ['AssociationAbort', 'ReleaseRequest', 'Unknown']:
-                raise CriticalIOError
-            elif message_type in ['MDSExtendedPollActionResult', 'LinkedMDSExtendedPollActionResult']:
-                raise CriticalIOError
-            else:
-                raise IOError
-
-        def receive_event_creation(association_message):
-            event_message = self.rs232.receive()
-            message_type = self.decoder.getMessageType(event_message)
-            logging.debug('Received ' + message_type + '.')
-
-            if message_type == 'MDSCreateEvent':
-                self.AssociationResponse = self.decoder.readData(association_message)
-                logging.debug("Association response: {0}".format(self.AssociationResponse))
-
-                self.KeepAliveTime = (
-                    self.AssociationResponse['AssocRespUserData']['MDSEUserInfoStd']['supported_aprofiles']
-                    ['AttributeList']['AVAType']['NOM_POLL_PROFILE_SUPPORT']['AttributeValue']
-                    ['PollProfileSupport']['min_poll_period']['RelativeTime'] / 8000
-                )
-                self.MDSCreateEvent, self.MDSParameters = self.decoder.readData(event_message)
-                self.initialTime = (
-                    self.MDSCreateEvent['MDSCreateInfo']['MDSAttributeList']['AttributeList']['AVAType']
-                    ['NOM_ATTR_TIME_ABS']['AttributeValue']['AbsoluteTime']
-                )
-                self.relativeInitialTime = (
-                    self.MDSCreateEvent['MDSCreateInfo']['MDSAttributeList']['AttributeList']['AVAType']
-                    ['NOM_ATTR_TIME_REL']['AttributeValue']['RelativeTime']
-                )
-                if 'saveInitialTime' in dir(self.distiller):
-                    self.distiller.saveInitialTime(self.initialTime, self.relativeInitialTime)
-
-                self.MDSCreateEventResult = self.decoder.writeData('MDSCreateEventResult', self.MDSParameters)
-                self.rs232.send(self.MDSCreateEventResult)
-                logging.debug('Sent MDS Create Event Result...')
-                return
-            else:
-                self.logger.error('Bad handshake!')
-                raise CriticalIOError
-
-        if blocking:
-            io_errors = 0
-            while 1:
-                try:
-                    request_association()
-                    m = receive_association_response()
-                    receive_event_creation(m)
-                    break
-                except CriticalIOError:
-                    logging.error('Critical IOError, resetting socket')
-                    raise
-                except IOError:
-                    io_errors += 1
-                    if io_errors >= 12:
-                        logging.error('Escalating IOError, resetting socket')
-                        raise
-                    else:
-                        logging.error('IOError, waiting to try again {0}'.format(io_errors))
-                        time.sleep(2.0)
-                        continue
-        else:
-            request_association()
-            m = receive_association_response()
-            receive_event_creation(m)
-
-    def set_priority_lists(self):
-        self.MDSSetPriorityListWave = self.decoder.writeData('MDSSetPriorityListWAVE', self.desiredWaveParams)
-        self.rs232.send(self.MDSSetPriorityListWave)
-        logging.debug('Sent MDS Set Priority List Wave...')
-
-        no_confirmation = True
-        while no_confirmation:
-            message = self.rs232.receive()
-            if not message:
-                logging.warning('No priority list msg received!')
-                break
-
-            message_type = self.decoder.getMessageType(message)
-            if message_type == 'MDSSetPriorityListResult':
-                PriorityListResult = self.decoder.readData(message)
-                if 'NOM_ATTR_POLL_RTSA_PRIO_LIST' in PriorityListResult['SetResult']['AttributeList']['AVAType']:
-                    self.MDSSetPriorityListResultWave = PriorityListResult
-                    logging.debug('Received MDS Set Priority List Result Wave.')
-                no_confirmation = False
-            elif message_type == 'MDSCreateEvent':
-                no_confirmation = False
-                logging.warning('Failed to confirm priority list setting.')
-
-    def submit_keep_alive(self):
-        self.rs232.send(self.KeepAliveMessage)
-        self.last_keep_alive = time.time()
-        logging.debug('Sent Keep Alive Message...')
-
-    def close(self):
-        if 0:  # self.rs232 is None:
-            logging.error('Trying to close a socket that no longer exists')
-            raise IOError
-
-        self.rs232.send(self.AssociationAbort)
-        logging.debug('Sent Association Abort...')
-        self.rs232.send(self.ReleaseRequest)
-        logging.debug('Sent Release Request...')
-
-        not_refused = True
-        count = 0
-        while not_refused:
-            message = self.rs232.receive()
-            if not message:
-                logging.debug('No release msg received!')
-                break
-            message_type = self.decoder.getMessageType(message)
-            logging.debug('Received ' + message_type + '.')
-
-            if message_type in ['ReleaseResponse', 'AssociationAbort', 'TimeoutError', 'Unknown']:
-                logging.debug('Connection with monitor released.')
-            elif count % 12 == 0:
-                self.rs232.send(self.AssociationAbort)
-                logging.debug('Re-sent Association Abort...')
-                self.rs232.send(self.ReleaseRequest)
-                logging.debug('Re-sent Release Request...')
-
-            logging.debug('Trying to disconnect {0}'.format(count))
-            count += 1
-
-        self.rs232.close()
-        self.rs232 = None
-
-    def start_polling(self):
-        self.rs232.send(self.MDSExtendedPollActionNumeric)
-        logging.debug('Sent MDS Extended Poll Action for Numerics...')
-        self.rs232.send(self.MDSExtendedPollActionWave)
-        logging.debug('Sent MDS Extended Poll Action for Waves...')
-        self.rs232.send(self.MDSExtendedPollActionAlarm)
-        logging.debug('Sent MDS Extended Poll Action for Alarms...')
-
-    def single_poll(self):
-        now = time.time()
-        if (now - self.last_keep_alive) > (self.KeepAliveTime - 5):
-            self.submit_keep_alive()
-
-        m = None
-        message = self.rs232.receive()
-        if not message:
-            logging.warning('No message received')
-            if (now - self.last_read_time) > self.timeout:
-                logging.error('Data stream timed out')
-                raise IOError
-            return
-
-        message_type = self.decoder.getMessageType(message)
-        logging.debug(message_type)
-
-        if message_type in ['AssociationAbort', 'ReleaseResponse']:
-            logging.error('Received \'Data Collection Terminated\' message type.')
-            raise IOError
-        elif message_type == 'RemoteOperationError':
-            logging.warning('Received (unhandled) \'RemoteOpsError\' message type')
-        elif message_type == 'MDSSinglePollActionResult':
-            logging.debug('Received (unhandled) \'SinglePollActionResult\' message type')
-        elif message_type in ['MDSExtendedPollActionResult', 'LinkedMDSExtendedPollActionResult']:
-            decoded_message = self.decoder.readData(message)
-            m = self.distiller.refine(decoded_message)
-            if not m:
-                logging.warning('Failed to distill message: {0}'.format(decoded_message))
-            else:
-                self.last_read_time = time.time()
-        else:
-            logging.warning('Received {0}'.format(message_type))
-
-        if m:
-            return self.condense(m)
-
-    @staticmethod
-    def condense(m):
-        ecg_label = None
-        for key in m.keys():
-            if 'ECG' in key:
-                ecg_label = key
-                break
-
-        bp = {
-            'systolic': m.get('non-invasive blood pressure_SYS'),
-            'diastolic': m.get('non-invasive blood pressure_DIA'),
-            'mean': m.get('non-invasive blood pressure_MEAN')
-        }
-
-        airway = {
-            'etCO2': m.get('etCO2'),
-            'Respiration Rate': m.get('Airway Respiration Rate')
-        }
-
-        ret = {
-            'II': m.get(ecg_label),
-            'Pleth': m.get('PLETH wave label'),
-            'Heart Rate': m.get('Heart Rate'),
-            'SpO2': m.get('Arterial Oxygen Saturation'),
-            'Respiration Rate': m.get('Respiration Rate'),
-            'Non-invasive Blood Pressure': bp,
-            'Airway': airway,
-            'alarms': m.get('alarms'),
-            'timestamp': m.get('timestamp')
-        }
-        return ret
-
-    def open(self, blocking=False):
-        opened = False
-        while not opened:
-            try:
-                self.rs232 = RS232(self.port)
-                self.initiate_association(blocking)
-                self.set_priority_lists()
-                self.start_polling()
-                self.last_read_time = time.time()
-                opened = True
-            except IOError:
-                logging.error('Failed to open connection to {0}, waiting to try again'.format(self.port))
-                time.sleep(1.0)
-                self.close()
-                pass
-
-    def read(self, count=1, blocking=False):
-        if count == 1:
-            try:
-                data = self.single_poll()
-                self.update_sampled_data(data)
-                if data:
-                    for f in self.update_funcs:
-                        new_data = f(sampled_data=self.sampled_data, **data)
-                        data.update(new_data)
-                self.logger.info(data)
-                return data
-            except IOError:
-                while 1:
-                    logging.error('IOError reading stream, resetting connection')
-                    try:
-                        self.close()
-                    except IOError:
-                        logging.error('Ignoring IOError closing connection')
-                    try:
-                        self.open(blocking)
-                        return self.read(1)
-                    except IOError:
-                        logging.error('IOError reestablishing connection, trying again')
-                        time.sleep(1.0)
-                        pass
-        else:
-            ret = []
-            for i in range(0, count):
-                d = self.read(1, blocking=blocking)
-                if d:
-                    ret.append(d)
-            return ret
-
 
 ##################################################
 # 알람 (GPIO) 코드 - 메인 프로세스에서만 사용
@@ -1146,8 +801,9 @@ def update_plot(q_wave, q_ABPoutput, stop_event, q_alarm_flag):
     update_time_HR = time.time()
     textoff_time = 30
 
-    base_time_ecg = time.time() - 100
-    base_time_ppg = time.time() - 100
+    # Sample times are converted from monotonic ns to seconds for display
+    base_time_ecg = time.monotonic() - 100
+    base_time_ppg = time.monotonic() - 100
     t_pre = time.time()
     abplim_first = 1
     skip_frame = 3
@@ -1158,6 +814,9 @@ def update_plot(q_wave, q_ABPoutput, stop_event, q_alarm_flag):
             (t_ecg, s_ecg, t_pleth, s_pleth,
              s_abp, predict_abp,
              HR, SPO2, t_receive, is_estiABP) = q_ABPoutput.get(timeout=0)
+            t_ecg = np.divide(t_ecg, 1e9)
+            t_pleth = np.divide(t_pleth, 1e9)
+            t_receive = t_receive / 1e9
 
             if skip_frame > 0:
                 skip_frame -= 1
@@ -1332,9 +991,9 @@ def update_plot(q_wave, q_ABPoutput, stop_event, q_alarm_flag):
                 blink_mBP_state = False
                 txt_MAP.set_color(color_BP_normal)
 
-        now_t = time.time() - base_time_ecg - 1.7
+        now_t = time.monotonic() - base_time_ecg - 1.7
         ax_wECG.set_xlim(now_t - 5, now_t)
-        now_t = time.time() - base_time_ppg - 2.0
+        now_t = time.monotonic() - base_time_ppg - 2.0
         ax_wPPG.set_xlim(now_t - 5, now_t)
         ax_wABP.set_xlim(now_t - 5, now_t)
 
@@ -1518,7 +1177,9 @@ if __name__ == '__main__':
         print(f"선택된 포트로 프로세스를 시작합니다: {port_sel}")
         tstream = PhilipsTelemetryStream(port=port_sel,
                                          values=["Pleth", 32*4, 'II', 64*8],
-                                         polling_interval=0.05)
+                                         polling_interval=0.05,
+                                         fused_waves=True,
+                                         counters_report=print)
     else:
         print("포트가 선택되지 않았습니다.")
         os._exit(0)
@@ -1583,7 +1244,8 @@ if __name__ == '__main__':
                 timer.cancel()
 
                 if data:
-                    t_receive = time.time()
+                    # Same timeline as the sample times (monotonic ns)
+                    t_receive = time.monotonic_ns()
                     HR = data.get('Heart Rate')
                     if HR:
                         buff_HR = HR
@@ -1609,14 +1271,16 @@ if __name__ == '__main__':
                             PPG = channel_PPG.get('samples')
                             if ECG and PPG:
                                 # 업데이트된 PPG만 추출
-                                idx_update = bisect.bisect_right(PPG.t, buff_tPPG[-1])
-                                if idx_update < len(PPG.t):
-                                    buff_tPPG.extend(PPG.t[idx_update:])
+                                tPPG = PPG.t
+                                idx_update = bisect.bisect_right(tPPG, buff_tPPG[-1])
+                                if idx_update < len(tPPG):
+                                    buff_tPPG.extend(tPPG[idx_update:])
                                     buff_PPG.extend(PPG.y[idx_update:])
                                 # 일정 주기(0.8초)에 한 번씩 ABP 추정 프로세스로 데이터 전달
                                 if not ABP_event.is_set() and (time.time() - t_lastTrans > 0.8):
                                     ABP_event.set()
-                                    q_ABPinput.put((ECG.t, ECG.y,
+                                    # The queue pickles later, in its feeder thread: copy the views
+                                    q_ABPinput.put((ECG.t.copy(), ECG.y.copy(),
                                                     buff_tPPG, buff_PPG,
                                                     buff_HR, buff_SPO2,
                                                     t_receive))
@@ -0,0 +1,589 @@
+"""
+Telemetry stream of a Philips Intellivue monitor over RS232.
+
+PhilipsTelemetryStream runs the association handshake, keep-alives and polls
+of one monitor and publishes what the distiller makes of the results. It has
+no GUI or model dependencies, so Main (the bedside display) and Acquisition
+(several monitors in one process) both build on it.
+"""
+
+from __future__ import unicode_literals
+
+import asyncio
+import logging
+import struct
+import time
+from collections import Counter
+
+from IntellivueProtocol.IntellivueDecoder import IntellivueDecoder
+from IntellivueProtocol.RS232 import RS232, AsyncRS232, ReplayRS232, LINK_COUNTERS
+from IntellivueProtocol.IntellivueDistiller import IntellivueDistiller
+from TelemetryStream import TelemetryStream
+
+
+class CriticalIOError(IOError):
+    """Need to tear the socket down and reset."""
+    pass
+
+
+class PhilipsTelemetryStream(TelemetryStream):
+    """
+    Intellivue(Philips) 모니터와 RS232로 통신하는 클래스.
+    TelemetryStream을 상속하여 필요함수 override.
+    """
+
+    # Attributes read from the association response, MDS create event and priority list result
+    HANDSHAKE_ATTRIBUTES = ('NOM_POLL_PROFILE_SUPPORT', 'NOM_ATTR_TIME_ABS', 'NOM_ATTR_TIME_REL',
+                            'NOM_ATTR_POLL_RTSA_PRIO_LIST')
+
+    def __init__(self, *args, **kwargs):
+        super(PhilipsTelemetryStream, self).__init__(*args, **kwargs)
+
+        self.logger.name = 'PhilipsTelemetry'
+
+        serialPort = kwargs.get('port')
+        selectedDataTypes = kwargs.get('values')[::2]
+
+        self.port = serialPort
+        self.rs232 = None
+
+        # Opt-in: read the serial port on a dedicated thread and poll in batches
+        self.reader_thread = kwargs.get('reader_thread', False)
+        self.last_arrival_ns = None
+
+        # Serial transport class: RS232 by default, AsyncRS232 with aopen().
+        # transport=ReplayRS232 with port=<capture file> replays a recorded session.
+        self.transport = kwargs.get('transport')
+
+        # Opt-in: tee every byte received from the monitor to this capture file
+        self.capture_file = kwargs.get('capture_file')
+        if self.capture_file and self.transport is not None and issubclass(self.transport, ReplayRS232):
+            raise ValueError('capture_file cannot be used with ReplayRS232, which reads a capture')
+
+        # Initialize Intellivue Decoder and Distiller
+        self.decoder = IntellivueDecoder()
+        self.distiller = IntellivueDistiller()
+
+        # Only decode the attributes used by the distiller and the handshake,
+        # unless decode_all_attributes is set
+        if not kwargs.get('decode_all_attributes', False):
+            self.decoder.selectAttributes(self.distiller.ATTRIBUTES + self.HANDSHAKE_ATTRIBUTES)
+
+        # Opt-in: the distiller scales wave samples straight into the sampled
+        # data buffers, results only tell which buffers got new samples
+        if kwargs.get('fused_waves', False):
+            self.distiller.bindWaves(self.wave_sink)
+
+        # Data collection params
+        self.dataCollectionTime = 72 * 60 * 60  # seconds
+        self.dataCollection = {'RelativeTime': self.dataCollectionTime * 8000}
+        self.KeepAliveTime = 0
+        self.messageTimes = []
+        self.desiredWaveParams = {'TextIdLabel': selectedDataTypes}
+        self.initialTime = 0
+        self.relativeInitialTime = 0
+
+        # Messages
+        self.AssociationRequest = self.decoder.writeData('AssociationRequest')
+        self.AssociationAbort = self.decoder.writeData('AssociationAbort')
+        self.ConnectIndication = {}
+        self.AssociationResponse = ''
+        self.MDSCreateEvent = {}
+        self.MDSParameters = {}
+        self.MDSCreateEventResult = ''
+        self.MDSSetPriorityListWave = self.decoder.writeData('MDSSetPriorityListWAVE', self.desiredWaveParams)
+        self.MDSSetPriorityListNumeric = ''
+        self.MDSSetPriorityListResultWave = {}
+        self.MDSSetPriorityListResultNumeric = {}
+        self.MDSGetPriorityList = self.decoder.writeData('MDSGetPriorityList')
+        self.MDSGetPriorityListResult = {}
+        self.ReleaseRequest = self.decoder.writeData('ReleaseRequest')
+        self.MDSExtendedPollActionNumeric = self.decoder.writeData(
+            'MDSExtendedPollActionNUMERIC', self.dataCollection)
+        self.MDSExtendedPollActionWave = self.decoder.writeData(
+            'MDSExtendedPollActionWAVE', self.dataCollection)
+        self.MDSExtendedPollActionAlarm = self.decoder.writeData(
+            'MDSExtendedPollActionALARM', self.dataCollection)
+        self.KeepAliveMessage = self.decoder.writeData('MDSSinglePollAction')
+
+        self.data_flow = False
+        self.last_read_time = time.time()
+        self.timeout = 10
+        self.last_keep_alive = time.time()
+
+        # Stream counters; the link counters are kept by the transport, and
+        # summed here over reconnects (see read_counters())
+        self.counters = Counter(dict.fromkeys(['keep_alives', 'polls', 'results', 'malformed_messages',
+                                                'poll_latency_ns'], 0))
+        self.link_counters = Counter(dict.fromkeys(LINK_COUNTERS, 0))
+        self.poll_sent_ns = None
+
+        # Seconds between counter dumps (0 to never dump), and where their
+        # report lines go: the log by default, which Main disables, so it
+        # passes print
+        self.counters_interval = kwargs.get('counters_interval', 60)
+        self.counters_report = kwargs.get('counters_report', logging.info)
+        self.last_counters = self.read_counters()
+
+    def initiate_association(self, blocking=False):
+        def request_association():
+            if not self.rs232:
+                logging.warning('Trying to send an Association Request without a socket!')
+                raise CriticalIOError
+            try:
+                self.rs232.send(self.AssociationRequest)
+                self.logger.debug('Sent Association Request...')
+            except:
+                self.logger.warning("Unable to send Association Request")
+                raise IOError
+
+        def receive_association_response():
+            association_message = self.rs232.receive()
+            if not association_message:
+                logging.warning('No association received')
+                raise IOError
+
+            message_type = self.decoder.getMessageType(association_message)
+            self.logger.debug('Received ' + message_type + '.')
+
+            if message_type == 'AssociationResponse':
+                return association_message
+            elif message_type == 'TimeoutError':
+                raise IOError
+            elif message_type in ['AssociationAbort', 'ReleaseRequest', 'Unknown']:
+                raise CriticalIOError
+            elif message_type in ['MDSExtendedPollActionResult', 'LinkedMDSExtendedPollActionResult']:
+                raise CriticalIOError
+            else:
+                raise IOError
+
+        def receive_event_creation(association_message):
+            event_message = self.rs232.receive()
+            message_type = self.decoder.getMessageType(event_message)
+            logging.debug('Received ' + message_type + '.')
+
+            if message_type == 'MDSCreateEvent':
+                self.AssociationResponse = self.decoder.readData(association_message)
+                logging.debug("Association response: {0}".format(self.AssociationResponse))
+
+                self.KeepAliveTime = (
+                    self.AssociationResponse['AssocRespUserData']['MDSEUserInfoStd']['supported_aprofiles']
+                    ['AttributeList']['AVAType']['NOM_POLL_PROFILE_SUPPORT']['AttributeValue']
+                    ['PollProfileSupport']['min_poll_period']['RelativeTime'] / 8000
+                )
+                self.MDSCreateEvent, self.MDSParameters = self.decoder.readData(event_message)
+                self.initialTime = (
+                    self.MDSCreateEvent['MDSCreateInfo']['MDSAttributeList']['AttributeList']['AVAType']
+                    ['NOM_ATTR_TIME_ABS']['AttributeValue']['AbsoluteTime']
+                )
+                self.relativeInitialTime = (
+                    self.MDSCreateEvent['MDSCreateInfo']['MDSAttributeList']['AttributeList']['AVAType']
+                    ['NOM_ATTR_TIME_REL']['AttributeValue']['RelativeTime']
+                )
+                if 'saveInitialTime' in dir(self.distiller):
+                    self.distiller.saveInitialTime(self.initialTime, self.relativeInitialTime)
+
+                self.MDSCreateEventResult = self.decoder.writeData('MDSCreateEventResult', self.MDSParameters)
+                self.rs232.send(self.MDSCreateEventResult)
+                logging.debug('Sent MDS Create Event Result...')
+                return
+            else:
+                self.logger.error('Bad handshake!')
+                raise CriticalIOError
+
+        if blocking:
+            io_errors = 0
+            while 1:
+                try:
+                    request_association()
+                    m = receive_association_response()
+                    receive_event_creation(m)
+                    break
+                except CriticalIOError:
+                    logging.error('Critical IOError, resetting socket')
+                    raise
+                except IOError:
+                    io_errors += 1
+                    if io_errors >= 12:
+                        logging.error('Escalating IOError, resetting socket')
+                        raise
+                    else:
+                        logging.error('IOError, waiting to try again {0}'.format(io_errors))
+                        time.sleep(2.0)
+                        continue
+        else:
+            request_association()
+            m = receive_association_response()
+            receive_event_creation(m)
+
+    def set_priority_lists(self):
+        self.MDSSetPriorityListWave = self.decoder.writeData('MDSSetPriorityListWAVE', self.desiredWaveParams)
+        self.rs232.send(self.MDSSetPriorityListWave)
+        logging.debug('Sent MDS Set Priority List Wave...')
+
+        no_confirmation = True
+        while no_confirmation:
+            message = self.rs232.receive()
+            if not message:
+                logging.warning('No priority list msg received!')
+                break
+
+            message_type = self.decoder.getMessageType(message)
+            if message_type == 'MDSSetPriorityListResult':
+                PriorityListResult = self.decoder.readData(message)
+                if 'NOM_ATTR_POLL_RTSA_PRIO_LIST' in PriorityListResult['SetResult']['AttributeList']['AVAType']:
+                    self.MDSSetPriorityListResultWave = PriorityListResult
+                    logging.debug('Received MDS Set Priority List Result Wave.')
+                no_confirmation = False
+            elif message_type == 'MDSCreateEvent':
+                no_confirmation = False
+                logging.warning('Failed to confirm priority list setting.')
+
+    def submit_keep_alive(self):
+        self.rs232.send(self.KeepAliveMessage)
+        self.last_keep_alive = time.time()
+        self.counters['keep_alives'] += 1
+        logging.debug('Sent Keep Alive Message...')
+
+    def close(self):
+        if 0:  # self.rs232 is None:
+            logging.error('Trying to close a socket that no longer exists')
+            raise IOError
+
+        self.rs232.send(self.AssociationAbort)
+        logging.debug('Sent Association Abort...')
+        self.rs232.send(self.ReleaseRequest)
+        logging.debug('Sent Release Request...')
+
+        not_refused = True
+        count = 0
+        while not_refused:
+            message = self.rs232.receive()
+            if not message:
+                logging.debug('No release msg received!')
+                break
+            message_type = self.decoder.getMessageType(message)
+            logging.debug('Received ' + message_type + '.')
+
+            if message_type in ['ReleaseResponse', 'AssociationAbort', 'TimeoutError', 'Unknown']:
+                logging.debug('Connection with monitor released.')
+            elif count % 12 == 0:
+                self.rs232.send(self.AssociationAbort)
+                logging.debug('Re-sent Association Abort...')
+                self.rs232.send(self.ReleaseRequest)
+                logging.debug('Re-sent Release Request...')
+
+            logging.debug('Trying to disconnect {0}'.format(count))
+            count += 1
+
+        self.link_counters.update(self.rs232.counters)
+        self.rs232.close()
+        self.rs232 = None
+
+    def start_polling(self):
+        self.rs232.send(self.MDSExtendedPollActionNumeric)
+        logging.debug('Sent MDS Extended Poll Action for Numerics...')
+        self.rs232.send(self.MDSExtendedPollActionWave)
+        logging.debug('Sent MDS Extended Poll Action for Waves...')
+        self.rs232.send(self.MDSExtendedPollActionAlarm)
+        logging.debug('Sent MDS Extended Poll Action for Alarms...')
+        self.poll_sent_ns = time.monotonic_ns()
+        self.counters['polls'] += 1
+
+    def read_counters(self):
+        """
+        Link counters of the transport (summed over reconnects) and stream
+        counters, cheap enough to call from another thread
+
+        returns: counters - dict, including 'dropped_packets' of the sampled
+                 data buffers and the monotonic 'time' of the copy (seconds)
+        """
+        counters = Counter(self.link_counters)
+        rs232 = self.rs232
+        if rs232 is not None:
+            counters.update(rs232.counters)
+        counters.update(self.counters)
+        counters['dropped_packets'] = sum(d['samples'].dropped_packets for d in self.sampled_data.values())
+        counters = dict(counters)
+        counters['time'] = time.monotonic()
+        return counters
+
+    def dump_counters(self):
+        """
+        Reports the counters (see counters_report), with throughput since the
+        previous dump
+
+        returns: counters - as read_counters(), plus 'frames/s' and 'kB/s' received
+        """
+        counters = self.read_counters()
+        last = self.last_counters
+        elapsed = max(counters['time'] - last['time'], 1e-9)
+        counters['frames/s'] = (counters['framesIn'] - last['framesIn']) / elapsed
+        counters['kB/s'] = (counters['bytesIn'] - last['bytesIn']) / elapsed / 1e3
+        self.last_counters = counters
+
+        self.counters_report('{0}: {1[frames/s]:.1f} frames/s {1[kB/s]:.1f} kB/s in, {1[crcFailures]} CRC failures, '
+                             '{1[framingErrors]} framing errors, {1[incompleteFrames]} incomplete frames, '
+                             '{1[resyncs]} resyncs ({1[discardedBytes]} bytes), {1[droppedFrames]} dropped frames, '
+                             '{1[dropped_packets]} dropped packets, {1[malformed_messages]} malformed messages, '
+                             '{1[keep_alives]} keep-alives, '
+                             'poll latency {2:.1f} ms'.format(self.port, counters, counters['poll_latency_ns'] / 1e6))
+        return counters
+
+    def check_counters(self):
+        if self.counters_interval and (time.monotonic() - self.last_counters['time']) > self.counters_interval:
+            self.dump_counters()
+
+    def single_poll(self):
+        now = time.time()
+        if (now - self.last_keep_alive) > (self.KeepAliveTime - 5):
+            self.submit_keep_alive()
+        self.check_counters()
+
+        if self.reader_thread:
+            return self.batch_poll(now)
+
+        message = self.rs232.receive()
+        if not message:
+            logging.warning('No message received')
+            if (now - self.last_read_time) > self.timeout:
+                logging.error('Data stream timed out')
+                raise IOError
+            return
+
+        return self.handle_message(message)
+
+    def batch_poll(self, now):
+        """
+        Drains every frame the reader thread has queued since the last poll.
+        Returns a list of condensed messages (possibly empty).
+        """
+        batch = self.rs232.receiveBatch()
+        if not batch:
+            if (now - self.last_read_time) > self.timeout:
+                logging.error('Data stream timed out')
+                raise IOError
+            return []
+
+        return self.handle_batch(batch)
+
+    def handle_batch(self, batch):
+        ret = []
+        for arrival, message in batch:
+            data = self.handle_message(message, arrival)
+            if data:
+                self.last_arrival_ns = arrival
+                ret.append(data)
+        return ret
+
+    def handle_message(self, message, arrival=None):
+        m = None
+        message_type = self.decoder.getMessageType(message)
+        logging.debug(message_type)
+
+        if message_type in ['AssociationAbort', 'ReleaseResponse']:
+            logging.error('Received \'Data Collection Terminated\' message type.')
+            raise IOError
+        elif message_type == 'RemoteOperationError':
+            logging.warning('Received (unhandled) \'RemoteOpsError\' message type')
+        elif message_type == 'MDSSinglePollActionResult':
+            logging.debug('Received (unhandled) \'SinglePollActionResult\' message type')
+        elif message_type in ['MDSExtendedPollActionResult', 'LinkedMDSExtendedPollActionResult']:
+            if self.poll_sent_ns is not None:
+                self.counters['poll_latency_ns'] = (arrival or time.monotonic_ns()) - self.poll_sent_ns
+                self.poll_sent_ns = None
+            self.counters['results'] += 1
+            # Malformed results (rejected by the decoder before reading them,
+            # or failing to read) are dropped, the connection is sound
+            try:
+                decoded_message = self.decoder.readData(message)
+            except (ValueError, KeyError, IndexError, struct.error) as error:
+                self.counters['malformed_messages'] += 1
+                logging.warning('Dropped malformed {0}: {1}'.format(message_type, error))
+                return
+            m = self.distiller.refine(decoded_message)
+            # Alarm results only distill to changes of the active alarms
+            if m or decoded_message['PollMdibDataReplyExt']['Type']['OIDType'] == 'NOM_MOC_VMO_AL_MON':
+                self.last_read_time = time.time()
+            else:
+                logging.warning('Failed to distill message: {0}'.format(decoded_message))
+        else:
+            logging.warning('Received {0}'.format(message_type))
+
+        if m:
+            return self.condense(m)
+
+    @staticmethod
+    def merge(batch):
+        """
+        Folds a batch of condensed messages into one, keeping the latest
+        non-empty value of each field (nested dicts are merged per field,
+        lists such as alarm_events are concatenated)
+        """
+        merged = {}
+        for data in batch:
+            for key, value in data.items():
+                if isinstance(value, list) and isinstance(merged.get(key), list):
+                    merged[key] = merged[key] + value
+                elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+                    merged[key] = dict(merged[key], **{k: v for k, v in value.items() if v is not None})
+                elif value is not None or key not in merged:
+                    merged[key] = value
+        return merged
+
+    def wave_sink(self, label):
+        """
+        Sampled data buffer of a distiller wave channel, named as in condense()
+        (an ECG lead is 'II'), for fused distillation
+        """
+        name = 'II' if 'ECG' in label else {'PLETH wave label': 'Pleth'}.get(label)
+        if name in self.sampled_data:
+            return name, self.sampled_data[name]['samples']
+
+    @staticmethod
+    def condense(m):
+        ecg_label = None
+        for key in m.keys():
+            if 'ECG' in key:
+                ecg_label = key
+                break
+
+        bp = {
+            'systolic': m.get('non-invasive blood pressure_SYS'),
+            'diastolic': m.get('non-invasive blood pressure_DIA'),
+            'mean': m.get('non-invasive blood pressure_MEAN')
+        }
+
+        airway = {
+            'etCO2': m.get('etCO2'),
+            'Respiration Rate': m.get('Airway Respiration Rate')
+        }
+
+        ret = {
+            'II': m.get(ecg_label),
+            'Pleth': m.get('PLETH wave label'),
+            'Heart Rate': m.get('Heart Rate'),
+            'SpO2': m.get('Arterial Oxygen Saturation'),
+            'Respiration Rate': m.get('Respiration Rate'),
+            'Non-invasive Blood Pressure': bp,
+            'Airway': airway,
+            'alarm_events': m.get('alarm_events'),
+            'stored': m.get('stored'),
+            'timestamp': m.get('timestamp')
+        }
+        return ret
+
+    def open(self, blocking=False):
+        opened = False
+        while not opened:
+            try:
+                transport_args = {'readerThread': self.reader_thread}
+                if self.capture_file:
+                    transport_args['captureFile'] = self.capture_file
+                self.rs232 = (self.transport or RS232)(self.port, **transport_args)
+                self.rs232.cacheFrames([self.AssociationRequest, self.AssociationAbort, self.ReleaseRequest,
+                                        self.MDSSetPriorityListWave, self.KeepAliveMessage,
+                                        self.MDSExtendedPollActionNumeric, self.MDSExtendedPollActionWave,
+                                        self.MDSExtendedPollActionAlarm])
+                self.initiate_association(blocking)
+                self.set_priority_lists()
+                self.start_polling()
+                self.last_read_time = time.time()
+                opened = True
+            except IOError:
+                logging.error('Failed to open connection to {0}, waiting to try again'.format(self.port))
+                time.sleep(1.0)
+                self.close()
+                pass
+
+    def publish(self, data):
+        if isinstance(data, list):
+            # Batch from the reader thread: buffer every packet, report the latest values
+            for d in data:
+                self.update_sampled_data(d)
+            data = self.merge(data) or None
+        else:
+            self.update_sampled_data(data)
+        if data:
+            for f in self.update_funcs:
+                new_data = f(sampled_data=self.sampled_data, **data)
+                data.update(new_data)
+        self.logger.info(data)
+        return data
+
+    def read(self, count=1, blocking=False):
+        if count == 1:
+            try:
+                return self.publish(self.single_poll())
+            except IOError:
+                while 1:
+                    logging.error('IOError reading stream, resetting connection')
+                    try:
+                        self.close()
+                    except IOError:
+                        logging.error('Ignoring IOError closing connection')
+                    try:
+                        self.open(blocking)
+                        return self.read(1)
+                    except IOError:
+                        logging.error('IOError reestablishing connection, trying again')
+                        time.sleep(1.0)
+                        pass
+        else:
+            ret = []
+            for i in range(0, count):
+                d = self.read(1, blocking=blocking)
+                if d:
+                    ret.append(d)
+            return ret
+
+    async def aopen(self, blocking=False):
+        """
+        Runs the (blocking) association handshake in a worker thread, then
+        hands the serial port to the running event loop
+        """
+        if self.transport is None:
+            self.transport = AsyncRS232
+        elif not issubclass(self.transport, AsyncRS232):
+            raise TypeError('aopen() needs an AsyncRS232 transport, not {0}'.format(self.transport.__name__))
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.open, blocking)
+        self.rs232.attach(loop)
+
+    async def aclose(self):
+        loop = asyncio.get_running_loop()
+        if self.rs232:
+            self.rs232.detach()
+        await loop.run_in_executor(None, self.close)
+
+    async def aread(self, blocking=False):
+        try:
+            now = time.time()
+            if (now - self.last_keep_alive) > (self.KeepAliveTime - 5):
+                self.submit_keep_alive()
+            self.check_counters()
+
+            # Wake up in time for the next keep-alive or the data timeout
+            wake = min(self.last_keep_alive + self.KeepAliveTime - 5, self.last_read_time + self.timeout)
+            batch = await self.rs232.receiveBatchAsync(timeout=max(0, wake - now))
+            if not batch:
+                if (time.time() - self.last_read_time) > self.timeout:
+                    logging.error('Data stream timed out')
+                    raise IOError
+                return
+
+            return self.publish(self.handle_batch(batch))
+        except IOError:
+            while 1:
+                logging.error('IOError reading stream, resetting connection')
+                try:
+                    await self.aclose()
+                except IOError:
+                    logging.error('Ignoring IOError closing connection')
+                try:
+                    await self.aopen(blocking)
+                    return
+                except IOError:
+                    logging.error('IOError reestablishing connection, trying again')
+                    await asyncio.sleep(1.0)
@@ -12,39 +12,83 @@ class SampledDataBuffer(object):
     # This is a fixed-length double queue for time/value pairs s.t. f(t)=y
     # Once initialized, it can be updated with a single time point and a set of values
     # taken at a given frequency.
-    # t is re-evaluated relative to the initialization time
+    # t is in int64 nanoseconds of the host's monotonic clock, as the distiller's timestamps
 
     def __init__(self, freq, dur):
         self.freq = freq
         self.dur = dur
-        self.y = np.zeros(self.freq*self.dur)
-        self.t = np.zeros(self.freq*self.dur)
-        self.start_time = datetime.datetime.now()
-        self.t1 = None
+        self.size = self.freq*self.dur
+        # Samples are written after the current window, in arrays twice its
+        # size: the window is moved back to the front only when they are full.
+        # Values are float32, as the wave samples of the distiller.
+        self.values = np.zeros(2*self.size, dtype=np.float32)
+        self.times = np.zeros(2*self.size, dtype=np.int64)
+        self.end = self.size
+        # Time of each sample of a packet after its first one (see reserve())
+        self.offsets = np.arange(self.size, dtype=np.int64) * 1000000000 // self.freq
         self.dropped_packets = 0
-
-    def rolling_append(self, _t0, values):
+        # Where the next packet of samples should start, to spot missing ones
+        self.next_t = None
+
+    # The window of the latest values and their times, as read-only views:
+    # later appends overwrite them, so copy what must outlive the next one
+    @property
+    def y(self):
+        return self.window(self.values)
+
+    @property
+    def t(self):
+        return self.window(self.times)
+
+    def window(self, array):
+        view = array[self.end-self.size:self.end]
+        view.flags.writeable = False
+        return view
+
+    def reserve(self, t0, length):
+        """
+        Appends length samples starting at t0 (ns) to the window: writes
+        their times, returns the slot of their values
+        """
+        if self.end + length > self.values.size:
+            keep = self.size - length
+            self.values[:keep] = self.values[self.end-keep:self.end]
+            self.times[:keep] = self.times[self.end-keep:self.end]
+            self.end = keep
+        self.end += length
+        np.add(self.offsets[:length], t0, out=self.times[self.end-length:self.end])
+
+        if length > 1:
+            duration = length * 1000000000 // self.freq
+
+            # A packet starting later than the previous one ended means packets were lost
+            if self.next_t is not None and t0 - self.next_t > duration // 2:
+                self.dropped_packets += round((t0 - self.next_t) / duration)
+            self.next_t = t0 + duration
+
+        return self.values[self.end-length:self.end]
+
+    def rolling_append(self, t0, values):
 
         if values is None:
             return
 
-        # Convert t0 to seconds since start_time
-        t0 = (_t0 - self.start_time).total_seconds()
-        if not self.t1:
-            self.t1 = t0
-        t0 -= self.t1
-
         length = values.size or 1  # For scalar
-        if length == 1:
-            times = t0
-        else:
-            sec_offset = length/self.freq
-            times = np.linspace(t0, t0+sec_offset, length)
+        self.reserve(t0, length)[:] = values
+
+    def store(self, t0, samples, ValueConversion):
+        """
+        Appends wave samples scaled with y = ax + b (see
+        IntellivueDistiller.convertValues), as rolling_append() of the
+        scaled samples, without intermediate arrays
+        """
+        if not samples.size:
+            return
 
-        self.y = np.roll(self.y, -length)
-        self.y[-length:] = values
-        self.t = np.roll(self.t, -length)
-        self.t[-length:] = times
+        a, b = ValueConversion
+        values = self.reserve(t0, samples.size)
+        np.multiply(samples, a, out=values, dtype=np.float32)
+        values += b
 
 class TelemetryStream(object):
     # This is an abstract class and/or factory that provides a consistent interface across
@@ -100,6 +144,34 @@ class TelemetryStream(object):
         # Read should echo data to self.logger at "info" level
         raise NotImplementedError
 
+    # asyncio interface: after 'await stream.aopen()', 'async for data in stream'
+    # yields every new sample as soon as it is decoded (no polling interval)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while 1:
+            data = await self.aread()
+            if data:
+                return data
+
+    async def arun(self):
+        # Async counterpart of run(): echo the results to the loggers
+        await self.aopen()
+        async for data in self:
+            pass
+
+    async def aopen(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def aclose(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def aread(self, *args, **kwargs):
+        # Like read(), but awaits new data instead of blocking
+        raise NotImplementedError
+
 
 class TelemetryEncoder(json.JSONEncoder):
     def default(self, o):